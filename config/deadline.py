@@ -0,0 +1,152 @@
+"""
+呼叫期限 (每次 Cloud Function 呼叫的剩餘時間)
+進入點 (line_webhook / process_document) 以函式逾時設定 (FUNCTION_TIMEOUT_SECONDS，與部署腳本的 --timeout 相同)
+建立期限，透過 contextvars 傳遞到同一次呼叫的所有階段 (公平排程器的工作執行緒會沿用排入時的 context)。
+
+- 網路呼叫的逾時取「原本的逾時」與「剩餘時間」中較小者 (timeout_for)，不會在函式被終止後仍等待
+- 每個階段開始前檢查剩餘時間是否足夠 (DEADLINE_STAGE_SECONDS 的預估值，上傳 / 下載再加上依大小估算的傳輸時間)；
+  不足時拋出 DeadlineExceeded，由呼叫端交給重試帳本，不開始一個會被中途終止的階段
+- 階段結束時已超過期限記為 deadline.<階段>.overrun，交給重試記為 deadline.<階段>.handoff，
+  呼叫結束時的剩餘時間記錄在 deadline.remaining_ms
+
+不在進入點內 (例如 scripts/retry_jobs.py、本地測試) 時沒有期限，逾時維持原本的值。
+"""
+
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+from config import metrics
+from config.env_manager import get_settings
+
+# 網路呼叫的最短逾時
+MIN_TIMEOUT_SECONDS = 0.5
+
+# 各階段開始前至少需要的剩餘秒數 (DEADLINE_STAGE_SECONDS 可覆寫個別階段)
+DEFAULT_STAGE_SECONDS = {
+    'download': 5,
+    'upload': 3,
+    'process': 20,
+    'extract': 3,
+    'save': 5,
+    'expand': 15,
+}
+
+
+def function_timeout_seconds() -> float:
+    """函式逾時 (FUNCTION_TIMEOUT_SECONDS，與部署腳本的 --timeout 相同)"""
+    return get_settings().get_float('FUNCTION_TIMEOUT_SECONDS', 60)
+
+
+def safety_seconds() -> float:
+    """保留給回應、寫入重試帳本與清理的時間 (DEADLINE_SAFETY_SECONDS)"""
+    return get_settings().get_float('DEADLINE_SAFETY_SECONDS', 3)
+
+
+def transfer_bytes_per_second() -> float:
+    """估算上傳 / 下載時間的傳輸速率 (DEADLINE_TRANSFER_BYTES_PER_SECOND)"""
+    return get_settings().get_float('DEADLINE_TRANSFER_BYTES_PER_SECOND', 10 * 1024 * 1024)
+
+
+def stage_seconds(stage: str) -> float:
+    """階段開始前至少需要的剩餘秒數"""
+    overrides = get_settings().get_json('DEADLINE_STAGE_SECONDS', {})
+    return overrides.get(stage, DEFAULT_STAGE_SECONDS.get(stage, 0))
+
+
+class DeadlineExceeded(RuntimeError):
+    """剩餘時間不足以開始階段 (尚未開始，可安全地交給重試)"""
+
+    def __init__(self, stage: str, remaining: float, required: float):
+        super().__init__(f"剩餘時間 {remaining:.1f} 秒不足以開始 {stage} (需要 {required:.1f} 秒)")
+        self.stage = stage
+
+
+class Deadline:
+    """單次呼叫的期限"""
+
+    def __init__(self, seconds: float, safety: Optional[float] = None):
+        safety = safety_seconds() if safety is None else safety
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds - safety
+
+    def remaining(self) -> float:
+        """剩餘秒數 (已扣除保留時間，不小於 0)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, cap: float) -> float:
+        """網路呼叫的逾時: 原本的逾時與剩餘時間中較小者"""
+        return max(MIN_TIMEOUT_SECONDS, min(cap, self.remaining()))
+
+    def check(self, stage: str, required: Optional[float] = None):
+        """
+        檢查剩餘時間是否足以開始階段
+
+        Raises:
+            DeadlineExceeded: 剩餘時間不足
+        """
+        required = stage_seconds(stage) if required is None else required
+        remaining = self.remaining()
+        if remaining < required:
+            metrics.increment(f"deadline.{stage}.handoff")
+            raise DeadlineExceeded(stage, remaining, required)
+
+    @contextmanager
+    def stage(self, name: str, required: Optional[float] = None):
+        """檢查剩餘時間後執行階段，結束時記錄耗時與是否超過期限"""
+        self.check(name, required)
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            metrics.observe(f"deadline.{name}.ms", (time.perf_counter() - started) * 1000)
+            if self.remaining() <= 0:
+                metrics.increment(f"deadline.{name}.overrun")
+                print(f"⏰ 階段 {name} 結束時已超過呼叫期限")
+
+
+class _Unbounded(Deadline):
+    """進入點以外 (重跑工具、本地測試) 沒有期限"""
+
+    def __init__(self):
+        super().__init__(float('inf'), 0)
+
+    def remaining(self) -> float:
+        return float('inf')
+
+
+_UNBOUNDED = _Unbounded()
+_current: contextvars.ContextVar = contextvars.ContextVar('invocation_deadline', default=_UNBOUNDED)
+
+
+@contextmanager
+def invocation(seconds: Optional[float] = None):
+    """進入點: 在此範圍內 (包含排入公平排程器的工作) current() 回傳本次呼叫的期限 (預設為函式逾時)"""
+    deadline = Deadline(function_timeout_seconds() if seconds is None else seconds)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+        metrics.observe('deadline.remaining_ms', deadline.remaining() * 1000)
+
+
+def current() -> Deadline:
+    """目前呼叫的期限"""
+    return _current.get()
+
+
+def timeout_for(cap: float) -> float:
+    """依目前呼叫的剩餘時間調整網路呼叫的逾時"""
+    return current().timeout(cap)
+
+
+def stage(name: str, required: Optional[float] = None):
+    """以目前呼叫的期限執行階段 (見 Deadline.stage)"""
+    return current().stage(name, required)
+
+
+def transfer_seconds(byte_count: int, stage_name: str) -> float:
+    """上傳 / 下載階段需要的秒數: 階段預估值加上依大小估算的傳輸時間"""
+    return stage_seconds(stage_name) + byte_count / transfer_bytes_per_second()
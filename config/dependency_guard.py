@@ -0,0 +1,382 @@
+"""
+外部相依服務防護 (斷路器 + 自適應並行數)
+LINE 內容 API、Cloud Storage 與 Document AI 變慢或失敗時，每次呼叫仍會等到 30 ~ 60 秒逾時，
+執行個體堆積、成本上升。每個相依服務以 Dependency 包裝呼叫:
+
+斷路器 (CircuitBreaker):
+  closed     正常呼叫；連續 failure_threshold 次失敗 (服務異常的例外、回傳值判定失敗或耗時超過 slow_ms) 後開啟
+  open       open_seconds 內直接拒絕 (拋出 DependencyUnavailable)，不等待逾時
+  half_open  開啟時間過後放行 half_open_probes 個探測呼叫，成功則關閉，失敗則重新開啟
+
+自適應並行數 (AdaptiveLimiter，AIMD):
+  耗時不超過 target_ms 的成功呼叫讓上限緩慢增加 (每輪約 +1)，失敗或變慢時上限減半 (每個耗時週期最多一次)；
+  沒有空位時最多等待 queue_seconds，之後拋出 DependencyUnavailable，由呼叫端延後處理 (回應非 2xx 讓事件重送)。
+
+只有代表服務異常的例外 (is_outage: 連線錯誤、逾時、HTTP 5xx / 429) 計為失敗；
+呼叫端本身的錯誤 (例如 CSV 產生失敗、ValueError、404) 照常拋出，但不影響斷路器與並行數上限。
+
+傳輸大型內容的呼叫 (transfer_bytes) 依 DEADLINE_TRANSFER_BYTES_PER_SECOND 扣除預估的傳輸時間後，
+才與 slow_ms / target_ms 比較，大型檔案的下載 / 上傳不會被視為變慢。
+
+各服務的設定可由 DEPENDENCY_SETTINGS (JSON) 覆寫，例如:
+  {"docai": {"slow_ms": 30000, "target_ms": 8000, "max_concurrency": 8}}
+設定重新載入時已建立的防護會套用新的設定，斷路器狀態與目前的並行數上限保留。
+目前狀態由 dependency_states() 取得 (webhook 的 /health 與 /metrics)，
+指標: dependency.<名稱>.calls / errors / rejected / shed / opened 與 dependency.<名稱>.latency_ms。
+"""
+
+import time
+import threading
+from typing import Callable, Dict, NamedTuple, Optional
+
+from config import metrics
+from config import deadline
+from config.env_manager import env_manager, get_settings
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class DependencySettings(NamedTuple):
+    """單一相依服務的設定"""
+    slow_ms: float                    # 超過此耗時的呼叫視為失敗 (斷路器)
+    target_ms: float                  # 自適應並行數的目標耗時
+    initial_concurrency: int
+    max_concurrency: int
+    min_concurrency: int = 1
+    # None 表示使用共用設定 (DEPENDENCY_FAILURE_THRESHOLD / DEPENDENCY_OPEN_SECONDS / DEPENDENCY_QUEUE_SECONDS)
+    failure_threshold: Optional[int] = None
+    open_seconds: Optional[float] = None
+    half_open_probes: int = 1
+    queue_seconds: Optional[float] = None
+
+
+# 預設設定 (依各服務正常情況下的耗時)
+DEFAULT_SETTINGS = {
+    'line': DependencySettings(slow_ms=15000, target_ms=3000, initial_concurrency=8, max_concurrency=32),
+    'gcs': DependencySettings(slow_ms=15000, target_ms=2000, initial_concurrency=16, max_concurrency=64),
+    'docai': DependencySettings(slow_ms=45000, target_ms=15000, initial_concurrency=4, max_concurrency=16),
+}
+
+
+class DependencyUnavailable(RuntimeError):
+    """相依服務的斷路器開啟或並行數已滿 (呼叫未執行)"""
+
+
+# 代表服務異常的例外類別 (第一次使用時依已安裝的套件建立)
+_outage_errors: Optional[tuple] = None
+
+
+def _load_outage_errors() -> tuple:
+    errors = [ConnectionError, TimeoutError]
+    try:
+        import requests
+        errors += [requests.ConnectionError, requests.Timeout]
+    except ImportError:
+        pass
+    try:
+        from google.api_core import exceptions as api_exceptions
+        # ServerError 涵蓋 5xx (含 ServiceUnavailable / DeadlineExceeded)
+        errors += [api_exceptions.ServerError, api_exceptions.TooManyRequests, api_exceptions.RetryError]
+    except ImportError:
+        pass
+    try:
+        from google.auth.exceptions import TransportError
+        errors.append(TransportError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def is_outage(error: BaseException) -> bool:
+    """例外是否代表相依服務異常 (連線錯誤、逾時、HTTP 5xx / 429)"""
+    global _outage_errors
+    if _outage_errors is None:
+        _outage_errors = _load_outage_errors()
+    if isinstance(error, _outage_errors):
+        return True
+    # requests 的 HTTPError (raise_for_status) 依狀態碼判斷
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(status, int) and (status >= 500 or status == 429)
+
+
+class CircuitBreaker:
+    """斷路器"""
+
+    def __init__(self, name: str, failure_threshold: int, open_seconds: float, half_open_probes: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def _refresh(self):
+        if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._transition(STATE_HALF_OPEN)
+            self._probes = 0
+
+    def _transition(self, state: str):
+        if state != self._state:
+            print(f"🔌 斷路器 {self.name}: {self._state} -> {state}")
+            self._state = state
+            if state == STATE_OPEN:
+                self._opened_at = self._clock()
+                metrics.increment(f"dependency.{self.name}.opened")
+
+    def allow(self) -> bool:
+        """是否放行一次呼叫 (half_open 時最多放行 half_open_probes 個探測)"""
+        with self._lock:
+            self._refresh()
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            return False
+
+    def cancel(self):
+        """放行後未實際呼叫 (例如並行數已滿)，歸還探測名額"""
+        with self._lock:
+            if self._state == STATE_HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record(self, ok: bool):
+        """記錄呼叫結果"""
+        with self._lock:
+            if ok:
+                self._failures = 0
+                if self._state == STATE_HALF_OPEN:
+                    self._transition(STATE_CLOSED)
+                return
+            self._failures += 1
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                self._transition(STATE_OPEN)
+
+
+class AdaptiveLimiter:
+    """AIMD 並行數上限"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, target_ms: float, backoff: float = 0.5,
+                 clock: Callable[[], float] = time.monotonic):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_ms = target_ms
+        self.backoff = backoff
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self, timeout: float) -> bool:
+        """取得一個空位，timeout 秒內沒有空位時回傳 False"""
+        deadline = self._clock() + timeout
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self._in_flight += 1
+            return True
+
+    def release(self, latency_ms: float, ok: bool):
+        """歸還空位並依結果調整上限"""
+        with self._condition:
+            self._in_flight -= 1
+            if ok and latency_ms <= self.target_ms:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+            else:
+                # 同時在途的呼叫會一起變慢，每個耗時週期只減半一次
+                now = self._clock()
+                if now - self._last_decrease >= latency_ms / 1000:
+                    self._limit = max(self.minimum, self._limit * self.backoff)
+                    self._last_decrease = now
+            self._condition.notify()
+
+    def reconfigure(self, minimum: int, maximum: int, target_ms: float):
+        """套用新的上下限與目標耗時 (目前的上限調整到新的範圍內)"""
+        with self._condition:
+            self.minimum = minimum
+            self.maximum = maximum
+            self.target_ms = target_ms
+            self._limit = min(maximum, max(minimum, self._limit))
+            self._condition.notify_all()
+
+
+class Dependency:
+    """以斷路器與自適應並行數保護的相依服務"""
+
+    def __init__(self, name: str, settings: DependencySettings, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.settings = settings
+        self.breaker = CircuitBreaker(name, settings.failure_threshold, settings.open_seconds,
+                                      settings.half_open_probes, clock)
+        self.limiter = AdaptiveLimiter(settings.initial_concurrency, settings.min_concurrency,
+                                       settings.max_concurrency, settings.target_ms, clock=clock)
+
+    def apply(self, settings: DependencySettings):
+        """套用新的設定 (設定重新載入時)，保留斷路器狀態與目前的並行數上限"""
+        self.settings = settings
+        self.breaker.failure_threshold = settings.failure_threshold
+        self.breaker.open_seconds = settings.open_seconds
+        self.breaker.half_open_probes = settings.half_open_probes
+        self.limiter.reconfigure(settings.min_concurrency, settings.max_concurrency, settings.target_ms)
+
+    def call(self, func: Callable, *args, is_failure: Optional[Callable] = None,
+             is_error_failure: Callable[[BaseException], bool] = is_outage, transfer_bytes: int = 0, **kwargs):
+        """
+        呼叫相依服務
+
+        Args:
+            func: 實際呼叫
+            is_failure: 依回傳值判斷失敗 (例如下載函式失敗時回傳 None)
+            is_error_failure: 依例外判斷失敗 (預設 is_outage)；其他例外照常拋出但不計為失敗
+            transfer_bytes: 本次呼叫傳輸的位元組數，判斷是否變慢時扣除預估的傳輸時間
+
+        Raises:
+            DependencyUnavailable: 斷路器開啟或並行數已滿 (func 未執行)
+        """
+        if not self.breaker.allow():
+            metrics.increment(f"dependency.{self.name}.rejected")
+            raise DependencyUnavailable(f"{self.name} 暫時無法使用 (斷路器開啟)")
+        if not self.limiter.acquire(self.settings.queue_seconds):
+            self.breaker.cancel()
+            metrics.increment(f"dependency.{self.name}.shed")
+            raise DependencyUnavailable(f"{self.name} 並行數已滿 ({self.limiter.limit})")
+
+        started = time.perf_counter()
+        ok = False
+        # 呼叫端本身的錯誤: 不代表服務健康與否，斷路器不記錄結果
+        neutral = False
+        try:
+            result = func(*args, **kwargs)
+            ok = not (is_failure and is_failure(result))
+            return result
+        except Exception as e:
+            neutral = not is_error_failure(e)
+            ok = neutral
+            raise
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            # 扣除預估的傳輸時間，只以服務本身的回應時間判斷是否變慢
+            service_ms = max(0.0, latency_ms - (transfer_bytes or 0) / deadline.transfer_bytes_per_second() * 1000)
+            if neutral:
+                self.breaker.cancel()
+            else:
+                self.breaker.record(ok and service_ms <= self.settings.slow_ms)
+            self.limiter.release(service_ms, ok)
+            metrics.increment(f"dependency.{self.name}.calls")
+            metrics.observe(f"dependency.{self.name}.latency_ms", latency_ms)
+            if not ok:
+                metrics.increment(f"dependency.{self.name}.errors")
+
+    def state(self) -> dict:
+        return {
+            'state': self.breaker.state,
+            'limit': self.limiter.limit,
+            'in_flight': self.limiter.in_flight,
+        }
+
+
+class _Unguarded:
+    """DEPENDENCY_GUARDS_ENABLED=false 時直接呼叫"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def call(self, func: Callable, *args, is_failure: Optional[Callable] = None,
+             is_error_failure: Callable[[BaseException], bool] = is_outage, transfer_bytes: int = 0, **kwargs):
+        return func(*args, **kwargs)
+
+    def state(self) -> dict:
+        return {'state': 'disabled'}
+
+
+def settings_for(name: str, settings=None) -> DependencySettings:
+    """
+    依設定快照取得相依服務的設定 (DEPENDENCY_SETTINGS 覆寫預設值，未指定的共用值取自 DEPENDENCY_*)
+
+    Args:
+        name: 相依服務名稱，未知的名稱以 gcs 的預設值為基礎
+        settings: 設定快照 (預設為目前的快照)
+    """
+    settings = settings or get_settings()
+    config = DEFAULT_SETTINGS.get(name, DEFAULT_SETTINGS['gcs'])
+    override = settings.get_json('DEPENDENCY_SETTINGS', {}).get(name)
+    if override:
+        config = config._replace(**override)
+    if config.failure_threshold is None:
+        config = config._replace(failure_threshold=settings.get_int('DEPENDENCY_FAILURE_THRESHOLD', 5))
+    if config.open_seconds is None:
+        config = config._replace(open_seconds=settings.get_float('DEPENDENCY_OPEN_SECONDS', 30))
+    if config.queue_seconds is None:
+        config = config._replace(queue_seconds=settings.get_float('DEPENDENCY_QUEUE_SECONDS', 1))
+    return config
+
+
+def _build(name: str, settings):
+    if settings.get_bool('DEPENDENCY_GUARDS_ENABLED', True):
+        return Dependency(name, settings_for(name, settings))
+    return _Unguarded(name)
+
+
+_dependencies: Dict[str, object] = {}
+_dependencies_lock = threading.Lock()
+
+
+def get_dependency(name: str):
+    """取得相依服務 (line / gcs / docai) 的共用防護"""
+    with _dependencies_lock:
+        dependency = _dependencies.get(name)
+        if dependency is None:
+            dependency = _build(name, get_settings())
+            _dependencies[name] = dependency
+        return dependency
+
+
+def _on_settings_reload(settings):
+    """設定重新載入時套用新的防護設定；啟用 / 停用防護時改建新的防護，進行中的呼叫不受影響"""
+    enabled = settings.get_bool('DEPENDENCY_GUARDS_ENABLED', True)
+    with _dependencies_lock:
+        for name, dependency in list(_dependencies.items()):
+            if enabled and isinstance(dependency, Dependency):
+                dependency.apply(settings_for(name, settings))
+            elif enabled != isinstance(dependency, Dependency):
+                _dependencies[name] = _build(name, settings)
+
+
+env_manager.on_reload(_on_settings_reload)
+
+
+def dependency_states() -> Dict[str, dict]:
+    """目前已使用的相依服務狀態 (健康檢查用)"""
+    with _dependencies_lock:
+        dependencies = list(_dependencies.values())
+    return {dependency.name: dependency.state() for dependency in dependencies}
+
+
+def is_degraded() -> bool:
+    """是否有相依服務的斷路器未關閉"""
+    return any(state['state'] in (STATE_OPEN, STATE_HALF_OPEN) for state in dependency_states().values())
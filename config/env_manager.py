@@ -1,90 +1,322 @@
 """
 環境變數管理工具
 支援本地開發、測試和生產環境的設定管理
+
+設定於載入時建立唯讀快照 (Settings)，之後的查詢不再呼叫 os.getenv，
+型別轉換結果也會快取。快照只會在收到 SIGHUP 或環境變數檔案修改時間變更時重新載入。
+
+各模組的調校設定 (准入控制、預先下載、相依服務防護、期限、效能分析、預熱等) 都在使用時經由 get_settings() 查詢，
+重新載入後下一次使用即生效；依設定建立的共用資源 (執行緒池、預算等) 由各模組以 on_reload() 註冊的回呼調整。
+以 require_settings() 登記的必需設定缺少時，重新載入的快照不會生效。
 """
 
 import os
+import json
+import time
+import signal
 import logging
+import threading
 from pathlib import Path
-from typing import Optional
-from dotenv import load_dotenv
+from types import MappingProxyType
+from dataclasses import dataclass, field
+from typing import Callable, List, Mapping, Optional
+from dotenv import dotenv_values
+
+# 專案根目錄 (部署時 config/ 會被複製到函式目錄，此時為函式目錄)
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# 檢查環境變數檔案是否變更的最小間隔 (秒)
+CONFIG_RELOAD_CHECK_SECONDS = float(os.getenv('CONFIG_RELOAD_CHECK_SECONDS', '5'))
+
+_TRUE_VALUES = ('true', '1', 'yes', 'on')
+
+
+@dataclass(frozen=True)
+class Settings:
+    """設定快照 (唯讀)"""
+    environment: str
+    line_channel_access_token: Optional[str]
+    line_channel_secret: Optional[str]
+    line_channel_id: Optional[str]
+    webhook_url: Optional[str]
+    gcp_project: Optional[str]
+    bucket_name: Optional[str]
+    processed_bucket_name: Optional[str]
+    docai_location: Optional[str]
+    docai_processor_id: Optional[str]
+    result_index_dsn: Optional[str]
+    auto_reply_enabled: bool
+    debug: bool
+    log_level: str
+    port: int
+    env_files: tuple
+    values: Mapping[str, str] = field(repr=False)
+    _cache: dict = field(default_factory=dict, repr=False, compare=False)
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """取得原始字串值"""
+        return self.values.get(key, default)
+
+    def _cached(self, kind: str, key: str, default, parse):
+        cache_key = (kind, key, default)
+        try:
+            return self._cache[cache_key]
+        except KeyError:
+            pass
+        raw = self.values.get(key)
+        value = default if raw is None else parse(raw, default, key)
+        self._cache[cache_key] = value
+        return value
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        """取得布林值 (結果會快取)"""
+        return self._cached('bool', key, default, _parse_bool)
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        """取得整數值 (結果會快取)"""
+        return self._cached('int', key, default, _parse_int)
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        """取得浮點數值 (結果會快取)"""
+        return self._cached('float', key, default, _parse_float)
+
+    def get_json(self, key: str, default=None):
+        """取得 JSON 值 (結果會快取，呼叫端不可修改回傳的物件)"""
+        value = self._cached('json', key, None, _parse_json)
+        return default if value is None else value
+
+
+def _parse_bool(raw, default, key):
+    return raw.strip().lower() in _TRUE_VALUES
+
+
+def _parse_int(raw, default, key):
+    try:
+        return int(raw)
+    except ValueError:
+        logging.warning(f"環境變數 {key} 無法轉換為整數，使用預設值 {default}")
+        return default
+
+
+def _parse_float(raw, default, key):
+    try:
+        return float(raw)
+    except ValueError:
+        logging.warning(f"環境變數 {key} 無法轉換為數值，使用預設值 {default}")
+        return default
+
+
+def _parse_json(raw, default, key):
+    if not raw.strip():
+        return default
+    try:
+        return json.loads(raw)
+    except ValueError:
+        logging.warning(f"環境變數 {key} 不是有效的 JSON，使用預設值")
+        return default
+
+
+def find_env_files(env_file: Optional[str] = None) -> List[Path]:
+    """
+    找出要載入的環境變數檔案 (依優先順序)
+
+    Args:
+        env_file: 指定的環境變數檔案路徑
+    """
+    if env_file:
+        return [Path(env_file)] if os.path.exists(env_file) else []
+
+    env = os.getenv('ENVIRONMENT', 'local')
+    names = [f'.env.{env}', '.env.local' if env == 'local' else None, '.env']
+    for directory in (Path.cwd(), PROJECT_ROOT):
+        for name in names:
+            if name and (directory / name).exists():
+                return [directory / name]
+    return []
+
+
+def build_settings(values: Mapping[str, str], env_files=()) -> Settings:
+    """由環境變數字典建立設定快照，並解析常用的設定值"""
+    values = MappingProxyType(dict(values))
+
+    def parse_bool(key, default):
+        return _parse_bool(values[key], default, key) if key in values else default
+
+    return Settings(
+        environment=values.get('ENVIRONMENT', 'local'),
+        line_channel_access_token=values.get('LINE_CHANNEL_ACCESS_TOKEN'),
+        line_channel_secret=values.get('LINE_CHANNEL_SECRET'),
+        line_channel_id=values.get('LINE_CHANNEL_ID'),
+        webhook_url=values.get('WEBHOOK_URL'),
+        gcp_project=values.get('GCP_PROJECT'),
+        bucket_name=values.get('BUCKET_NAME', 'line-document-processor-annular-welder'),
+        processed_bucket_name=values.get('PROCESSED_BUCKET_NAME'),
+        docai_location=values.get('DOCAI_LOCATION'),
+        docai_processor_id=values.get('DOCAI_PROCESSOR_ID'),
+        result_index_dsn=values.get('RESULT_INDEX_DSN') or None,
+        auto_reply_enabled=parse_bool('AUTO_REPLY_ENABLED', False),
+        debug=parse_bool('DEBUG', False),
+        log_level=values.get('LOG_LEVEL', 'INFO').upper(),
+        port=_parse_int(values.get('PORT', '8080'), 8080, 'PORT'),
+        env_files=tuple(str(path) for path in env_files),
+        values=values,
+    )
+
 
 class EnvironmentManager:
     """環境變數管理器"""
-    
+
     def __init__(self, env_file: Optional[str] = None):
         """
         初始化環境管理器
-        
+
         Args:
             env_file: 指定的環境變數檔案路徑
         """
         self.env_file = env_file
-        self.environment = self._load_environment()
-        
+        # 行程啟動時的環境變數優先於檔案內容 (與 load_dotenv 預設行為相同)
+        self._base_environ = dict(os.environ)
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[Settings], None]] = []
+        self._required = set()
+        self._warned_keys = set()
+        self._mtimes = {}
+        self._next_check = 0.0
+        self.settings = self._load(sync_environ=True)
+        self.environment = self.settings.environment
+
         # 設定日誌
         self._setup_logging()
-        
-    def _load_environment(self) -> str:
-        """載入環境變數"""
-        # 優先使用指定的環境變數檔案
-        if self.env_file and os.path.exists(self.env_file):
-            load_dotenv(self.env_file)
-            logging.info(f"載入指定的環境變數檔案: {self.env_file}")
-            return os.getenv('ENVIRONMENT', 'unknown')
-        
-        # 根據 ENVIRONMENT 變數載入對應的檔案
-        env = os.getenv('ENVIRONMENT', 'local')
-        
-        # 嘗試載入對應的環境變數檔案
-        env_files = [
-            f'.env.{env}',
-            '.env.local' if env == 'local' else None,
-            '.env'
-        ]
-        
+
+    def _load(self, sync_environ: bool = False) -> Settings:
+        """
+        讀取環境變數檔案並建立快照
+
+        Args:
+            sync_environ: 將檔案內容同步到 os.environ (僅在啟動時，讓 server.py 等直接以 os.getenv 讀取的程式取得相同的值)
+        """
+        env_files = find_env_files(self.env_file)
+        file_values = {}
         for env_file in env_files:
-            if env_file and os.path.exists(env_file):
-                load_dotenv(env_file)
-                logging.info(f"載入環境變數檔案: {env_file}")
-                break
-        
-        return env
-    
+            file_values.update({k: v for k, v in dotenv_values(env_file).items() if v is not None})
+            logging.info(f"載入環境變數檔案: {env_file}")
+
+        values = dict(self._base_environ)
+        for key, value in file_values.items():
+            if key not in self._base_environ:
+                values[key] = value
+                if sync_environ:
+                    os.environ[key] = value
+
+        self._mtimes = {str(path): _mtime(path) for path in env_files}
+        return build_settings(values, env_files)
+
     def _setup_logging(self):
         """設定日誌"""
-        log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
         logging.basicConfig(
-            level=getattr(logging, log_level),
+            level=getattr(logging, self.settings.log_level, logging.INFO),
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
-    
+
+    def missing_required(self, settings: Optional[Settings] = None) -> List[str]:
+        """列出快照 (預設為目前的快照) 缺少的必需設定"""
+        settings = settings or self.settings
+        return sorted(key for key in self._required if not settings.values.get(key))
+
+    def require(self, *keys: str):
+        """
+        登記必需的設定並檢查目前的快照；之後重新載入的快照缺少這些設定時不會生效
+
+        Args:
+            keys: 環境變數名稱
+
+        Raises:
+            ValueError: 部署在 Cloud Functions (有 FUNCTION_TARGET) 且目前的快照缺少必需設定
+        """
+        self._required.update(keys)
+        missing = self.missing_required()
+        if missing:
+            message = f"缺少必需的環境變數: {', '.join(missing)}"
+            logging.error(message)
+            if os.getenv('FUNCTION_TARGET'):
+                raise ValueError(message)
+
+    def reload(self) -> Settings:
+        """重新載入設定快照並通知已註冊的回呼；缺少必需設定時保留目前的快照"""
+        with self._lock:
+            settings = self._load()
+            missing = self.missing_required(settings)
+            if missing:
+                logging.error(f"重新載入的設定缺少必需的環境變數 {', '.join(missing)}，保留目前的設定")
+                return self.settings
+            self.settings = settings
+            self.environment = self.settings.environment
+            self._warned_keys.clear()
+            callbacks = list(self._callbacks)
+        logging.info("設定已重新載入")
+        for callback in callbacks:
+            callback(self.settings)
+        return self.settings
+
+    def override(self, **values) -> Settings:
+        """以指定值覆寫目前的快照並通知已註冊的回呼 (本地測試用，之後重新載入時仍保留這些值)"""
+        values = {key: str(value) for key, value in values.items()}
+        with self._lock:
+            self._base_environ.update(values)
+            self.settings = build_settings({**self.settings.values, **values}, self.settings.env_files)
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback(self.settings)
+        return self.settings
+
+    def maybe_reload(self) -> Settings:
+        """
+        若環境變數檔案修改時間變更則重新載入；檢查本身每 CONFIG_RELOAD_CHECK_SECONDS 最多一次
+
+        適合在每個請求開始時呼叫，平常只是一次時間比較。
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return self.settings
+        self._next_check = now + CONFIG_RELOAD_CHECK_SECONDS
+
+        current = {str(path): _mtime(path) for path in find_env_files(self.env_file)}
+        if current != self._mtimes:
+            return self.reload()
+        return self.settings
+
+    def on_reload(self, callback: Callable[[Settings], None]):
+        """註冊設定重新載入時的回呼 (例如重建客戶端)"""
+        self._callbacks.append(callback)
+
     def get(self, key: str, default: Optional[str] = None) -> str:
         """
         取得環境變數值
-        
+
         Args:
             key: 環境變數名稱
             default: 預設值
-            
+
         Returns:
             環境變數值
         """
-        value = os.getenv(key, default)
-        if value is None:
+        value = self.settings.values.get(key, default)
+        if value is None and key not in self._warned_keys:
+            # 每個變數只警告一次，避免熱路徑上重複輸出
+            self._warned_keys.add(key)
             logging.warning(f"環境變數 {key} 未設定")
         return value
-    
+
     def get_required(self, key: str) -> str:
         """
         取得必需的環境變數值
-        
+
         Args:
             key: 環境變數名稱
-            
+
         Returns:
             環境變數值
-            
+
         Raises:
             ValueError: 如果環境變數未設定
         """
@@ -92,70 +324,92 @@ class EnvironmentManager:
         if value is None:
             raise ValueError(f"必需的環境變數 {key} 未設定")
         return value
-    
+
     def get_bool(self, key: str, default: bool = False) -> bool:
         """
         取得布林值環境變數
-        
+
         Args:
             key: 環境變數名稱
             default: 預設值
-            
+
         Returns:
             布林值
         """
-        value = self.get(key, str(default)).lower()
-        return value in ('true', '1', 'yes', 'on')
-    
+        return self.settings.get_bool(key, default)
+
     def get_int(self, key: str, default: int = 0) -> int:
         """
         取得整數值環境變數
-        
+
         Args:
             key: 環境變數名稱
             default: 預設值
-            
+
         Returns:
             整數值
         """
-        try:
-            return int(self.get(key, str(default)))
-        except ValueError:
-            logging.warning(f"環境變數 {key} 無法轉換為整數，使用預設值 {default}")
-            return default
-    
+        return self.settings.get_int(key, default)
+
     def validate_required_vars(self, required_vars: list) -> bool:
         """
         驗證必需的環境變數
-        
+
         Args:
             required_vars: 必需的環境變數列表
-            
+
         Returns:
             是否所有必需的變數都已設定
         """
-        missing_vars = []
-        for var in required_vars:
-            if not self.get(var):
-                missing_vars.append(var)
-        
+        missing_vars = [var for var in required_vars if not self.settings.values.get(var)]
+
         if missing_vars:
             logging.error(f"缺少必需的環境變數: {', '.join(missing_vars)}")
             return False
-        
+
         return True
-    
+
     def print_environment_info(self):
         """印出環境資訊（不包含敏感資料）"""
         print(f"🌍 環境: {self.environment}")
         print(f"🔧 專案 ID: {self.get('GCP_PROJECT', '未設定')}")
         print(f"📦 原始檔案 Bucket: {self.get('BUCKET_NAME', '未設定')}")
         print(f"📦 處理後檔案 Bucket: {self.get('PROCESSED_BUCKET_NAME', '未設定')}")
-        print(f"🐛 Debug 模式: {self.get_bool('DEBUG')}")
-        print(f"📝 日誌等級: {self.get('LOG_LEVEL', 'INFO')}")
+        print(f"🐛 Debug 模式: {self.settings.debug}")
+        print(f"📝 日誌等級: {self.settings.log_level}")
+
+
+def _mtime(path) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _install_reload_signal():
+    """收到 SIGHUP 時重新載入設定 (僅限主執行緒且平台支援時)"""
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return
+    try:
+        signal.signal(signal.SIGHUP, lambda signum, frame: env_manager.reload())
+    except ValueError:
+        pass
 
 # 全域環境管理器實例
 env_manager = EnvironmentManager()
+_install_reload_signal()
+
+def get_settings() -> Settings:
+    """取得目前的設定快照"""
+    return env_manager.settings
+
+def reload_settings_if_changed() -> Settings:
+    """環境變數檔案變更時重新載入，回傳目前的設定快照"""
+    return env_manager.maybe_reload()
+
+def require_settings(*keys: str):
+    """登記必需設定的便捷函數"""
+    env_manager.require(*keys)
 
 def get_env(key: str, default: Optional[str] = None) -> str:
     """取得環境變數的便捷函數"""
@@ -0,0 +1,232 @@
+"""
+租戶公平排程器
+依租戶 (LINE 群組 / 聊天室 / 用戶) 分開排隊，以加權輪詢 (deficit round robin) 取出工作，
+並限制每個租戶同時執行的工作數，避免單一用戶一次丟進大量檔案時餓死其他用戶。
+
+每個工作的排隊耗時記錄在 scheduler.queue_ms 與 scheduler.tenant.<代號>.queue_ms 指標中
+(代號為租戶 ID 的雜湊，不直接輸出 LINE ID)。
+工作在排入時的 contextvars context 中執行 (例如 config.deadline 的呼叫期限)。
+設定重新載入時共用排程器套用新的工作執行緒數、租戶並行上限與權重，已排入的工作不受影響。
+"""
+
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+from config import metrics
+from config.env_manager import env_manager, get_settings
+
+ANONYMOUS_TENANT = 'anonymous'
+
+
+def tenant_of(source: Optional[dict]) -> str:
+    """由 LINE 事件的 source 取得租戶 ID (群組 / 聊天室優先於個人)"""
+    source = source or {}
+    return source.get('groupId') or source.get('roomId') or source.get('userId') or ANONYMOUS_TENANT
+
+
+def tenant_label(tenant: str) -> str:
+    """指標用的租戶代號 (保留類型字首 U/C/R 與 8 碼雜湊)"""
+    if tenant == ANONYMOUS_TENANT:
+        return tenant
+    return f"{tenant[:1]}{hashlib.sha1(tenant.encode('utf-8')).hexdigest()[:8]}"
+
+
+def parse_weights(config_json: Optional[str]) -> Dict[str, int]:
+    """解析租戶權重設定"""
+    if not config_json:
+        return {}
+    try:
+        return {tenant: max(1, int(weight)) for tenant, weight in json.loads(config_json).items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"⚠️ FAIR_TENANT_WEIGHTS 格式錯誤，忽略: {e}")
+        return {}
+
+
+class FairScheduler:
+    """租戶公平排程器"""
+
+    def __init__(self, workers: int = 4, tenant_concurrency: int = 2, weights: Optional[Dict[str, int]] = None):
+        """
+        初始化排程器
+
+        Args:
+            workers: 工作執行緒數 (整個執行個體同時執行的工作上限)
+            tenant_concurrency: 單一租戶同時執行的工作上限
+            weights: 租戶 ID -> 權重 (每輪可連續取出的工作數)
+        """
+        self.workers = max(1, workers)
+        self.tenant_concurrency = max(1, tenant_concurrency)
+        self.weights = weights or {}
+        self._condition = threading.Condition()
+        self._queues: Dict[str, deque] = {}
+        self._ring = deque()
+        self._deficit: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+        self._live = 0
+        self._spawned = 0
+        self._stopped = False
+
+    def _ensure_workers(self):
+        """補足工作執行緒 (呼叫端持有 _condition)"""
+        while self._live < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"fair-scheduler-{self._spawned}", daemon=True)
+            self._spawned += 1
+            self._live += 1
+            thread.start()
+
+    def reconfigure(self, workers: int, tenant_concurrency: int, weights: Optional[Dict[str, int]] = None):
+        """
+        套用新的設定 (設定重新載入時)
+
+        工作執行緒增加時於下次排入工作時補足；減少時多出的執行緒在完成目前的工作後結束。
+        """
+        with self._condition:
+            self.workers = max(1, workers)
+            self.tenant_concurrency = max(1, tenant_concurrency)
+            self.weights = weights or {}
+            self._condition.notify_all()
+
+    def submit(self, tenant: str, fn: Callable, *args, **kwargs) -> Future:
+        """
+        將工作排入租戶佇列
+
+        Args:
+            tenant: 租戶 ID
+            fn: 要執行的函式
+
+        Returns:
+            Future (可用 result() 等待結果)
+        """
+        future = Future()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("排程器已關閉")
+            self._ensure_workers()
+            queue = self._queues.get(tenant)
+            if queue is None:
+                queue = self._queues[tenant] = deque()
+                self._ring.append(tenant)
+            queue.append((future, contextvars.copy_context(), fn, args, kwargs, time.perf_counter()))
+            self._condition.notify()
+        return future
+
+    def run(self, tenant: str, fn: Callable, *args, **kwargs):
+        """排入工作並等待結果 (例外會原樣拋出)"""
+        return self.submit(tenant, fn, *args, **kwargs).result()
+
+    def _next_job(self):
+        """依加權輪詢取出下一個可執行的工作；所有租戶都達並行上限時回傳 None"""
+        for _ in range(len(self._ring)):
+            tenant = self._ring[0]
+            if self._running.get(tenant, 0) >= self.tenant_concurrency:
+                self._ring.rotate(-1)
+                continue
+
+            if self._deficit.get(tenant, 0) <= 0:
+                self._deficit[tenant] = self.weights.get(tenant, 1)
+            self._deficit[tenant] -= 1
+
+            queue = self._queues[tenant]
+            job = queue.popleft()
+            if not queue:
+                # 佇列清空的租戶移出輪詢，下次排入時重新加入隊尾
+                self._ring.popleft()
+                del self._queues[tenant]
+                self._deficit.pop(tenant, None)
+            elif self._deficit[tenant] <= 0:
+                self._ring.rotate(-1)
+            self._running[tenant] = self._running.get(tenant, 0) + 1
+            return tenant, job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                picked = None
+                while picked is None:
+                    if self._live > self.workers:
+                        # 執行緒數已調降
+                        self._live -= 1
+                        return
+                    picked = self._next_job()
+                    if picked is None:
+                        if self._stopped:
+                            self._live -= 1
+                            return
+                        self._condition.wait()
+
+            tenant, (future, context, fn, args, kwargs, enqueued_at) = picked
+            queue_ms = (time.perf_counter() - enqueued_at) * 1000
+            metrics.observe('scheduler.queue_ms', queue_ms)
+            metrics.observe(f"scheduler.tenant.{tenant_label(tenant)}.queue_ms", queue_ms)
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(context.run(fn, *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self._condition:
+                self._running[tenant] -= 1
+                if not self._running[tenant]:
+                    del self._running[tenant]
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """各租戶 (以代號表示) 目前排隊與執行中的工作數"""
+        with self._condition:
+            tenants = set(self._queues) | set(self._running)
+            return {
+                tenant_label(tenant): {
+                    'queued': len(self._queues.get(tenant, ())),
+                    'running': self._running.get(tenant, 0),
+                }
+                for tenant in tenants
+            }
+
+    def shutdown(self):
+        """停止接受新工作；已排入的工作執行完後結束執行緒"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+
+def scheduler_options(settings=None) -> dict:
+    """依設定快照取得排程器的參數 (FAIR_WORKERS / FAIR_TENANT_CONCURRENCY / FAIR_TENANT_WEIGHTS)"""
+    settings = settings or get_settings()
+    return {
+        'workers': settings.get_int('FAIR_WORKERS', 4),
+        'tenant_concurrency': settings.get_int('FAIR_TENANT_CONCURRENCY', 2),
+        # 租戶權重 (JSON，例如 {"Cxxxx": 3})，未列出的租戶權重為 1
+        'weights': parse_weights(settings.get('FAIR_TENANT_WEIGHTS')),
+    }
+
+
+_scheduler: Optional[FairScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FairScheduler:
+    """取得共用的排程器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler(**scheduler_options())
+    return _scheduler
+
+
+def _on_settings_reload(settings):
+    """設定重新載入時調整共用排程器"""
+    with _scheduler_lock:
+        scheduler = _scheduler
+    if scheduler is not None:
+        scheduler.reconfigure(**scheduler_options(settings))
+
+
+env_manager.on_reload(_on_settings_reload)
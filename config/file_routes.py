@@ -0,0 +1,235 @@
+"""
+檔案路由表
+webhook_receiver 與 document_processor 共用的副檔名 / MIME 類型對照，
+決定每種檔案的儲存路徑、使用的 Document AI 處理器 (可多個並行或先分類)，以及是否需要處理。
+
+engine 決定擷取方式 (見 document_processor/local_extract.py):
+  docai  - 一律送交 Document AI
+  auto   - 先嘗試本地擷取 (例如有文字層的 PDF)，無法擷取時送交 Document AI
+  local  - 只在本地擷取 (Office / 文字檔)，無法擷取時視為失敗
+  archive - 展開壓縮檔並上傳需要處理的成員 (見 document_processor/archive_expand.py)
+
+路由表於匯入時 (以及設定重新載入且 FILE_ROUTES_PATH 變更時) 編譯為查找字典，之後每次查詢皆為 O(1)。
+可透過 FILE_ROUTES_PATH 指定 JSON 檔覆寫或新增路由，格式同 DEFAULT_ROUTES。
+"""
+
+import os
+import json
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from config import metrics
+from config.env_manager import env_manager, get_settings
+
+
+class FileRoute(NamedTuple):
+    """單一路由設定"""
+    name: str                         # 路由名稱 (指標用)
+    file_type: str                    # 檔案分類，對應儲存路徑 line-{file_type}/
+    process: bool                     # 是否送交 Document AI
+    processors: Tuple[str, ...] = ()  # 處理器名稱或 ID，空白表示 default，多個時並行處理
+    classifier: Optional[str] = None  # 先經分類處理器判斷類別再分派
+    engine: str = 'docai'             # 擷取方式: docai / auto / local / archive
+
+    @property
+    def storage_prefix(self) -> str:
+        return f"line-{self.file_type}"
+
+
+# 路由名稱 -> 設定與副檔名/MIME 對照
+DEFAULT_ROUTES = {
+    'images': {
+        'file_type': 'images',
+        'process': True,
+        'extensions': {
+            '.jpg': 'image/jpeg',
+            '.jpeg': 'image/jpeg',
+            '.png': 'image/png',
+            '.gif': 'image/gif',
+            '.bmp': 'image/bmp',
+            '.webp': 'image/webp',
+            '.tif': 'image/tiff',
+            '.tiff': 'image/tiff',
+        },
+    },
+    'pdf': {
+        'file_type': 'documents',
+        'process': True,
+        'engine': 'auto',
+        'extensions': {'.pdf': 'application/pdf'},
+    },
+    'word': {
+        'file_type': 'documents',
+        'process': True,
+        'engine': 'local',
+        'extensions': {
+            '.doc': 'application/msword',
+            '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        },
+    },
+    'spreadsheets': {
+        'file_type': 'spreadsheets',
+        'process': True,
+        'engine': 'local',
+        'extensions': {
+            '.xls': 'application/vnd.ms-excel',
+            '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        },
+    },
+    'presentations': {
+        'file_type': 'presentations',
+        'process': True,
+        'engine': 'local',
+        'extensions': {
+            '.ppt': 'application/vnd.ms-powerpoint',
+            '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+        },
+    },
+    'text': {
+        'file_type': 'text',
+        'process': True,
+        'engine': 'local',
+        'extensions': {'.txt': 'text/plain', '.md': 'text/markdown'},
+    },
+    'archives': {
+        'file_type': 'archives',
+        'process': True,
+        'engine': 'archive',
+        'extensions': {
+            '.zip': 'application/zip',
+            '.rar': 'application/vnd.rar',
+            '.7z': 'application/x-7z-compressed',
+        },
+    },
+    'videos': {
+        'file_type': 'videos',
+        'process': False,
+        'extensions': {
+            '.mp4': 'video/mp4',
+            '.avi': 'video/x-msvideo',
+            '.mov': 'video/quicktime',
+            '.wmv': 'video/x-ms-wmv',
+        },
+    },
+    'audio': {
+        'file_type': 'audio',
+        'process': False,
+        'extensions': {
+            '.mp3': 'audio/mpeg',
+            '.wav': 'audio/wav',
+            '.flac': 'audio/flac',
+            '.m4a': 'audio/mp4',
+        },
+    },
+}
+
+OTHERS_ROUTE = FileRoute(name='others', file_type='others', process=False)
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+
+def _load_route_config(override_path: Optional[str] = None) -> dict:
+    """載入預設路由並套用 FILE_ROUTES_PATH 的覆寫設定"""
+    routes = {name: dict(config) for name, config in DEFAULT_ROUTES.items()}
+    if override_path:
+        with open(override_path, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+        for name, config in overrides.items():
+            routes.setdefault(name, {}).update(config)
+    return routes
+
+
+def _compile(routes: dict):
+    """將路由設定編譯為副檔名與 MIME 查找表"""
+    by_extension: Dict[str, tuple] = {}
+    by_mime: Dict[str, tuple] = {}
+    for name, config in routes.items():
+        processors = config.get('processors', config.get('processor') or ())
+        if isinstance(processors, str):
+            processors = (processors,)
+        route = FileRoute(
+            name=name,
+            file_type=config.get('file_type', name),
+            process=bool(config.get('process', False)),
+            processors=tuple(processors),
+            classifier=config.get('classifier'),
+            engine=config.get('engine', 'docai'),
+        )
+        for extension, mime_type in config.get('extensions', {}).items():
+            entry = (route, mime_type)
+            by_extension[extension.lower()] = entry
+            by_mime.setdefault(mime_type, (route, extension.lower()))
+    return by_extension, by_mime
+
+
+_routes_path = get_settings().get('FILE_ROUTES_PATH')
+_BY_EXTENSION, _BY_MIME = _compile(_load_route_config(_routes_path))
+
+
+def _on_settings_reload(settings):
+    """FILE_ROUTES_PATH 變更時重新編譯查找表 (讀取失敗時保留原本的路由)"""
+    global _routes_path, _BY_EXTENSION, _BY_MIME
+    override_path = settings.get('FILE_ROUTES_PATH')
+    if override_path == _routes_path:
+        return
+    try:
+        tables = _compile(_load_route_config(override_path))
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 無法載入檔案路由設定 {override_path}，保留原本的路由: {e}")
+        return
+    _routes_path = override_path
+    _BY_EXTENSION, _BY_MIME = tables
+
+
+env_manager.on_reload(_on_settings_reload)
+
+
+def _extension_of(file_name: str) -> str:
+    return os.path.splitext(file_name or '')[1].lower()
+
+
+def _normalize_mime(content_type: Optional[str]) -> str:
+    return (content_type or '').split(';', 1)[0].strip().lower()
+
+
+def resolve_route(file_name: str, content_type: Optional[str] = None) -> FileRoute:
+    """
+    依副檔名 (優先) 或 MIME 類型取得路由
+
+    Args:
+        file_name: 檔案名稱
+        content_type: 內容類型 (可選)
+
+    Returns:
+        路由設定，找不到時回傳 OTHERS_ROUTE
+    """
+    entry = _BY_EXTENSION.get(_extension_of(file_name))
+    if entry:
+        return entry[0]
+    entry = _BY_MIME.get(_normalize_mime(content_type))
+    if entry:
+        return entry[0]
+    return OTHERS_ROUTE
+
+
+def get_mime_type(file_name: str, content_type: Optional[str] = None) -> str:
+    """依副檔名取得 MIME 類型，找不到時使用傳入的內容類型"""
+    entry = _BY_EXTENSION.get(_extension_of(file_name))
+    if entry:
+        return entry[1]
+    return _normalize_mime(content_type) or DEFAULT_MIME_TYPE
+
+
+def extension_for_mime(content_type: Optional[str], default: str = '') -> str:
+    """依 MIME 類型取得副檔名 (例如 image/png -> .png)"""
+    entry = _BY_MIME.get(_normalize_mime(content_type))
+    return entry[1] if entry else default
+
+
+def record_route(route: FileRoute, action: str):
+    """
+    記錄路由計數
+
+    Args:
+        route: 路由設定
+        action: 動作名稱，例如 uploaded / processed / skipped
+    """
+    metrics.increment(f"route.{route.name}.{action}")
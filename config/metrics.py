@@ -0,0 +1,72 @@
+"""
+程序內指標收集
+提供執行緒安全的計數器與耗時統計，供健康檢查與本地效能測試輸出
+"""
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_observations = {}
+
+
+def increment(name: str, value: int = 1):
+    """
+    累加計數器
+
+    Args:
+        name: 指標名稱，以點分隔，例如 route.images.processed
+        value: 累加值
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float):
+    """
+    記錄一筆觀測值 (例如耗時毫秒)，保留次數、總和與最大值
+
+    Args:
+        name: 指標名稱
+        value: 觀測值
+    """
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None:
+            _observations[name] = {'count': 1, 'sum': value, 'max': value}
+        else:
+            stats['count'] += 1
+            stats['sum'] += value
+            if value > stats['max']:
+                stats['max'] = value
+
+
+def snapshot(prefix: str = '') -> dict:
+    """
+    取得目前所有指標
+
+    Args:
+        prefix: 只回傳指定前綴的指標
+
+    Returns:
+        {'counters': {...}, 'observations': {...}}
+    """
+    with _lock:
+        counters = {k: v for k, v in _counters.items() if k.startswith(prefix)}
+        observations = {}
+        for name, stats in _observations.items():
+            if name.startswith(prefix):
+                observations[name] = {
+                    'count': stats['count'],
+                    'avg': round(stats['sum'] / stats['count'], 3),
+                    'max': round(stats['max'], 3),
+                }
+    return {'counters': counters, 'observations': observations}
+
+
+def reset():
+    """清除所有指標 (測試用)"""
+    with _lock:
+        _counters.clear()
+        _observations.clear()
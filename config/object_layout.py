@@ -0,0 +1,221 @@
+"""
+Cloud Storage 物件命名規則
+webhook_receiver (上傳的原始檔) 與 document_processor (處理結果) 共用。
+
+partitioned (預設):
+  {分類}/{yyyy}/{mm}/{dd}/{分片}/{內容雜湊前 16 碼}-{租戶標籤}_{檔名}
+  - 日期分區: 列出某一天的物件只需列出單一前綴，不必掃描整個 bucket
+  - 分片: 內容雜湊前兩碼 (256 個)，同一天的寫入分散在不同前綴，不會集中在依時間遞增的名稱
+  - 內容雜湊: 內容的 MD5 (hex，與 Cloud Storage 的 md5Hash 相同)，遷移既有物件時不必下載內容
+  - 租戶標籤: 租戶 ID 的 MD5 前 8 碼 (不在名稱中暴露 LINE ID)，不同租戶在同一天上傳相同內容與檔名時
+    不會寫入同一個物件而覆蓋彼此的 metadata 與結果歸屬；沒有租戶時 (遷移的舊物件) 省略 "-{租戶標籤}"
+    處理結果沿用原始檔的租戶標籤
+  每個分區可產生 _manifest.jsonl (scripts/object_layout.py manifest)，讀取一次即可取得當天所有物件。
+
+flat (舊格式):
+  原始檔 line-{類型}/{檔名}；處理結果 {時間}_{檔名}.json / .csv 放在 bucket 根目錄
+"""
+
+import os
+import re
+import json
+import base64
+import hashlib
+from datetime import datetime, date, timedelta
+from typing import Iterator, List, NamedTuple, Optional
+
+from config.env_manager import get_settings
+
+# 處理結果的分類 (processed bucket 內的第一層)
+RESULTS_CATEGORY = 'results'
+MANIFEST_NAME = '_manifest.jsonl'
+CONTENT_HASH_DIGITS = 16
+TENANT_LABEL_DIGITS = 8
+
+_NAME_PATTERN = re.compile(
+    r'^(?P<category>[^/]+)/(?P<year>\d{4})/(?P<month>\d{2})/(?P<day>\d{2})/'
+    r'(?P<shard>[0-9a-f]+)/(?P<hash>[0-9a-f]{%d})(?:-(?P<tenant>[0-9a-f]{%d}))?_(?P<file_name>[^/]+)$'
+    % (CONTENT_HASH_DIGITS, TENANT_LABEL_DIGITS)
+)
+
+
+def is_partitioned() -> bool:
+    """目前的命名規則是否為 partitioned (OBJECT_LAYOUT)"""
+    return get_settings().get('OBJECT_LAYOUT', 'partitioned') == 'partitioned'
+
+
+class ObjectKey(NamedTuple):
+    """partitioned 物件名稱的組成"""
+    category: str
+    day: date
+    shard: str
+    content_hash: str
+    file_name: str
+    tenant: Optional[str] = None      # 租戶標籤 (舊物件沒有)
+
+
+def file_md5(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """計算檔案內容的 MD5 (hex)"""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tenant_label(tenant_id: Optional[str]) -> Optional[str]:
+    """租戶在物件名稱中的標籤 (租戶 ID 的 MD5 前 8 碼；沒有租戶時回傳 None)"""
+    if not tenant_id:
+        return None
+    return hashlib.md5(tenant_id.encode('utf-8')).hexdigest()[:TENANT_LABEL_DIGITS]
+
+
+def md5_hex(md5_base64: Optional[str]) -> Optional[str]:
+    """將 Cloud Storage 的 md5Hash (base64) 轉為 hex"""
+    if not md5_base64:
+        return None
+    return base64.b64decode(md5_base64).hex()
+
+
+def partition_prefix(category: str, day: date) -> str:
+    """某個分類某一天的前綴 (以 / 結尾)"""
+    return f"{category}/{day:%Y/%m/%d}/"
+
+
+def object_name(category: str, file_name: str, content_hash: str, when: Optional[datetime] = None,
+                tenant: Optional[str] = None) -> str:
+    """
+    產生 partitioned 物件名稱
+
+    Args:
+        category: 分類 (例如 line-images、results)
+        file_name: 原始檔名 (不含路徑)
+        content_hash: 內容雜湊 (hex)
+        when: 分區日期 (預設為現在)
+        tenant: 租戶標籤 (tenant_label 的結果；None 時省略)
+    """
+    when = when or datetime.now()
+    content_hash = content_hash.lower()
+    shard = content_hash[:get_settings().get_int('OBJECT_SHARD_DIGITS', 2)]
+    stem = content_hash[:CONTENT_HASH_DIGITS] + (f"-{tenant}" if tenant else '')
+    return f"{partition_prefix(category, when)}{shard}/{stem}_{os.path.basename(file_name)}"
+
+
+def parse_object_name(name: str) -> Optional[ObjectKey]:
+    """解析 partitioned 物件名稱 (不符合格式時回傳 None)"""
+    match = _NAME_PATTERN.match(name)
+    if not match:
+        return None
+    return ObjectKey(
+        category=match['category'],
+        day=date(int(match['year']), int(match['month']), int(match['day'])),
+        shard=match['shard'],
+        content_hash=match['hash'],
+        file_name=match['file_name'],
+        tenant=match['tenant'],
+    )
+
+
+def original_file_name(name: str) -> str:
+    """由物件名稱取得原始檔名 (partitioned 名稱去掉分區與雜湊，其他格式取 basename)"""
+    key = parse_object_name(name)
+    return key.file_name if key else os.path.basename(name)
+
+
+def upload_object_name(storage_prefix: str, file_name: str, file_path: str, tenant_id: Optional[str] = None) -> str:
+    """webhook 上傳原始檔的物件名稱 (依 OBJECT_LAYOUT)"""
+    if not is_partitioned():
+        return f"{storage_prefix}/{file_name}"
+    return object_name(storage_prefix, file_name, file_md5(file_path), tenant=tenant_label(tenant_id))
+
+
+def content_object_name(storage_prefix: str, file_name: str, content_hash: str,
+                        tenant_id: Optional[str] = None) -> str:
+    """已知內容 MD5 (hex) 時的原始檔物件名稱 (依 OBJECT_LAYOUT，例如壓縮檔展開的成員)"""
+    if not is_partitioned():
+        return f"{storage_prefix}/{os.path.basename(file_name)}"
+    return object_name(storage_prefix, file_name, content_hash, tenant=tenant_label(tenant_id))
+
+
+def result_base_name(source_name: str, content_hash: Optional[str], timestamp: Optional[datetime] = None) -> str:
+    """
+    處理結果的物件名稱 (不含 .json / .csv 等副檔名，依 OBJECT_LAYOUT)
+
+    Args:
+        source_name: 原始檔的物件名稱
+        content_hash: 原始檔的內容雜湊 (hex)；沒有時使用舊格式
+        timestamp: 處理時間 (預設為現在)
+    """
+    timestamp = timestamp or datetime.now()
+    if not is_partitioned() or not content_hash:
+        return f"{timestamp:%Y-%m-%d_%H-%M-%S}_{source_name}"
+    key = parse_object_name(source_name)
+    return object_name(RESULTS_CATEGORY, original_file_name(source_name), content_hash, timestamp,
+                       tenant=key.tenant if key else None)
+
+
+def find_results(bucket, source_name: str, days: int = 2) -> List[str]:
+    """
+    找出原始檔 (partitioned 名稱) 的處理結果物件
+
+    處理結果以原始檔的內容雜湊命名，日期為處理當天；通常與上傳同一天，跨午夜時為隔天，
+    因此只需列出 days 個日期下的單一名稱前綴。
+
+    Returns:
+        結果物件名稱 (原始結果與 CSV)；原始檔不是 partitioned 名稱或尚未處理時回傳空列表
+    """
+    key = parse_object_name(source_name)
+    if not key:
+        return []
+    names = []
+    for offset in range(days):
+        base = object_name(RESULTS_CATEGORY, key.file_name, key.content_hash, key.day + timedelta(days=offset),
+                           tenant=key.tenant)
+        names.extend(blob.name for blob in bucket.list_blobs(prefix=base + '.'))
+        if names:
+            break
+    return names
+
+
+def list_partition(bucket, category: str, day: date, use_manifest: bool = True) -> List[dict]:
+    """
+    列出某個分類某一天的物件
+
+    有 manifest 時只讀取一個物件，否則列出單一日期前綴 (不掃描整個 bucket)
+
+    Returns:
+        [{'name', 'size', 'md5', 'updated'}]
+    """
+    prefix = partition_prefix(category, day)
+    if use_manifest:
+        manifest = bucket.blob(prefix + MANIFEST_NAME)
+        if manifest.exists():
+            return [json.loads(line) for line in manifest.download_as_text().splitlines() if line]
+    return list(iter_partition_objects(bucket, prefix))
+
+
+def iter_partition_objects(bucket, prefix: str) -> Iterator[dict]:
+    """列出前綴下的物件 (不含 manifest)"""
+    for blob in bucket.list_blobs(prefix=prefix):
+        if blob.name.endswith('/' + MANIFEST_NAME):
+            continue
+        yield {
+            'name': blob.name,
+            'size': blob.size,
+            'md5': md5_hex(blob.md5_hash),
+            'updated': blob.updated.isoformat() if blob.updated else None,
+        }
+
+
+def write_manifest(bucket, category: str, day: date) -> int:
+    """
+    列出分區內的物件並寫入 _manifest.jsonl (每行一個物件)
+
+    Returns:
+        manifest 內的物件數
+    """
+    prefix = partition_prefix(category, day)
+    entries = list(iter_partition_objects(bucket, prefix))
+    body = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries)
+    bucket.blob(prefix + MANIFEST_NAME).upload_from_string(body, content_type='application/x-ndjson')
+    return len(entries)
@@ -0,0 +1,371 @@
+"""
+請求層級的取樣效能分析 (預設關閉)
+進入點 (line_webhook / process_document) 以 request() 決定本次呼叫是否分析，交給其他執行緒的工作
+(公平排程器執行的 handle_event / run_document_job、預先下載) 以 attached() 包裝後加入同一個分析。
+
+- 觸發方式: 依 PROFILE_SAMPLE_RATE 隨機取樣，或請求帶有與 PROFILE_HEADER_TOKEN 相同的 X-Profile-Token 標頭；
+  以標頭觸發時上傳的物件會帶有 line_profile metadata，文件處理器處理同一個檔案時也會分析
+- 分析方式 (PROFILE_ENGINE): cprofile 記錄每個函式的呼叫次數與耗時；
+  stack 每 PROFILE_STACK_INTERVAL_MS 毫秒取樣一次呼叫堆疊 (負擔較低，輸出可直接畫火焰圖)
+- 記憶體配置 (PROFILE_TRACEMALLOC=true): 以 tracemalloc 記錄峰值與配置最多的程式位置 (整個行程同時只有一個分析會啟用)
+- 輸出 (PROFILE_OUTPUT): 本地目錄或 gs://bucket/prefix，每個分析一個資料檔 (.prof / .stacks) 與一個中繼資料檔 (.json)，
+  以 scripts/profile_report.py 彙整
+
+未設定取樣率與標頭 token 時，進入點與 attached() 只做一次布林判斷 (ENABLED 於設定重新載入時更新)；
+同時進行的分析數量以 PROFILE_MAX_CONCURRENT 限制。
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import socket
+import marshal
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+from config import metrics
+from config.env_manager import env_manager, get_settings
+
+PROFILE_HEADER = 'X-Profile-Token'
+# 以標頭觸發時寫入上傳物件的 metadata，文件處理器據此分析同一個檔案
+PROFILE_METADATA_KEY = 'line_profile'
+ENGINES = ('cprofile', 'stack')
+
+
+def default_output() -> str:
+    """分析結果的預設輸出位置 (PROFILE_OUTPUT)"""
+    return get_settings().get('PROFILE_OUTPUT', '/tmp/profiles')
+
+
+def _apply_settings(settings):
+    """依設定快照更新是否啟用與同時分析數上限 (匯入時與設定重新載入時)"""
+    global ENABLED, _max_concurrent, _slots
+    ENABLED = settings.get_float('PROFILE_SAMPLE_RATE', 0) > 0 or bool(settings.get('PROFILE_HEADER_TOKEN'))
+    max_concurrent = max(1, settings.get_int('PROFILE_MAX_CONCURRENT', 1))
+    if max_concurrent != _max_concurrent:
+        # 進行中的分析歸還到原本的 semaphore
+        _max_concurrent = max_concurrent
+        _slots = threading.BoundedSemaphore(max_concurrent)
+
+
+ENABLED = False
+_max_concurrent = 0
+_slots = None
+_apply_settings(get_settings())
+env_manager.on_reload(_apply_settings)
+
+_current: contextvars.ContextVar = contextvars.ContextVar('profile_session', default=None)
+_storage_client = None
+
+
+class ProfileSession:
+    """單次呼叫的分析 (可由多個執行緒加入)"""
+
+    def __init__(self, kind: str, trigger: str, engine: Optional[str] = None, metadata: Optional[dict] = None):
+        self.kind = kind
+        self.trigger = trigger
+        engine = engine or get_settings().get('PROFILE_ENGINE', 'cprofile').lower()
+        self.engine = engine if engine in ENGINES else 'cprofile'
+        self.metadata = dict(metadata or {})
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._threads = set()
+        self._profiles = []
+        self._stacks = Counter()
+        self._samples = 0
+        self._sampler = None
+        self._stopped = threading.Event()
+        self._owns_tracemalloc = False
+
+    def start(self):
+        """開始記憶體追蹤與堆疊取樣"""
+        settings = get_settings()
+        if settings.get_bool('PROFILE_TRACEMALLOC') and not tracemalloc.is_tracing():
+            tracemalloc.start(settings.get_int('PROFILE_TRACEMALLOC_FRAMES', 10))
+            self._owns_tracemalloc = True
+        if self.engine == 'stack':
+            self._sampler = threading.Thread(target=self._sample_loop, name='profile-sampler', daemon=True)
+            self._sampler.start()
+
+    @contextmanager
+    def thread(self):
+        """分析目前執行緒在此範圍內的執行 (同一執行緒重複加入時不重複記錄)"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            if thread_id in self._threads:
+                nested = True
+            else:
+                nested = False
+                self._threads.add(thread_id)
+        if nested:
+            yield self
+            return
+        profile = None
+        if self.engine == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            yield self
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._threads.discard(thread_id)
+                if profile is not None:
+                    self._profiles.append(profile)
+
+    def _sample_loop(self):
+        interval = get_settings().get_float('PROFILE_STACK_INTERVAL_MS', 5) / 1000
+        while not self._stopped.wait(interval):
+            with self._lock:
+                thread_ids = list(self._threads)
+            if not thread_ids:
+                continue
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self._stacks[_collapse(frame)] += 1
+                    self._samples += 1
+
+    def finish(self) -> dict:
+        """
+        停止分析並整理結果
+
+        Returns:
+            {'data': 資料檔內容 (bytes), 'suffix': 副檔名, 'meta': 中繼資料}
+        """
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+        meta = {
+            'kind': self.kind,
+            'trigger': self.trigger,
+            'engine': self.engine,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(duration_ms, 1),
+            'pid': os.getpid(),
+            'host': os.getenv('K_REVISION') or socket.gethostname(),
+            'metadata': self.metadata,
+        }
+        if self._owns_tracemalloc:
+            top = get_settings().get_int('PROFILE_TRACEMALLOC_TOP', 30)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            meta['tracemalloc'] = {
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'top': [{'where': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                         'size': stat.size, 'count': stat.count}
+                        for stat in snapshot.statistics('lineno')[:top]],
+            }
+
+        if self.engine == 'stack':
+            meta['samples'] = self._samples
+            data = ''.join(f"{stack} {count}\n" for stack, count in self._stacks.most_common()).encode('utf-8')
+            return {'data': data, 'suffix': '.stacks', 'meta': meta}
+
+        stats = None
+        for profile in self._profiles:
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        meta['threads'] = len(self._profiles)
+        return {'data': marshal.dumps(stats.stats if stats else {}), 'suffix': '.prof', 'meta': meta}
+
+
+def _collapse(frame) -> str:
+    """將呼叫堆疊轉成 collapsed stack 格式 (由外而內，以分號分隔)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def trigger_for(headers=None, forced: bool = False) -> Optional[str]:
+    """
+    決定本次呼叫是否分析
+
+    Args:
+        headers: 請求標頭 (Webhook)
+        forced: 上游已要求分析 (物件帶有 line_profile metadata)
+
+    Returns:
+        觸發方式 ('header' / 'forced' / 'sample')，不分析時為 None
+    """
+    settings = get_settings()
+    header_token = settings.get('PROFILE_HEADER_TOKEN')
+    if header_token:
+        if headers is not None and hmac.compare_digest(
+                headers.get(PROFILE_HEADER, '').encode('utf-8'), header_token.encode('utf-8')):
+            return 'header'
+        if forced:
+            return 'forced'
+    sample_rate = settings.get_float('PROFILE_SAMPLE_RATE', 0)
+    if sample_rate > 0 and random.random() < sample_rate:
+        return 'sample'
+    return None
+
+
+@contextmanager
+def request(kind: str, headers=None, forced: bool = False, **metadata):
+    """
+    進入點: 取樣到時在此範圍內分析目前執行緒，並讓 attach() 加入的工作執行緒一併分析
+
+    Args:
+        kind: 進入點名稱 (webhook / document)，決定輸出路徑
+        headers: 請求標頭
+        forced: 上游已要求分析
+        metadata: 寫入中繼資料檔的欄位 (可再以 annotate() 補充)
+    """
+    if not ENABLED:
+        yield None
+        return
+    trigger = trigger_for(headers, forced)
+    if trigger is None:
+        yield None
+        return
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        metrics.increment('profile.skipped_busy')
+        yield None
+        return
+
+    session = ProfileSession(kind, trigger, metadata=metadata)
+    token = _current.set(session)
+    try:
+        session.start()
+        with session.thread():
+            yield session
+    finally:
+        _current.reset(token)
+        try:
+            result = session.finish()
+        finally:
+            slots.release()
+        metrics.increment(f"profile.{kind}.{trigger}")
+        write_profile(result)
+
+
+@contextmanager
+def attach():
+    """在工作執行緒中加入目前呼叫的分析 (沒有進行中的分析時不做任何事)"""
+    session = _current.get() if ENABLED else None
+    if session is None:
+        yield None
+        return
+    with session.thread():
+        yield session
+
+
+def attached(fn):
+    """包裝要交給其他執行緒 (公平排程器、預先下載) 執行的函式，使其加入目前呼叫的分析"""
+    if not ENABLED or _current.get() is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with attach():
+            return fn(*args, **kwargs)
+    return run
+
+
+def annotate(**fields):
+    """
+    補充目前分析的中繼資料 (例如訊息類型與副檔名，供彙整時分組)
+    同一次呼叫有多個事件且值不同時保留為清單
+    """
+    session = _current.get() if ENABLED else None
+    if session is None:
+        return
+    with session._lock:
+        for key, value in fields.items():
+            previous = session.metadata.get(key)
+            if key not in session.metadata or previous == value:
+                session.metadata[key] = value
+            elif isinstance(previous, list):
+                if value not in previous:
+                    previous.append(value)
+            else:
+                session.metadata[key] = [previous, value]
+
+
+def propagate() -> bool:
+    """目前呼叫是否以標頭觸發分析 (上傳的物件應帶有 line_profile metadata)"""
+    session = _current.get() if ENABLED else None
+    return session is not None and session.trigger == 'header'
+
+
+def profile_name(meta: dict) -> str:
+    """輸出檔名 (不含副檔名): <進入點>/<日期>/<時間>-<pid>-<隨機碼>"""
+    started_at = datetime.fromisoformat(meta['started_at'])
+    return (f"{meta['kind']}/{started_at:%Y-%m-%d}/"
+            f"{started_at:%H%M%S}-{meta['pid']}-{uuid.uuid4().hex[:8]}")
+
+
+def _get_storage_client():
+    global _storage_client
+    if _storage_client is None:
+        try:
+            from google.cloud import storage
+        except ImportError:
+            raise ImportError("輸出分析結果到 Cloud Storage 需要 google-cloud-storage，請執行: pip install google-cloud-storage")
+        _storage_client = storage.Client()
+    return _storage_client
+
+
+def write_profile(result: dict, output: str = None) -> Optional[str]:
+    """
+    寫出分析結果 (失敗時只記錄，不影響請求)
+
+    Args:
+        result: ProfileSession.finish() 的回傳值
+        output: 本地目錄或 gs://bucket/prefix，預設為 PROFILE_OUTPUT (default_output())
+
+    Returns:
+        資料檔位置，失敗時為 None
+    """
+    output = output or default_output()
+    name = profile_name(result['meta'])
+    meta = json.dumps(result['meta'], ensure_ascii=False).encode('utf-8')
+    try:
+        if output.startswith('gs://'):
+            bucket_name, _, prefix = output[5:].partition('/')
+            base = f"{prefix.strip('/')}/{name}" if prefix.strip('/') else name
+            bucket = _get_storage_client().bucket(bucket_name)
+            bucket.blob(f"{base}{result['suffix']}").upload_from_string(result['data'],
+                                                                       content_type='application/octet-stream')
+            bucket.blob(f"{base}.json").upload_from_string(meta, content_type='application/json')
+            location = f"gs://{bucket_name}/{base}{result['suffix']}"
+        else:
+            base = os.path.join(output, name)
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            with open(f"{base}{result['suffix']}", 'wb') as f:
+                f.write(result['data'])
+            with open(f"{base}.json", 'wb') as f:
+                f.write(meta)
+            location = f"{base}{result['suffix']}"
+    except Exception as e:
+        metrics.increment('profile.write_failed')
+        print(f"⚠️ 寫出效能分析結果失敗: {e}")
+        return None
+    metrics.increment('profile.written')
+    print(f"🔬 效能分析 ({result['meta']['trigger']}, {result['meta']['duration_ms']:.0f} ms) 已寫出: {location}")
+    return location
@@ -0,0 +1,180 @@
+"""
+處理進度通知
+追蹤每位用戶的檔案工作 (下載 → 上傳 → Document AI → 儲存)，在短時間窗內累積狀態變更，
+每個窗只發送一則彙整訊息；reply token 仍有效時優先使用回覆 (不計入 push 額度)。
+
+每個狀態變更累加 notify.updates，每則送出的訊息累加 notify.sent.reply / notify.sent.push。
+"""
+
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import requests
+
+from config import metrics
+from config import deadline
+from config.env_manager import get_settings
+
+# 狀態 -> (圖示, 說明)
+STAGE_LABELS = {
+    'downloading': ('⏳', '下載中'),
+    'downloaded': ('📂', '已下載 (本地)'),
+    'uploaded': ('☁️', '已上傳'),
+    'processing': ('🔍', 'Document AI 處理中'),
+    'saved': ('✅', '處理完成'),
+    'failed': ('❌', '失敗'),
+    # 只有啟用 LINE Webhook 重送 (或 GCS --retry) 時才會再處理，不保證自動重試
+    'deferred': ('🕒', '目前忙碌或處理時間不足，尚未完成；若稍後未收到完成通知，請重新傳送檔案'),
+    'rejected': ('🚫', '超過今日額度，未處理'),
+}
+
+
+def format_progress(jobs) -> str:
+    """
+    將一位用戶的工作狀態彙整成一則訊息
+
+    Args:
+        jobs: [(名稱, 狀態, 補充說明)]
+    """
+    # 單則訊息最多列出的工作數
+    max_lines = get_settings().get_int('PROGRESS_MAX_LINES', 20)
+    lines = [f"📋 檔案處理進度 ({len(jobs)} 個)"]
+    for label, stage, detail in jobs[:max_lines]:
+        icon, text = STAGE_LABELS.get(stage, ('•', stage))
+        lines.append(f"{icon} {label}：{text}" + (f" ({detail})" if detail else ''))
+    if len(jobs) > max_lines:
+        lines.append(f"…還有 {len(jobs) - max_lines} 個")
+    return '\n'.join(lines)
+
+
+class ProgressNotifier:
+    """處理進度通知器"""
+
+    def __init__(self, sender: Callable[[str, str, Optional[str]], None],
+                 window_seconds: Optional[float] = None, reply_ttl_seconds: Optional[float] = None):
+        """
+        初始化通知器
+
+        Args:
+            sender: 發送函式 (收件者 ID, 訊息, reply token 或 None)
+            window_seconds: 累積狀態變更的時間窗 (秒)；0 表示只在 flush 時發送 (預設依目前設定的 PROGRESS_WINDOW_SECONDS)
+            reply_ttl_seconds: reply token 視為有效的秒數 (預設依目前設定的 REPLY_TOKEN_TTL_SECONDS)
+        """
+        self.sender = sender
+        self._window_seconds = window_seconds
+        self._reply_ttl_seconds = reply_ttl_seconds
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        atexit.register(self.flush, True)
+
+    @property
+    def window_seconds(self) -> float:
+        if self._window_seconds is not None:
+            return self._window_seconds
+        return get_settings().get_float('PROGRESS_WINDOW_SECONDS', 2)
+
+    @property
+    def reply_ttl_seconds(self) -> float:
+        # LINE reply token 的有效時間有限，超過此秒數改用 push
+        if self._reply_ttl_seconds is not None:
+            return self._reply_ttl_seconds
+        return get_settings().get_float('REPLY_TOKEN_TTL_SECONDS', 50)
+
+    def update(self, recipient: str, job_key: str, label: str, stage: str,
+               reply_token: Optional[str] = None, detail: Optional[str] = None):
+        """
+        記錄工作狀態變更 (同一工作在時間窗內只保留最新狀態)
+
+        Args:
+            recipient: 收件者 (LINE 用戶 ID)
+            job_key: 工作 ID (例如 message id)
+            label: 顯示名稱 (例如檔名)
+            stage: 狀態 (見 STAGE_LABELS)
+            reply_token: 事件的 reply token，時間窗結束時若仍有效則以回覆發送
+            detail: 補充說明
+        """
+        if not recipient:
+            return
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pending.get(recipient)
+            if entry is None:
+                entry = self._pending[recipient] = {
+                    'jobs': OrderedDict(), 'since': now, 'reply_token': None, 'reply_at': None
+                }
+            if reply_token and entry['reply_token'] is None:
+                entry['reply_token'] = reply_token
+                entry['reply_at'] = now
+            entry['jobs'][job_key] = (label, stage, detail)
+            self._ensure_thread()
+        metrics.increment('notify.updates')
+
+    def _ensure_thread(self):
+        """啟動背景執行緒定期發送到期的訊息 (呼叫端需持有鎖)"""
+        if self.window_seconds <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._flush_loop, name='progress-notifier', daemon=True)
+        self._thread.start()
+
+    def _flush_loop(self):
+        interval = max(0.05, self.window_seconds / 4)
+        while True:
+            time.sleep(interval)
+            self.flush()
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+
+    def flush(self, force: bool = False) -> int:
+        """
+        發送時間窗已到 (或 force 時全部) 的彙整訊息
+
+        Returns:
+            發送的訊息數
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [recipient for recipient, entry in self._pending.items()
+                   if force or now - entry['since'] >= self.window_seconds]
+            batches = [(recipient, self._pending.pop(recipient)) for recipient in due]
+
+        for recipient, entry in batches:
+            reply_token = entry['reply_token']
+            if reply_token and now - entry['reply_at'] > self.reply_ttl_seconds:
+                reply_token = None
+            message = format_progress(list(entry['jobs'].values()))
+            try:
+                self.sender(recipient, message, reply_token)
+                metrics.increment('notify.sent.reply' if reply_token else 'notify.sent.push')
+            except Exception as e:
+                metrics.increment('notify.errors')
+                print(f"❌ 進度通知發送失敗: {e}")
+        return len(batches)
+
+
+def line_push_sender(get_access_token: Callable[[], str]) -> Callable[[str, str, Optional[str]], None]:
+    """
+    建立直接呼叫 LINE Messaging API 的發送函式 (供沒有 webhook 回覆邏輯的函式使用)
+
+    Args:
+        get_access_token: 取得 Channel Access Token 的函式 (每次發送時讀取，設定重新載入後立即生效)
+    """
+    def send(recipient, message, reply_token=None):
+        if reply_token:
+            url = "https://api.line.me/v2/bot/message/reply"
+            data = {'replyToken': reply_token, 'messages': [{'type': 'text', 'text': message}]}
+        else:
+            url = "https://api.line.me/v2/bot/message/push"
+            data = {'to': recipient, 'messages': [{'type': 'text', 'text': message}]}
+        response = requests.post(url, headers={
+            'Authorization': f'Bearer {get_access_token()}',
+            'Content-Type': 'application/json'
+        }, json=data, timeout=deadline.timeout_for(10))
+        if response.status_code != 200:
+            raise RuntimeError(f"{response.status_code} - {response.text}")
+    return send
@@ -0,0 +1,290 @@
+"""
+重試帳本
+記錄每個工作 (LINE 檔案下載、文件處理) 的階段檢查點，失敗時以指數退避排程重試，
+超過次數上限移入死信區。帳本為本地 SQLite 檔案，可離線使用。
+
+階段: downloaded → uploaded → processed → saved
+
+次數上限與退避時間在使用時由設定快照讀取 (設定重新載入後即生效)；帳本檔案位置 (RETRY_LEDGER_PATH)
+於第一次使用時決定，變更後須重新啟動。
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from typing import List, Optional
+
+from config import metrics
+from config.env_manager import get_settings
+
+STAGES = ('downloaded', 'uploaded', 'processed', 'saved')
+
+STATUS_RUNNING = 'running'
+STATUS_PENDING = 'pending'
+STATUS_DEAD = 'dead'
+STATUS_DONE = 'done'
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        checkpoints TEXT NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL,
+        failed_stage TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        next_attempt_at REAL,
+        updated_at REAL NOT NULL
+    )
+"""
+
+JOB_COLUMNS = ('job_id', 'kind', 'payload', 'checkpoints', 'status', 'failed_stage',
+               'attempts', 'last_error', 'next_attempt_at', 'updated_at')
+
+
+def default_path() -> str:
+    """帳本的預設位置 (RETRY_LEDGER_PATH)"""
+    return get_settings().get('RETRY_LEDGER_PATH') or os.path.join(tempfile.gettempdir(), 'line_retry_ledger.db')
+
+
+def backoff_delay(attempts: int, base: Optional[float] = None, cap: Optional[float] = None) -> float:
+    """計算第 N 次失敗後的等待秒數 (指數退避加上 ±20% 抖動，預設依 RETRY_BASE_DELAY_SECONDS / RETRY_MAX_DELAY_SECONDS)"""
+    settings = get_settings()
+    base = settings.get_float('RETRY_BASE_DELAY_SECONDS', 30) if base is None else base
+    cap = settings.get_float('RETRY_MAX_DELAY_SECONDS', 3600) if cap is None else cap
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class RetryLedger:
+    """重試帳本"""
+
+    def __init__(self, path: Optional[str] = None, max_attempts: Optional[int] = None):
+        """
+        初始化帳本
+
+        Args:
+            path: SQLite 檔案路徑 (預設為 RETRY_LEDGER_PATH)
+            max_attempts: 失敗次數上限，超過即移入死信區 (預設依目前設定的 RETRY_MAX_ATTEMPTS)
+        """
+        path = path or default_path()
+        self.path = path
+        self._max_attempts = max_attempts
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(SCHEMA)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_next ON jobs (status, next_attempt_at)')
+        self._conn.commit()
+
+    @property
+    def max_attempts(self) -> int:
+        """失敗次數上限"""
+        if self._max_attempts is not None:
+            return self._max_attempts
+        return get_settings().get_int('RETRY_MAX_ATTEMPTS', 5)
+
+    def artifact_path(self, job_id: str, suffix: str) -> str:
+        """取得工作中繼產出 (例如已處理的文件) 的本地儲存路徑"""
+        artifact_dir = os.path.join(os.path.dirname(os.path.abspath(self.path)), 'line_retry_artifacts')
+        os.makedirs(artifact_dir, exist_ok=True)
+        digest = hashlib.sha1(job_id.encode('utf-8')).hexdigest()
+        return os.path.join(artifact_dir, f"{digest}{suffix}")
+
+    def _row_to_job(self, row) -> Optional[dict]:
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job['payload'] = json.loads(job['payload'])
+        job['checkpoints'] = json.loads(job['checkpoints'])
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """取得工作紀錄"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row)
+
+    def start(self, job_id: str, kind: str, payload: dict) -> dict:
+        """
+        開始 (或恢復) 一個工作；已存在的工作保留既有檢查點
+
+        已完成 (done) 與死信區 (dead) 的工作維持原狀態，呼叫端應依回傳的狀態略過；
+        死信區的工作只能以 revive() (scripts/retry_jobs.py revive) 重新排入。
+        next_attempt_at 的退避時間只由 scripts/retry_jobs.py replay --due 使用，
+        LINE / GCS 重送的事件不受退避限制，立即從檢查點繼續。
+
+        Args:
+            job_id: 工作 ID (例如 LINE message id 或 GCS 路徑)
+            kind: 工作類型 (line_file / line_image / document)
+            payload: 重跑所需的參數
+
+        Returns:
+            工作紀錄
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO jobs (job_id, kind, payload, status, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (job_id) DO UPDATE SET
+                    status = CASE WHEN jobs.status IN ('done', 'dead') THEN jobs.status ELSE excluded.status END,
+                    updated_at = excluded.updated_at
+                """,
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), STATUS_RUNNING, now)
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def checkpoint(self, job_id: str, stage: str, artifact=None):
+        """
+        記錄階段完成
+
+        Args:
+            job_id: 工作 ID
+            stage: 階段名稱 (見 STAGES)
+            artifact: 該階段產出 (例如本地檔案路徑、GCS 路徑)，供重跑下一階段使用
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT checkpoints FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            checkpoints = json.loads(row[0])
+            checkpoints[stage] = artifact
+            self._conn.execute(
+                'UPDATE jobs SET checkpoints = ?, updated_at = ? WHERE job_id = ?',
+                (json.dumps(checkpoints, ensure_ascii=False), time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def complete(self, job_id: str):
+        """標記工作完成"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, failed_stage = NULL, next_attempt_at = NULL, updated_at = ? WHERE job_id = ?",
+                (STATUS_DONE, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def fail(self, job_id: str, stage: str, error) -> str:
+        """
+        記錄失敗並排程重試
+
+        Args:
+            job_id: 工作 ID
+            stage: 失敗的階段 (尚未完成的階段名稱，例如 download / upload / process / save)
+            error: 錯誤訊息或例外
+
+        Returns:
+            新狀態 (pending 或 dead)
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT attempts FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return STATUS_DEAD
+            attempts = row[0] + 1
+            if attempts >= self.max_attempts:
+                status, next_attempt_at = STATUS_DEAD, None
+            else:
+                status, next_attempt_at = STATUS_PENDING, now + backoff_delay(attempts)
+            self._conn.execute(
+                """
+                UPDATE jobs SET status = ?, failed_stage = ?, attempts = ?, last_error = ?,
+                    next_attempt_at = ?, updated_at = ?
+                WHERE job_id = ?
+                """,
+                (status, stage, attempts, str(error)[:2000], next_attempt_at, now, job_id)
+            )
+            self._conn.commit()
+
+        metrics.increment(f"retry.{stage}.failed")
+        if status == STATUS_DEAD:
+            metrics.increment(f"retry.{stage}.dead_lettered")
+            print(f"☠️ 工作 {job_id} 在 {stage} 階段失敗 {attempts} 次，移入死信區")
+        else:
+            print(f"🔁 工作 {job_id} 在 {stage} 階段失敗 (第 {attempts} 次)，"
+                  f"{next_attempt_at - now:.0f} 秒後重試")
+        return status
+
+    def defer(self, job_id: str, stage: str, reason) -> str:
+        """
+        記錄延後 (階段尚未開始，例如下載預算不足、期限不足或相依服務暫時無法使用)；不計入失敗次數，不會移入死信區
+
+        Args:
+            job_id: 工作 ID
+            stage: 延後的階段
+            reason: 延後原因
+
+        Returns:
+            新狀態 (pending；死信區或不存在的工作維持原狀)
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE jobs SET status = ?, failed_stage = ?, last_error = ?, next_attempt_at = ?, updated_at = ?
+                WHERE job_id = ? AND status NOT IN ('done', 'dead')
+                """,
+                (STATUS_PENDING, stage, str(reason)[:2000], now, now, job_id)
+            )
+            self._conn.commit()
+        metrics.increment(f"retry.{stage}.deferred")
+        return STATUS_PENDING
+
+    def revive(self, job_id: str):
+        """將死信區的工作重新排入待重試 (重置次數)；死信區的工作只能由此恢復"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE job_id = ?",
+                (STATUS_PENDING, time.time(), time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def list_jobs(self, status: Optional[str] = None, due_only: bool = False,
+                  limit: int = 100) -> List[dict]:
+        """
+        列出工作
+
+        Args:
+            status: 只列出指定狀態
+            due_only: 只列出已到重試時間的待重試工作
+            limit: 最多筆數
+        """
+        statement = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs"
+        params = []
+        if due_only:
+            statement += ' WHERE status = ? AND next_attempt_at <= ?'
+            params.extend([STATUS_PENDING, time.time()])
+        elif status:
+            statement += ' WHERE status = ?'
+            params.append(status)
+        statement += ' ORDER BY updated_at DESC LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(statement, params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+
+_ledger: Optional[RetryLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> RetryLedger:
+    """取得共用的重試帳本"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = RetryLedger()
+    return _ledger
@@ -0,0 +1,133 @@
+"""
+租戶每日額度
+記錄每個租戶 (LINE 群組 / 聊天室 / 用戶) 當日下載的位元組數與 Document AI 處理頁數，
+超過 TENANT_DAILY_BYTES / TENANT_DAILY_PAGES 時拒絕新的工作 (0 表示不限制)。
+
+用量存放在本地 SQLite 檔案，Cloud Function 上為各執行個體分別計算。
+額度上限在每次檢查時由設定快照讀取 (設定重新載入後即生效)；檔案位置 (TENANT_QUOTA_PATH) 變更後須重新啟動。
+"""
+
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+from typing import Optional
+
+from config import metrics
+from config.env_manager import get_settings
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS usage (
+        tenant TEXT NOT NULL,
+        day TEXT NOT NULL,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        pages INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant, day)
+    )
+"""
+
+
+def default_path() -> str:
+    """用量紀錄的預設位置 (TENANT_QUOTA_PATH)"""
+    return get_settings().get('TENANT_QUOTA_PATH') or os.path.join(tempfile.gettempdir(), 'line_tenant_quota.db')
+
+
+def today() -> str:
+    return time.strftime('%Y-%m-%d')
+
+
+class TenantQuota:
+    """租戶每日額度"""
+
+    def __init__(self, path: Optional[str] = None, daily_bytes: Optional[int] = None,
+                 daily_pages: Optional[int] = None):
+        """
+        初始化額度紀錄
+
+        Args:
+            path: SQLite 檔案路徑 (預設為 TENANT_QUOTA_PATH)
+            daily_bytes: 每個租戶每日可下載的位元組數 (0 表示不限制，預設依目前設定的 TENANT_DAILY_BYTES)
+            daily_pages: 每個租戶每日可處理的頁數 (0 表示不限制，預設依目前設定的 TENANT_DAILY_PAGES)
+        """
+        path = path or default_path()
+        self.path = path
+        self._daily_bytes = daily_bytes
+        self._daily_pages = daily_pages
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    @property
+    def daily_bytes(self) -> int:
+        if self._daily_bytes is not None:
+            return self._daily_bytes
+        return get_settings().get_int('TENANT_DAILY_BYTES', 0)
+
+    @property
+    def daily_pages(self) -> int:
+        if self._daily_pages is not None:
+            return self._daily_pages
+        return get_settings().get_int('TENANT_DAILY_PAGES', 0)
+
+    def usage(self, tenant: str, day: Optional[str] = None) -> dict:
+        """取得租戶當日用量"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT bytes, pages FROM usage WHERE tenant = ? AND day = ?', (tenant, day or today())
+            ).fetchone()
+        return {'bytes': row[0], 'pages': row[1]} if row else {'bytes': 0, 'pages': 0}
+
+    def allows(self, tenant: str, byte_count: int = 0, pages: int = 0) -> bool:
+        """
+        檢查租戶是否還有額度執行新的工作
+
+        已用完或加上本次用量會超過上限時回傳 False，並累加 quota.<bytes|pages>.rejected 指標。
+
+        Args:
+            tenant: 租戶 ID
+            byte_count: 本次預計下載的位元組數 (未知時為 0)
+            pages: 本次預計處理的頁數 (未知時為 0)
+        """
+        if not self.daily_bytes and not self.daily_pages:
+            return True
+        used = self.usage(tenant)
+        for kind, limit, requested in (('bytes', self.daily_bytes, byte_count),
+                                        ('pages', self.daily_pages, pages)):
+            if limit and (used[kind] >= limit or used[kind] + requested > limit):
+                metrics.increment(f"quota.{kind}.rejected")
+                return False
+        return True
+
+    def consume(self, tenant: str, byte_count: int = 0, pages: int = 0):
+        """累加租戶當日用量"""
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO usage (tenant, day, bytes, pages) VALUES (?, ?, ?, ?)
+                ON CONFLICT (tenant, day) DO UPDATE SET
+                    bytes = usage.bytes + excluded.bytes,
+                    pages = usage.pages + excluded.pages
+                """,
+                (tenant, today(), byte_count, pages)
+            )
+            self._conn.commit()
+        metrics.increment('quota.bytes.consumed', byte_count)
+        metrics.increment('quota.pages.consumed', pages)
+
+
+_quota: Optional[TenantQuota] = None
+_quota_lock = threading.Lock()
+
+
+def get_quota() -> TenantQuota:
+    """取得共用的額度紀錄"""
+    global _quota
+    with _quota_lock:
+        if _quota is None:
+            _quota = TenantQuota()
+    return _quota
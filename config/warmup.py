@@ -0,0 +1,122 @@
+"""
+執行個體預熱
+新的執行個體處理第一個請求前，先建立共用客戶端、開啟連線池 (DNS、TLS、gRPC 通道與存取權杖) 並載入選用套件，
+第一個請求不必在 LINE 的逾時計時中等待這些初始化。
+
+兩個函式在模組載入時以 register() 登記各自的預熱步驟，由以下方式執行:
+- 冷啟動: WARMUP_ON_START=true (部署在 Cloud Functions 時預設開啟) 時於模組載入時執行
+- Webhook 接收器: GET /warmup (部署後或由 Cloud Scheduler 呼叫)；正式服務模式由每個工作行程在 fork 後執行
+- 文件處理器: 名稱以 WARMUP_OBJECT_PREFIX 開頭的物件事件只預熱，不處理
+
+每個步驟只建立連線或讀取中繼資料，不做實際工作。步驟失敗只記錄 (第一個請求照常建立)，不影響其他步驟。
+同一行程只執行一次，之後回傳第一次的結果。指標: warmup.<步驟>.ms、warmup.total_ms、warmup.errors
+"""
+
+import os
+import time
+import importlib
+import threading
+from typing import Callable, List, Optional
+
+from config import metrics
+from config.env_manager import get_settings
+
+_steps = []
+_lock = threading.Lock()
+_report = None
+
+
+def on_start() -> bool:
+    """是否於冷啟動時預熱 (WARMUP_ON_START；未設定時部署在 Cloud Functions (有 FUNCTION_TARGET) 才預熱)"""
+    settings = get_settings()
+    if not settings.get('WARMUP_ON_START'):
+        return bool(settings.get('FUNCTION_TARGET'))
+    return settings.get_bool('WARMUP_ON_START')
+
+
+def timeout_seconds() -> float:
+    """預熱時網路呼叫的逾時 (WARMUP_TIMEOUT_SECONDS)"""
+    return get_settings().get_float('WARMUP_TIMEOUT_SECONDS', 10)
+
+
+def object_prefix() -> str:
+    """預熱時讀取中繼資料的物件前綴 (WARMUP_OBJECT_PREFIX，物件不必存在)；文件處理器收到此前綴的物件事件時只預熱"""
+    return get_settings().get('WARMUP_OBJECT_PREFIX', '_warmup/')
+
+
+def register(name: str, fn: Callable[[], Optional[dict]]):
+    """
+    登記預熱步驟 (依登記順序執行)
+
+    Args:
+        name: 步驟名稱，用於指標與回報
+        fn: 預熱函式，可回傳補充資訊
+    """
+    _steps.append((name, fn))
+
+
+def preload(*module_names: str) -> List[str]:
+    """
+    預先載入選用套件 (未安裝的略過)
+
+    Returns:
+        已載入的套件名稱
+    """
+    loaded = []
+    for name in module_names:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        loaded.append(name)
+    return loaded
+
+
+def run(force: bool = False) -> dict:
+    """
+    執行所有預熱步驟
+
+    Args:
+        force: 已預熱過仍重新執行 (正式服務模式的工作行程 fork 後使用)
+
+    Returns:
+        {'warm': 是否全部成功, 'total_ms': 總耗時, 'steps': {步驟: {'status', 'ms', ...}}, 'pid': 行程 ID}
+    """
+    global _report
+    with _lock:
+        if _report is not None and not force:
+            return {**_report, 'cached': True}
+
+        started = time.perf_counter()
+        steps = {}
+        for name, fn in _steps:
+            step_started = time.perf_counter()
+            try:
+                detail = fn()
+                steps[name] = {'status': 'ok'}
+                if detail:
+                    steps[name].update(detail)
+            except Exception as e:
+                metrics.increment('warmup.errors')
+                steps[name] = {'status': 'error', 'error': str(e)}
+                print(f"⚠️ 預熱 {name} 失敗: {e}")
+            elapsed_ms = (time.perf_counter() - step_started) * 1000
+            steps[name]['ms'] = round(elapsed_ms, 1)
+            metrics.observe(f"warmup.{name}.ms", elapsed_ms)
+
+        total_ms = (time.perf_counter() - started) * 1000
+        metrics.observe('warmup.total_ms', total_ms)
+        _report = {
+            'warm': all(step['status'] == 'ok' for step in steps.values()),
+            'total_ms': round(total_ms, 1),
+            'steps': steps,
+            'pid': os.getpid(),
+        }
+        summary = ', '.join(f"{name} {step['ms']:.0f} ms" for name, step in steps.items())
+        print(f"🔥 預熱完成 ({total_ms:.0f} ms): {summary}")
+        return _report
+
+
+def report() -> Optional[dict]:
+    """最近一次預熱的結果 (尚未預熱時為 None)"""
+    return _report
@@ -15,6 +15,11 @@ fi
 echo "📋 當前配置:"
 gcloud config list --format="value(core.project,core.account)" 2>/dev/null || echo "未設定"
 
+# 複製共用模組到函式目錄 (Cloud Function 只會上傳 --source 目錄)
+rm -rf webhook_receiver/config
+cp -r config webhook_receiver/config
+trap 'rm -rf webhook_receiver/config' EXIT
+
 # 部署
 echo "📤 部署中..."
 gcloud functions deploy line-webhook-receiver \
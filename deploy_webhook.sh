@@ -101,10 +101,19 @@ confirm_deployment() {
     fi
 }
 
+# 複製共用模組到函式目錄 (Cloud Function 只會上傳 --source 目錄)
+bundle_shared_modules() {
+    rm -rf webhook_receiver/config
+    cp -r config webhook_receiver/config
+    trap 'rm -rf webhook_receiver/config' EXIT
+}
+
 # 部署 Cloud Function
 deploy_function() {
     print_info "開始部署 Cloud Function..."
     
+    bundle_shared_modules
+    
     gcloud functions deploy line-webhook-receiver \
         --runtime python311 \
         --trigger-http \
@@ -0,0 +1,254 @@
+"""
+壓縮檔展開
+用戶以壓縮檔一次傳送多張發票時，逐一串流讀出成員並上傳到原始檔 bucket，每個成員再各自觸發文件處理。
+
+- 串流: 由 Cloud Storage 以範圍讀取 (blob.open) 直接讀取壓縮檔，不下載、不將整個壓縮檔解壓縮到磁碟；
+  每個成員解壓縮到 SpooledTemporaryFile (小於 ARCHIVE_SPOOL_BYTES 時只在記憶體) 並同時計算 MD5
+- 過濾: 依共用路由表只上傳需要處理的成員 (略過目錄、隱藏檔、加密成員、影音檔與巢狀壓縮檔)
+- 並行: 讀取依序進行，上傳由 ARCHIVE_WORKERS 個執行緒並行，已解壓縮但尚未上傳的成員最多 2 x ARCHIVE_WORKERS 個
+- 防護 (zip bomb): 依中央目錄檢查成員數、解壓縮後總大小、單一成員大小與壓縮比，超過時拒絕整個壓縮檔；
+  解壓縮時再以實際讀出的位元組數檢查一次
+- 冪等: 成員以內容 MD5 命名並以 if_generation_match=0 上傳，重跑時已存在的成員不重複上傳
+
+目前支援 .zip (標準函式庫)；.rar / .7z 沒有串流解壓縮的標準實作，仍只儲存不展開。
+"""
+
+import os
+import time
+import zipfile
+import hashlib
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from google.api_core.exceptions import PreconditionFailed
+
+from config import metrics
+from config import deadline
+from config.dependency_guard import get_dependency
+from config.file_routes import resolve_route, get_mime_type
+from config.object_layout import content_object_name
+from config.env_manager import get_settings
+
+MB = 1024 * 1024
+
+# 壓縮比只檢查解壓縮後超過此大小的成員 (小型文字檔的壓縮比本來就高)
+RATIO_MIN_BYTES = 1024 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+
+SUPPORTED_EXTENSIONS = ('.zip',)
+
+
+class ArchiveRejected(ValueError):
+    """壓縮檔超過防護限制 (不重試)"""
+
+
+class ArchiveLimits(NamedTuple):
+    """壓縮檔防護限制"""
+    max_members: int = 1000
+    max_total_bytes: int = 1024 * MB
+    max_member_bytes: int = 100 * MB
+    max_ratio: float = 100
+
+    @classmethod
+    def from_settings(cls, settings=None) -> 'ArchiveLimits':
+        """依設定快照 (ARCHIVE_MAX_MEMBERS / ARCHIVE_MAX_TOTAL_BYTES / ARCHIVE_MAX_MEMBER_BYTES / ARCHIVE_MAX_RATIO) 建立"""
+        settings = settings or get_settings()
+        defaults = cls()
+        return cls(
+            max_members=settings.get_int('ARCHIVE_MAX_MEMBERS', defaults.max_members),
+            max_total_bytes=settings.get_int('ARCHIVE_MAX_TOTAL_BYTES', defaults.max_total_bytes),
+            max_member_bytes=settings.get_int('ARCHIVE_MAX_MEMBER_BYTES', defaults.max_member_bytes),
+            max_ratio=settings.get_float('ARCHIVE_MAX_RATIO', defaults.max_ratio),
+        )
+
+
+def read_chunk_bytes() -> int:
+    """由 Cloud Storage 讀取壓縮檔時每次範圍讀取的大小 (ARCHIVE_READ_CHUNK)"""
+    return get_settings().get_int('ARCHIVE_READ_CHUNK', 8 * MB)
+
+
+def supports(file_name: str) -> bool:
+    """是否可以展開此壓縮檔"""
+    return os.path.splitext(file_name)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def member_name(info: zipfile.ZipInfo) -> str:
+    """成員檔名 (不含路徑)；未標記 UTF-8 的檔名多半是 Windows 以 Big5 (CP950) 壓縮，嘗試還原"""
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode('cp437').decode('cp950')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return os.path.basename(name.rstrip('/'))
+
+
+def check_archive(infos, limits: ArchiveLimits):
+    """
+    依中央目錄檢查防護限制
+
+    Raises:
+        ArchiveRejected: 超過成員數、總大小、單一成員大小或壓縮比
+    """
+    if len(infos) > limits.max_members:
+        raise ArchiveRejected(f"成員數 {len(infos)} 超過上限 {limits.max_members}")
+    total = sum(info.file_size for info in infos)
+    if total > limits.max_total_bytes:
+        raise ArchiveRejected(f"解壓縮後總大小 {total} bytes 超過上限 {limits.max_total_bytes}")
+    for info in infos:
+        if info.file_size > limits.max_member_bytes:
+            raise ArchiveRejected(f"{info.filename} 解壓縮後 {info.file_size} bytes 超過上限 {limits.max_member_bytes}")
+        if info.file_size > RATIO_MIN_BYTES and info.file_size > info.compress_size * limits.max_ratio:
+            raise ArchiveRejected(f"{info.filename} 壓縮比超過上限 {limits.max_ratio:g}")
+
+
+def select_member(info: zipfile.ZipInfo):
+    """
+    依路由表判斷成員是否需要上傳
+
+    Returns:
+        (路由, 檔名)；不需上傳時回傳 (None, 原因)
+    """
+    if info.is_dir():
+        return None, 'directory'
+    name = member_name(info)
+    if not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+        return None, 'hidden'
+    if info.flag_bits & 0x1:
+        return None, 'encrypted'
+    route = resolve_route(name)
+    if route.engine == 'archive':
+        # 不展開巢狀壓縮檔 (避免遞迴的 zip bomb)
+        return None, 'nested'
+    if not route.process:
+        return None, 'route'
+    return route, name
+
+
+def spool_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, limits: ArchiveLimits):
+    """
+    解壓縮單一成員 (同時計算 MD5，超過上限時停止)
+
+    Returns:
+        (SpooledTemporaryFile, MD5 hex, 大小)
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=get_settings().get_int('ARCHIVE_SPOOL_BYTES', 8 * MB))
+    digest = hashlib.md5()
+    size = 0
+    try:
+        with archive.open(info) as member:
+            for chunk in iter(lambda: member.read(COPY_CHUNK_BYTES), b''):
+                size += len(chunk)
+                if size > min(info.file_size, limits.max_member_bytes):
+                    raise ArchiveRejected(f"{info.filename} 實際大小超過宣告的 {info.file_size} bytes")
+                digest.update(chunk)
+                spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, digest.hexdigest(), size
+
+
+def upload_member(bucket, object_name: str, spool, content_type: str, metadata: dict) -> bool:
+    """
+    上傳成員 (目標已存在時不覆蓋)
+
+    Returns:
+        是否實際上傳
+    """
+    try:
+        blob = bucket.blob(object_name)
+        if metadata:
+            blob.metadata = metadata
+        # 逾時不超過本次呼叫的剩餘時間，停滯的上傳不會超過函式的執行時間上限
+        blob.upload_from_file(spool, rewind=True, content_type=content_type, if_generation_match=0,
+                              timeout=deadline.timeout_for(60))
+        return True
+    except PreconditionFailed:
+        return False
+
+
+def guarded_upload(bucket, object_name: str, spool, content_type: str, metadata: dict) -> bool:
+    """經由 Cloud Storage 相依服務防護上傳成員；不論是否實際上傳 (例如斷路器開啟時拒絕) 都關閉暫存檔"""
+    try:
+        return get_dependency('gcs').call(upload_member, bucket, object_name, spool, content_type, metadata)
+    finally:
+        spool.close()
+
+
+def expand_archive(fileobj, bucket, archive_name: str, metadata: Optional[dict] = None,
+                   limits: Optional[ArchiveLimits] = None, workers: Optional[int] = None) -> dict:
+    """
+    展開壓縮檔並上傳需要處理的成員
+
+    Args:
+        fileobj: 可 seek 的壓縮檔 (例如 blob.open('rb'))
+        bucket: 上傳成員的 Bucket
+        archive_name: 壓縮檔的物件名稱 (寫入成員的 metadata)
+        metadata: 壓縮檔的 metadata (上傳者、租戶)，複製到每個成員
+        limits: 防護限制 (預設依目前設定)
+        workers: 並行上傳數 (預設依 ARCHIVE_WORKERS)
+
+    Returns:
+        統計 {'members', 'uploaded', 'existing', 'skipped', 'bytes', 'seconds'}
+
+    Raises:
+        ArchiveRejected: 超過防護限制
+    """
+    started = time.perf_counter()
+    limits = limits or ArchiveLimits.from_settings()
+    workers = workers or get_settings().get_int('ARCHIVE_WORKERS', 8)
+    member_metadata = {**(metadata or {}), 'line_archive': archive_name}
+    stats = {'members': 0, 'uploaded': 0, 'existing': 0, 'skipped': 0, 'bytes': 0}
+    # 限制已解壓縮但尚未上傳的成員數 (記憶體 / 暫存檔用量)
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    futures = []
+
+    with zipfile.ZipFile(fileobj) as archive, ThreadPoolExecutor(max_workers=workers,
+                                                                thread_name_prefix='archive') as executor:
+        infos = archive.infolist()
+        check_archive(infos, limits)
+        for info in infos:
+            stats['members'] += 1
+            route, name = select_member(info)
+            if route is None:
+                stats['skipped'] += 1
+                metrics.increment(f"archive.skipped.{name}")
+                continue
+
+            in_flight.acquire()
+            try:
+                spool, content_hash, size = spool_member(archive, info, limits)
+            except Exception:
+                in_flight.release()
+                raise
+            stats['bytes'] += size
+            object_name = content_object_name(route.storage_prefix, name, content_hash,
+                                              member_metadata.get('line_tenant_id'))
+            try:
+                # 在呼叫端的 context 中執行，沿用本次呼叫的期限與效能分析
+                future = executor.submit(contextvars.copy_context().run, guarded_upload, bucket, object_name,
+                                         spool, get_mime_type(name), member_metadata)
+            except Exception:
+                spool.close()
+                in_flight.release()
+                raise
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+
+        # 等待所有上傳完成；任何一個失敗時拋出例外，重跑時已上傳的成員會被略過
+        for future in futures:
+            if future.result():
+                stats['uploaded'] += 1
+            else:
+                stats['existing'] += 1
+
+    stats['seconds'] = time.perf_counter() - started
+    metrics.increment('archive.members', stats['members'])
+    metrics.increment('archive.uploaded', stats['uploaded'])
+    metrics.observe('archive.expand_ms', stats['seconds'] * 1000)
+    return stats
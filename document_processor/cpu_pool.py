@@ -0,0 +1,224 @@
+"""
+CPU 密集階段的執行器
+JSON 轉換、結構化資料擷取與 CSV 編碼會持有 GIL，多個文件並行處理時彼此排隊。
+CPU_EXECUTOR=process 時改交由行程池執行，參數與回傳值只包含 bytes / 字串等簡單資料。
+
+  inline  - 在目前的執行緒中執行 (預設，CSV 維持串流上傳)
+  process - 行程池 (大小由 CPU_WORKERS 設定，0 表示可用 CPU 數)，每個執行個體只啟動與暖機一次
+
+每個工作從送出到取得結果的耗時 (含等待空閒的工作行程) 記錄在 cpu.<階段>.ms。
+設定重新載入且 CPU_EXECUTOR / CPU_WORKERS / CPU_START_METHOD 變更時改用新的執行器，舊的行程池在進行中的工作完成後關閉。
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from config import metrics
+from config.env_manager import env_manager, get_settings
+
+
+def available_cpus() -> int:
+    """目前行程可使用的 CPU 數 (容器的 CPU 限制會反映在 affinity 上)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _warm_worker():
+    """工作行程初始化: 預先載入 Document AI 型別 (反序列化文件用) 與輸出模組"""
+    from google.cloud import documentai_v1  # noqa: F401
+    import rendering  # noqa: F401
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+class InlineExecutor:
+    """在呼叫端執行緒中直接執行"""
+
+    name = 'inline'
+    offloads = False
+    workers = 0
+
+    def run(self, stage: str, func: Callable, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            metrics.observe(f'cpu.{stage}.ms', (time.perf_counter() - started) * 1000)
+
+    def warm_up(self) -> int:
+        return 0
+
+    def retire(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class ProcessExecutor:
+    """行程池執行器"""
+
+    name = 'process'
+    offloads = True
+
+    def __init__(self, workers: int = 0, start_method: str = 'forkserver'):
+        """
+        初始化行程池 (工作行程在 warm_up 或第一個工作時才啟動)
+
+        Args:
+            workers: 工作行程數，0 表示可用 CPU 數
+            start_method: multiprocessing 啟動方式 (forkserver / spawn / fork)
+        """
+        self.workers = workers or available_cpus()
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = 'spawn'
+        self.start_method = start_method
+        self._lock = threading.Lock()
+        self._pool = None
+        self._warmed = False
+        # 設定重新載入後由新的執行器取代；進行中的工作完成後才關閉行程池
+        self._active = 0
+        self._retired = False
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_warm_worker
+                )
+            return self._pool
+
+    def warm_up(self) -> int:
+        """
+        啟動所有工作行程並完成初始化 (每個執行個體只執行一次)
+
+        Returns:
+            完成暖機的工作行程數
+        """
+        if self._warmed:
+            return self.workers
+        started = time.perf_counter()
+        pool = self._get_pool()
+        # 每個送出的工作都可能啟動一個新的工作行程，初始化 (_warm_worker) 在接手工作前完成
+        for future in [pool.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+        self._warmed = True
+        print(f"🔥 CPU 行程池已暖機: {self.workers} 個工作行程，耗時 {(time.perf_counter() - started) * 1000:.0f} ms")
+        return self.workers
+
+    def run(self, stage: str, func: Callable, *args):
+        """
+        在工作行程中執行 func(*args) 並等待結果
+
+        Args:
+            stage: 階段名稱 (指標用)
+            func: 模組層級函式 (需可被工作行程匯入)
+            args: 可序列化 (pickle) 的參數
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._active += 1
+            closed = self._retired and self._pool is None
+        try:
+            if closed:
+                # 設定重新載入後才取得舊執行器的呼叫端 (行程池已關閉): 在目前的執行緒執行
+                return func(*args)
+            pool = self._get_pool()
+            try:
+                return pool.submit(func, *args).result()
+            except BrokenProcessPool:
+                # 工作行程異常結束 (例如記憶體不足) 時重建行程池，本次工作交由呼叫端的重試處理
+                metrics.increment('cpu.pool.broken')
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                        self._warmed = False
+                raise
+        finally:
+            self._release()
+            metrics.observe(f'cpu.{stage}.ms', (time.perf_counter() - started) * 1000)
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            pool = None
+            if self._retired and self._active == 0:
+                pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def retire(self):
+        """停止使用此執行器: 沒有進行中的工作時立即關閉行程池，否則由最後一個工作完成時關閉"""
+        with self._lock:
+            self._retired = True
+            pool = None
+            if self._active == 0:
+                pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                self._warmed = False
+
+
+def executor_options(settings=None) -> tuple:
+    """依設定快照取得 (CPU_EXECUTOR, CPU_WORKERS, CPU_START_METHOD)"""
+    settings = settings or get_settings()
+    # 工作行程的啟動方式；預設 forkserver，避免複製已建立的 gRPC 連線
+    return (settings.get('CPU_EXECUTOR', 'inline'), settings.get_int('CPU_WORKERS', 0),
+            settings.get('CPU_START_METHOD', 'forkserver'))
+
+
+def build_executor(kind: str = 'inline', workers: int = 0, start_method: str = 'forkserver'):
+    """依設定建立執行器"""
+    if kind == 'process':
+        return ProcessExecutor(workers, start_method)
+    if kind != 'inline':
+        print(f"⚠️ 未知的 CPU_EXECUTOR: {kind}，改用 inline")
+    return InlineExecutor()
+
+
+_executor = None
+_executor_options = None
+_executor_lock = threading.Lock()
+
+
+def get_cpu_executor():
+    """取得共用的 CPU 執行器 (每個執行個體一個)"""
+    global _executor, _executor_options
+    with _executor_lock:
+        if _executor is None:
+            _executor_options = executor_options()
+            _executor = build_executor(*_executor_options)
+        return _executor
+
+
+def _on_settings_reload(settings):
+    """設定重新載入時若執行器設定變更則改用新的執行器 (新的行程池在第一個工作時啟動)"""
+    global _executor, _executor_options
+    options = executor_options(settings)
+    with _executor_lock:
+        if _executor is None or options == _executor_options:
+            return
+        previous = _executor
+        _executor_options = options
+        _executor = build_executor(*options)
+    previous.retire()
+
+
+env_manager.on_reload(_on_settings_reload)
@@ -0,0 +1,109 @@
+"""
+串流 CSV 輸出
+將結構化資料逐列編碼為 CSV，以固定大小的區塊上傳到 Cloud Storage，
+記憶體用量只與區塊大小有關，不隨表格大小成長。
+
+內容小於一個區塊時以單次上傳完成；超過時改用可續傳上傳 (blob.open) 分塊寫入。
+"""
+
+import io
+import os
+import csv
+from typing import Iterable, Iterator, Sequence, Tuple
+
+from extraction import STRUCTURED_COLUMNS
+
+# 上傳區塊大小 (Cloud Storage 可續傳上傳要求為 256 KiB 的倍數)
+CSV_CHUNK_BYTES = int(os.getenv('CSV_CHUNK_BYTES', str(1024 * 1024)))
+_CHUNK_ALIGNMENT = 256 * 1024
+
+
+def aligned_chunk_size(chunk_bytes: int) -> int:
+    """將區塊大小調整為 256 KiB 的倍數"""
+    return max(1, round(chunk_bytes / _CHUNK_ALIGNMENT)) * _CHUNK_ALIGNMENT
+
+
+def iter_csv_chunks(rows: Iterable[dict], columns: Sequence[str] = STRUCTURED_COLUMNS,
+                    chunk_bytes: int = CSV_CHUNK_BYTES, counter: dict = None) -> Iterator[bytes]:
+    """
+    將資料列編碼為 CSV，每累積約 chunk_bytes 產生一個 UTF-8 區塊
+
+    Args:
+        rows: 資料列 (dict)
+        columns: 欄位順序 (第一列為表頭)
+        chunk_bytes: 區塊大小
+        counter: 傳入時會寫入 'rows' (資料列數) 與 'bytes' (總位元組數)
+
+    Yields:
+        CSV 區塊 (bytes)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    row_count = 0
+    byte_count = 0
+    # StringIO 以字元計算，以 chunk_bytes 字元為門檻 (中文約 3 倍位元組，區塊仍有上限)
+    for row in rows:
+        # csv 模組會將 None 寫成空欄位
+        writer.writerow([row.get(column) for column in columns])
+        row_count += 1
+        if buffer.tell() >= chunk_bytes:
+            chunk = buffer.getvalue().encode('utf-8')
+            byte_count += len(chunk)
+            yield chunk
+            buffer.seek(0)
+            buffer.truncate()
+
+    chunk = buffer.getvalue().encode('utf-8')
+    byte_count += len(chunk)
+    if counter is not None:
+        counter['rows'] = row_count
+        counter['bytes'] = byte_count
+    yield chunk
+
+
+def upload_csv_chunks(blob, chunks: Iterator[bytes], counter: dict, chunk_bytes: int = CSV_CHUNK_BYTES):
+    """
+    上傳已編碼的 CSV 區塊 (串流產生或在工作行程中預先編碼)；沒有任何資料列時不建立 blob
+
+    Args:
+        blob: Cloud Storage Blob
+        chunks: CSV 區塊 (iter_csv_chunks 的輸出)
+        counter: iter_csv_chunks 的計數 (區塊全部取出後才會有 'rows' / 'bytes')
+        chunk_bytes: 區塊大小 (需為 256 KiB 的倍數)
+    """
+    chunks = iter(chunks)
+    first = next(chunks)
+    second = next(chunks, None)
+
+    if second is None:
+        # 只有一個區塊: 單次上傳
+        if counter['rows']:
+            blob.upload_from_string(first, content_type='text/csv')
+        return
+
+    with blob.open('wb', chunk_size=chunk_bytes, content_type='text/csv') as writer:
+        writer.write(first)
+        writer.write(second)
+        for chunk in chunks:
+            writer.write(chunk)
+
+
+def write_csv_blob(blob, rows: Iterable[dict], columns: Sequence[str] = STRUCTURED_COLUMNS,
+                   chunk_bytes: int = CSV_CHUNK_BYTES) -> Tuple[int, int]:
+    """
+    以串流方式將資料列寫入 CSV blob；沒有任何資料列時不建立 blob
+
+    Args:
+        blob: Cloud Storage Blob
+        rows: 資料列 (dict，可為 generator)
+        columns: 欄位順序
+        chunk_bytes: 區塊大小 (會調整為 256 KiB 的倍數)
+
+    Returns:
+        (資料列數, 位元組數)
+    """
+    chunk_bytes = aligned_chunk_size(chunk_bytes)
+    counter = {}
+    upload_csv_chunks(blob, iter_csv_chunks(rows, columns, chunk_bytes, counter), counter, chunk_bytes)
+    return counter['rows'], counter['bytes']
@@ -0,0 +1,252 @@
+"""
+Document AI 多處理器分派
+依路由設定將文件送到指定處理器，或同時送往多個處理器 (例如 OCR + 發票解析) 並合併實體。
+可先經由分類處理器判斷文件類型，再送往對應的處理器。
+
+處理器登錄表由 DOCAI_PROCESSORS (JSON) 設定，例如:
+  {"ocr": {"id": "abc123", "cost_per_page": 0.0015},
+   "invoice": {"id": "def456", "cost_per_page": 0.01},
+   "classifier": {"id": "ghi789", "cost_per_page": 0.005}}
+名稱 default 固定對應 DOCAI_PROCESSOR_ID。
+"""
+
+import os
+import json
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from google.cloud import documentai_v1 as documentai
+
+from config import metrics
+from config import deadline
+from config.dependency_guard import get_dependency
+
+DOCAI_FANOUT_WORKERS = int(os.environ.get('DOCAI_FANOUT_WORKERS', '4'))
+# 單次處理器呼叫的逾時上限 (呼叫期限的剩餘時間較短時以剩餘時間為準)
+DOCAI_TIMEOUT_SECONDS = float(os.environ.get('DOCAI_TIMEOUT_SECONDS', '120'))
+DEFAULT_PROCESSOR_NAME = 'default'
+
+
+class ProcessorSpec(NamedTuple):
+    """處理器設定"""
+    name: str
+    processor_id: str
+    cost_per_page: float = 0.0
+
+
+def load_registry(default_processor_id: Optional[str],
+                  config_json: Optional[str] = None) -> Dict[str, ProcessorSpec]:
+    """
+    建立處理器登錄表
+
+    Args:
+        default_processor_id: DOCAI_PROCESSOR_ID
+        config_json: DOCAI_PROCESSORS 的 JSON 內容
+
+    Returns:
+        名稱 -> 處理器設定
+    """
+    registry = {}
+    if default_processor_id:
+        registry[DEFAULT_PROCESSOR_NAME] = ProcessorSpec(DEFAULT_PROCESSOR_NAME, default_processor_id)
+
+    config_json = config_json if config_json is not None else os.environ.get('DOCAI_PROCESSORS')
+    if config_json:
+        for name, config in json.loads(config_json).items():
+            registry[name] = ProcessorSpec(
+                name=name,
+                processor_id=config['id'],
+                cost_per_page=float(config.get('cost_per_page', 0.0)),
+            )
+    return registry
+
+
+def _shift_anchors(entity, offset: int):
+    """將實體 (含子屬性) 的文字錨點位移 offset 個字元"""
+    for segment in entity.text_anchor.text_segments:
+        segment.start_index += offset
+        segment.end_index += offset
+    for child in entity.properties:
+        _shift_anchors(child, offset)
+
+
+def merge_documents(documents: Sequence[documentai.Document]) -> documentai.Document:
+    """
+    合併多個處理器的結果：以第一份 (通常為 OCR) 的文字與頁面為基礎，附加其他結果的實體
+
+    其他處理器的實體錨點指向各自的 text；文字與第一份不同時，將該文字附加在合併結果的 text 之後
+    (以換行分隔) 並位移錨點，使錨點仍指向原本的內容。
+
+    Args:
+        documents: 依處理器順序排列的結果
+
+    Returns:
+        合併後的文件
+    """
+    merged = documentai.Document()
+    merged_pb = documentai.Document.pb(merged)
+    merged_pb.CopyFrom(documentai.Document.pb(documents[0]))
+    base_text = merged_pb.text
+    for other in documents[1:]:
+        other_pb = documentai.Document.pb(other)
+        entities = list(other_pb.entities)
+        if other_pb.text and other_pb.text != base_text:
+            offset = len(merged_pb.text) + 1
+            merged_pb.text += '\n' + other_pb.text
+            entities = [type(entity)() for entity in entities]
+            for shifted, entity in zip(entities, other_pb.entities):
+                shifted.CopyFrom(entity)
+                _shift_anchors(shifted, offset)
+        merged_pb.entities.extend(entities)
+    return merged
+
+
+class DocumentDispatcher:
+    """Document AI 分派器"""
+
+    def __init__(self, client, registry: Dict[str, ProcessorSpec], project_id: str,
+                 location: str, max_workers: int = DOCAI_FANOUT_WORKERS):
+        """
+        初始化分派器
+
+        Args:
+            client: DocumentProcessorServiceClient (或相同介面的測試替身)
+            registry: 處理器登錄表
+            project_id: GCP 專案 ID
+            location: Document AI 區域
+            max_workers: 同時呼叫的處理器數量上限
+        """
+        self.client = client
+        self.registry = registry
+        self.project_id = project_id
+        self.location = location
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='docai-dispatch')
+        # 設定重新載入後由新的分派器取代；進行中的處理完成後才關閉執行緒池
+        self._state_lock = threading.Lock()
+        self._active = 0
+        self._retired = False
+        self._closed = False
+
+    def retire(self):
+        """停止使用此分派器: 沒有進行中的處理時立即關閉執行緒池，否則由最後一個處理完成時關閉"""
+        with self._state_lock:
+            self._retired = True
+            idle = self._active == 0 and not self._closed
+            if idle:
+                self._closed = True
+        if idle:
+            self.executor.shutdown(wait=False)
+
+    def resolve(self, name: str) -> ProcessorSpec:
+        """依名稱取得處理器；未登錄的名稱視為處理器 ID"""
+        spec = self.registry.get(name)
+        if spec is None:
+            spec = ProcessorSpec(name=name, processor_id=name)
+        return spec
+
+    def call(self, spec: ProcessorSpec, gcs_uri: str, mime_type: str) -> documentai.Document:
+        """呼叫單一處理器並記錄耗時、頁數與成本"""
+        request_payload = documentai.ProcessRequest(
+            name=self.client.processor_path(self.project_id, self.location, spec.processor_id),
+            gcs_document=documentai.GcsDocument(gcs_uri=gcs_uri, mime_type=mime_type)
+        )
+
+        started = time.perf_counter()
+        try:
+            # Document AI 異常時 (斷路器開啟) 立即失敗，不等待逾時
+            result = get_dependency('docai').call(self.client.process_document, request=request_payload,
+                                                  timeout=deadline.timeout_for(DOCAI_TIMEOUT_SECONDS))
+        except Exception:
+            metrics.increment(f"docai.{spec.name}.errors")
+            raise
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        document = result.document
+        pages = len(document.pages)
+        metrics.observe(f"docai.{spec.name}.latency_ms", latency_ms)
+        metrics.increment(f"docai.{spec.name}.calls")
+        metrics.increment(f"docai.{spec.name}.pages", pages)
+        metrics.increment(f"docai.{spec.name}.cost_usd", pages * spec.cost_per_page)
+        print(f"處理器 {spec.name} 完成: {pages} 頁，耗時 {latency_ms:.0f} ms")
+        return document
+
+    def classify(self, classifier: str, gcs_uri: str, mime_type: str) -> Optional[str]:
+        """以分類處理器判斷文件類型，回傳信心度最高的類別"""
+        document = self.call(self.resolve(classifier), gcs_uri, mime_type)
+        if not document.entities:
+            return None
+        best = max(document.entities, key=lambda entity: entity.confidence)
+        print(f"分類結果: {best.type_} ({best.confidence:.2f})")
+        return best.type_
+
+    def warm_up(self, timeout: float) -> Optional[str]:
+        """
+        預熱: 讀取預設處理器的中繼資料 (不處理文件)，建立 gRPC 通道並取得存取權杖
+
+        Args:
+            timeout: 逾時秒數
+
+        Returns:
+            讀取的處理器名稱，沒有登錄處理器時為 None
+        """
+        if not self.registry:
+            return None
+        spec = self.registry.get(DEFAULT_PROCESSOR_NAME) or next(iter(self.registry.values()))
+        self.client.get_processor(
+            name=self.client.processor_path(self.project_id, self.location, spec.processor_id),
+            timeout=timeout
+        )
+        return spec.name
+
+    def process(self, gcs_uri: str, mime_type: str, processors: Sequence[str] = (),
+                classifier: Optional[str] = None) -> documentai.Document:
+        """
+        處理文件
+
+        Args:
+            gcs_uri: 文件位置
+            mime_type: MIME 類型
+            processors: 處理器名稱 (或 ID) 列表，多個時並行呼叫後合併
+            classifier: 分類處理器名稱；分類結果若為已登錄的處理器名稱，改送往該處理器
+
+        Returns:
+            處理結果 (多個處理器時為合併結果)
+        """
+        with self._state_lock:
+            self._active += 1
+        try:
+            return self._process(gcs_uri, mime_type, processors, classifier)
+        finally:
+            with self._state_lock:
+                self._active -= 1
+                idle = self._retired and self._active == 0 and not self._closed
+                if idle:
+                    self._closed = True
+            if idle:
+                self.executor.shutdown(wait=False)
+
+    def _process(self, gcs_uri: str, mime_type: str, processors: Sequence[str],
+                 classifier: Optional[str]) -> documentai.Document:
+        names: List[str] = list(processors) or [DEFAULT_PROCESSOR_NAME]
+        if classifier:
+            label = self.classify(classifier, gcs_uri, mime_type)
+            if label and label in self.registry:
+                names = [label]
+
+        specs = [self.resolve(name) for name in names]
+        if len(specs) == 1:
+            return self.call(specs[0], gcs_uri, mime_type)
+
+        if self._closed:
+            # 取得舊分派器後才開始處理的呼叫端 (執行緒池已關閉): 依序呼叫
+            return merge_documents([self.call(spec, gcs_uri, mime_type) for spec in specs])
+
+        print(f"並行送往處理器: {', '.join(spec.name for spec in specs)}")
+        # 在呼叫端的 context 中執行，沿用本次呼叫的期限
+        futures = [self.executor.submit(contextvars.copy_context().run, self.call, spec, gcs_uri, mime_type)
+                   for spec in specs]
+        return merge_documents([future.result() for future in futures])
@@ -0,0 +1,209 @@
+"""
+Document AI 結果擷取
+逐列產生實體與表格儲存格資料 (generator)，讓 CSV 輸出與結果索引不必一次持有整份結果。
+直接讀取底層 protobuf，避免大量儲存格時 proto-plus 包裝的額外成本。
+
+兩種模式 (EXTRACTION_MODE):
+  flat   - 實體與表格儲存格攤平成 type/value/confidence/page 列 (預設)
+  tables - 保留表格結構，每個表格輸出一份整齊的資料 (表頭解析後的欄名、列索引、儲存格信心度)
+"""
+
+from typing import Iterator, List, NamedTuple, Tuple
+
+from google.cloud import documentai_v1 as documentai
+
+# CSV 與結果索引共用的欄位
+STRUCTURED_COLUMNS = ('type', 'value', 'confidence', 'page')
+
+# 表格模式每個表格輸出的欄位 (一列一個儲存格)
+TABLE_COLUMNS = ('table_id', 'page', 'row_index', 'column_index', 'column', 'value', 'confidence')
+
+
+class TableFrame(NamedTuple):
+    """單一表格的擷取結果"""
+    table_id: str
+    page: int
+    columns: Tuple[str, ...]
+    row_count: int
+    cells: List[dict]
+
+
+def layout_text(text: str, layout) -> str:
+    """
+    依 layout 的 text_anchor 從文件全文取出對應文字
+
+    Args:
+        text: Document.text
+        layout: Document AI Layout (protobuf)
+    """
+    segments = layout.text_anchor.text_segments
+    if len(segments) == 1:
+        return text[segments[0].start_index:segments[0].end_index].strip()
+    return ''.join(text[segment.start_index:segment.end_index] for segment in segments).strip()
+
+
+def _to_pb(document):
+    """取得底層 protobuf (已是 protobuf 時直接回傳)"""
+    return documentai.Document.pb(document) if isinstance(document, documentai.Document) else document
+
+def iter_entity_data(document) -> Iterator[dict]:
+    """只產生實體列 (表格模式下表格另外輸出)"""
+    pb = _to_pb(document)
+    for entity in pb.entities:
+        page_refs = entity.page_anchor.page_refs
+        yield {
+            'type': entity.type_,
+            'value': entity.mention_text,
+            'confidence': entity.confidence,
+            'page': page_refs[0].page if page_refs else None
+        }
+
+def iter_structured_data(document) -> Iterator[dict]:
+    """
+    逐列產生結構化資料 (實體、表頭、表格內容)
+
+    Args:
+        document: Document AI 結果
+
+    Yields:
+        {'type', 'value', 'confidence', 'page'}
+    """
+    pb = _to_pb(document)
+    text = pb.text
+
+    # 提取實體 (Entities)
+    yield from iter_entity_data(pb)
+
+    # 提取表格 (Tables)
+    for page in pb.pages:
+        page_number = page.page_number
+        for table in page.tables:
+            for row_type, rows in (('table_header', table.header_rows), ('table_body', table.body_rows)):
+                for row in rows:
+                    for cell in row.cells:
+                        yield {
+                            'type': row_type,
+                            'value': layout_text(text, cell.layout),
+                            'confidence': 1.0,
+                            'page': page_number
+                        }
+
+
+def extract_structured_data(document) -> list:
+    """從 Document AI 結果中提取結構化資料 (完整列表)"""
+    return list(iter_structured_data(document))
+
+
+def _scan_cells(rows):
+    """
+    逐格讀取一次 protobuf: 依 row_span / col_span 計算位置，並收集 text_anchor 位移與信心度
+
+    Returns:
+        (位置 [(列索引, 欄索引, 欄跨距)], 文字位移 [(start, end)], 多段文字 {索引: [(start, end)]}, 信心度)
+    """
+    positions = []
+    spans = []
+    multi = {}
+    confidences = []
+    # 只記錄被上方跨列儲存格佔用的位置 (同一列由欄指標處理)
+    occupied = set()
+    for row_index, row in enumerate(rows):
+        column = 0
+        for cell in row.cells:
+            while occupied and (row_index, column) in occupied:
+                occupied.discard((row_index, column))
+                column += 1
+            col_span = cell.col_span or 1
+            row_span = cell.row_span
+            positions.append((row_index, column, col_span))
+            if row_span > 1:
+                for extra_row in range(row_index + 1, row_index + row_span):
+                    for extra_column in range(column, column + col_span):
+                        occupied.add((extra_row, extra_column))
+            column += col_span
+
+            layout = cell.layout
+            confidences.append(layout.confidence)
+            segments = layout.text_anchor.text_segments
+            if len(segments) == 1:
+                segment = segments[0]
+                spans.append((segment.start_index, segment.end_index))
+            else:
+                if segments:
+                    multi[len(spans)] = [(segment.start_index, segment.end_index) for segment in segments]
+                spans.append((0, 0))
+    return positions, spans, multi, confidences
+
+
+def _resolve_texts(text: str, spans, multi) -> List[str]:
+    """以收集好的位移對 document.text 做一輪切片，取得所有儲存格文字"""
+    values = [text[start:end].strip() for start, end in spans]
+    for index, segment_spans in multi.items():
+        values[index] = ''.join(text[start:end] for start, end in segment_spans).strip()
+    return values
+
+
+def _column_names(header_positions, header_values, column_count) -> Tuple[str, ...]:
+    """由表頭列決定欄名 (多列表頭以 " / " 串接，空白或重複的欄名自動補上編號)"""
+    parts = [[] for _ in range(column_count)]
+    for (_, column, col_span), value in zip(header_positions, header_values):
+        if not value:
+            continue
+        for target in range(column, min(column + col_span, column_count)):
+            if not parts[target] or parts[target][-1] != value:
+                parts[target].append(value)
+
+    names = []
+    seen = {}
+    for index, column_parts in enumerate(parts):
+        name = ' / '.join(column_parts) or f"column_{index + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 1
+        names.append(name)
+    return tuple(names)
+
+
+def iter_tables(document) -> Iterator[TableFrame]:
+    """
+    逐一產生保留結構的表格
+
+    Args:
+        document: Document AI 結果
+
+    Yields:
+        TableFrame (cells 的欄位見 TABLE_COLUMNS)
+    """
+    pb = _to_pb(document)
+    text = pb.text
+
+    for page in pb.pages:
+        page_number = page.page_number
+        for table_index, table in enumerate(page.tables):
+            table_id = f"p{page_number}_t{table_index + 1}"
+            header_positions, header_spans, header_multi, _ = _scan_cells(table.header_rows)
+            positions, spans, multi, confidences = _scan_cells(table.body_rows)
+            header_values = _resolve_texts(text, header_spans, header_multi)
+            values = _resolve_texts(text, spans, multi)
+
+            column_count = max(
+                [column + col_span for _, column, col_span in header_positions + positions] or [0]
+            )
+            columns = _column_names(header_positions, header_values, column_count)
+
+            cells = [
+                {
+                    'table_id': table_id,
+                    'page': page_number,
+                    'row_index': row_index,
+                    'column_index': column,
+                    'column': columns[column],
+                    'value': value,
+                    'confidence': round(confidence, 4)
+                }
+                for (row_index, column, _), value, confidence in zip(positions, values, confidences)
+            ]
+            yield TableFrame(table_id, page_number, columns, len(table.body_rows), cells)
+
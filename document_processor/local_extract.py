@@ -0,0 +1,320 @@
+"""
+本地擷取 (不經 Document AI 的快速路徑)
+已有文字層或結構化格式的檔案直接在本行程解析，產生與 Document AI 相同結構的 Document
+(文字、頁面、表格儲存格皆以 text_anchor 指向全文)，後續的 JSON / CSV / 表格輸出與結果索引不需區分來源。
+
+支援格式:
+  .txt / .md   - 文字 (UTF-8，失敗時嘗試 Big5)，以換頁字元 (\\f) 分頁
+  .xlsx        - 每個工作表一頁、一個表格 (第一個非空白列為表頭)，直接讀取 OOXML，不需要 openpyxl
+  .docx        - 段落文字與表格
+  .pptx        - 每張投影片一頁的文字
+  .pdf         - 需要 pypdf；每頁都有足夠文字時使用文字層，掃描頁 (無文字層) 交給 Document AI OCR
+
+無法在本地擷取時回傳 None，由呼叫端決定是否送往 Document AI。
+"""
+
+import io
+import os
+import re
+import zipfile
+import importlib.util
+import posixpath
+from typing import List, Optional, Sequence
+from xml.etree import ElementTree
+
+from google.cloud import documentai_v1 as documentai
+
+from config.env_manager import get_settings
+
+_NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'pkg': 'http://schemas.openxmlformats.org/package/2006/relationships',
+    'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+}
+_CELL_REF = re.compile(r'([A-Z]+)(\d+)')
+
+
+class _DocumentBuilder:
+    """逐步建立 Document protobuf (全文與 text_anchor 位置同步累積)"""
+
+    def __init__(self, mime_type: str):
+        self.pb = documentai.Document.pb(documentai.Document())
+        self.pb.mime_type = mime_type
+        self._parts = []
+        self._length = 0
+
+    def add_text(self, text: str, separator: str = '') -> tuple:
+        """加入文字，回傳 (start, end)"""
+        start = self._length
+        self._parts.append(text)
+        self._length += len(text)
+        end = self._length
+        if separator:
+            self._parts.append(separator)
+            self._length += len(separator)
+        return start, end
+
+    def add_page(self):
+        """新增一頁，回傳 (頁面, 頁面文字的起點)；頁面內容加入後呼叫 end_page"""
+        page = self.pb.pages.add(page_number=len(self.pb.pages) + 1)
+        page.layout.confidence = 1.0
+        return page, self._length
+
+    def end_page(self, page, page_start: int):
+        """頁面 layout 指向 page_start 到目前為止的文字"""
+        if self._length > page_start:
+            page.layout.text_anchor.text_segments.add(start_index=page_start, end_index=self._length)
+
+    def add_table(self, page, rows: Sequence[Sequence[str]], header_rows: int = 1):
+        """新增表格 (儲存格信心度為 1.0，空白儲存格沒有 text_anchor)"""
+        table = page.tables.add()
+        width = max((len(row) for row in rows), default=0)
+        for index, values in enumerate(rows):
+            row = table.header_rows.add() if index < header_rows else table.body_rows.add()
+            for column in range(width):
+                value = values[column] if column < len(values) else ''
+                cell = row.cells.add(row_span=1, col_span=1)
+                cell.layout.confidence = 1.0
+                if value:
+                    start, end = self.add_text(value)
+                    cell.layout.text_anchor.text_segments.add(start_index=start, end_index=end)
+                if column < width - 1:
+                    self.add_text('\t')
+            self.add_text('\n')
+        return table
+
+    def build(self):
+        self.pb.text = ''.join(self._parts)
+        return self.pb
+
+
+def _read_xml(archive: zipfile.ZipFile, name: str):
+    """讀取壓縮檔中的 XML (超過大小上限時拋出 ValueError)"""
+    info = archive.getinfo(name)
+    # 解壓縮後的 XML 大小上限，避免異常檔案耗盡記憶體
+    if info.file_size > get_settings().get_int('LOCAL_MAX_XML_BYTES', 200 * 1024 * 1024):
+        raise ValueError(f"{name} 解壓縮後過大 ({info.file_size} bytes)")
+    return ElementTree.fromstring(archive.read(name))
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + (ord(letter) - 64)
+    return index - 1
+
+
+def _xlsx_shared_strings(archive) -> List[str]:
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    root = _read_xml(archive, 'xl/sharedStrings.xml')
+    # 每個 si 可能是單一 t 或多個 rich text run (r/t)
+    return [''.join(node.text or '' for node in item.iter(f"{{{_NS['main']}}}t"))
+            for item in root.findall('main:si', _NS)]
+
+
+def _xlsx_sheets(archive):
+    """依活頁簿順序回傳 [(工作表名稱, XML 路徑)]"""
+    workbook = _read_xml(archive, 'xl/workbook.xml')
+    relations = _read_xml(archive, 'xl/_rels/workbook.xml.rels')
+    targets = {rel.get('Id'): rel.get('Target') for rel in relations.findall('pkg:Relationship', _NS)}
+    sheets = []
+    for sheet in workbook.findall('main:sheets/main:sheet', _NS):
+        target = targets.get(sheet.get(f"{{{_NS['rel']}}}id"), '')
+        path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        sheets.append((sheet.get('name'), path))
+    return sheets
+
+
+def _xlsx_rows(archive, path, shared_strings) -> List[List[str]]:
+    """讀取工作表的儲存格值 (依列、欄位置排列，略過完全空白的列)"""
+    root = _read_xml(archive, path)
+    rows = []
+    for row in root.iterfind('main:sheetData/main:row', _NS):
+        values = []
+        for cell in row.findall('main:c', _NS):
+            match = _CELL_REF.match(cell.get('r', ''))
+            column = _column_index(match.group(1)) if match else len(values)
+            cell_type = cell.get('t')
+            if cell_type == 'inlineStr':
+                value = ''.join(node.text or '' for node in cell.iter(f"{{{_NS['main']}}}t"))
+            else:
+                raw = cell.findtext('main:v', default='', namespaces=_NS)
+                if cell_type == 's' and raw:
+                    value = shared_strings[int(raw)]
+                elif cell_type == 'b':
+                    value = 'TRUE' if raw == '1' else 'FALSE'
+                else:
+                    value = raw
+            if column >= len(values):
+                values.extend([''] * (column - len(values) + 1))
+            values[column] = value.strip()
+        if any(values):
+            rows.append(values)
+    return rows
+
+
+def extract_xlsx(data: bytes):
+    """解析 .xlsx (每個工作表一頁、一個表格)"""
+    builder = _DocumentBuilder('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        shared_strings = _xlsx_shared_strings(archive)
+        for _, path in _xlsx_sheets(archive):
+            rows = _xlsx_rows(archive, path, shared_strings)
+            page, page_start = builder.add_page()
+            if rows:
+                builder.add_table(page, rows)
+            builder.end_page(page, page_start)
+    return builder.build()
+
+
+def _docx_paragraph(paragraph) -> str:
+    return ''.join(node.text or '' for node in paragraph.iter(f"{{{_NS['w']}}}t")).strip()
+
+
+def extract_docx(data: bytes):
+    """解析 .docx (段落文字與表格，整份文件為一頁)"""
+    builder = _DocumentBuilder('application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        body = _read_xml(archive, 'word/document.xml').find('w:body', _NS)
+    page, page_start = builder.add_page()
+    for element in body if body is not None else ():
+        if element.tag == f"{{{_NS['w']}}}p":
+            text = _docx_paragraph(element)
+            if text:
+                builder.add_text(text, '\n')
+        elif element.tag == f"{{{_NS['w']}}}tbl":
+            rows = [[' '.join(filter(None, (_docx_paragraph(p) for p in cell.findall('w:p', _NS))))
+                     for cell in row.findall('w:tc', _NS)]
+                    for row in element.findall('w:tr', _NS)]
+            if rows:
+                builder.add_table(page, rows)
+    builder.end_page(page, page_start)
+    return builder.build()
+
+
+def extract_pptx(data: bytes):
+    """解析 .pptx (每張投影片一頁)"""
+    builder = _DocumentBuilder('application/vnd.openxmlformats-officedocument.presentationml.presentation')
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        slides = sorted(
+            (name for name in archive.namelist() if re.fullmatch(r'ppt/slides/slide\d+\.xml', name)),
+            key=lambda name: int(re.search(r'(\d+)', name.rsplit('/', 1)[1]).group(1))
+        )
+        for name in slides:
+            page, page_start = builder.add_page()
+            for paragraph in _read_xml(archive, name).iter(f"{{{_NS['a']}}}p"):
+                text = ''.join(node.text or '' for node in paragraph.iter(f"{{{_NS['a']}}}t")).strip()
+                if text:
+                    builder.add_text(text, '\n')
+            builder.end_page(page, page_start)
+    return builder.build()
+
+
+def extract_text(data: bytes, mime_type: str = 'text/plain'):
+    """解析純文字 (以換頁字元分頁)"""
+    for encoding in ('utf-8-sig', 'big5'):
+        try:
+            text = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        text = data.decode('utf-8', errors='replace')
+
+    builder = _DocumentBuilder(mime_type)
+    for page_text in text.split('\f'):
+        page, page_start = builder.add_page()
+        builder.add_text(page_text)
+        builder.end_page(page, page_start)
+    return builder.build()
+
+
+def extract_pdf(data: bytes, min_chars: Optional[int] = None):
+    """
+    讀取 PDF 文字層 (需要 pypdf)
+
+    Args:
+        data: PDF 內容
+        min_chars: 每頁至少要有的文字數，低於此值視為掃描頁 (需要 OCR)；預設依 LOCAL_PDF_MIN_CHARS
+
+    Returns:
+        Document；未安裝 pypdf、無法解析或任何一頁文字不足 (掃描頁) 時回傳 None
+    """
+    if min_chars is None:
+        min_chars = get_settings().get_int('LOCAL_PDF_MIN_CHARS', 20)
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        page_texts = [(page.extract_text() or '').strip() for page in reader.pages]
+    except Exception as e:
+        print(f"⚠️ 無法讀取 PDF 文字層: {e}")
+        return None
+    if not page_texts or any(len(text) < min_chars for text in page_texts):
+        return None
+
+    builder = _DocumentBuilder('application/pdf')
+    for text in page_texts:
+        page, page_start = builder.add_page()
+        builder.add_text(text, '\n')
+        builder.end_page(page, page_start)
+    return builder.build()
+
+
+# 副檔名 -> 擷取函式
+EXTRACTORS = {
+    '.txt': extract_text,
+    '.md': lambda data: extract_text(data, 'text/markdown'),
+    '.xlsx': extract_xlsx,
+    '.docx': extract_docx,
+    '.pptx': extract_pptx,
+    '.pdf': extract_pdf,
+}
+
+
+_pypdf_available = None
+
+
+def pdf_supported() -> bool:
+    """是否已安裝 pypdf (只檢查一次)"""
+    global _pypdf_available
+    if _pypdf_available is None:
+        _pypdf_available = importlib.util.find_spec('pypdf') is not None
+    return _pypdf_available
+
+
+def supports(file_name: str) -> bool:
+    """是否有對應的本地擷取函式 (.pdf 需要已安裝 pypdf，否則下載後必定交給 Document AI)"""
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == '.pdf':
+        return pdf_supported()
+    return extension in EXTRACTORS
+
+
+def extract_local(file_name: str, data: bytes) -> Optional[documentai.Document]:
+    """
+    在本地擷取文件
+
+    Args:
+        file_name: 檔案名稱 (依副檔名選擇擷取函式)
+        data: 檔案內容
+
+    Returns:
+        Document (proto-plus)；不支援或需要 OCR 時回傳 None
+    """
+    extractor = EXTRACTORS.get(os.path.splitext(file_name)[1].lower())
+    if extractor is None:
+        return None
+    try:
+        pb = extractor(data)
+    except Exception as e:
+        # 格式異常的檔案可能拋出任何例外 (例如共用字串索引超出範圍、缺少節點)，交由呼叫端改送 Document AI
+        print(f"⚠️ 本地擷取失敗 ({type(e).__name__}): {e}")
+        return None
+    return documentai.Document.wrap(pb) if pb is not None else None
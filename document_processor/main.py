@@ -1,150 +1,539 @@
 import os
+import sys
 import json
-import pandas as pd
-from datetime import datetime
+import time
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from datetime import datetime, timezone
 from google.cloud import documentai_v1 as documentai
 from google.cloud import storage
-from dotenv import load_dotenv
 
-# --- 初始化 ---
-if os.environ.get('FUNCTIONS_FRAMEWORK') is None:
-    load_dotenv()
+# 共用模組 (config/) 位於專案根目錄；部署時由部署腳本複製到函式目錄
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.append(str(project_root))
 
-# --- 從環境變數讀取設定 ---
-PROJECT_ID = os.environ.get('GCP_PROJECT')
-LOCATION = os.environ.get('DOCAI_LOCATION')
-PROCESSOR_ID = os.environ.get('DOCAI_PROCESSOR_ID')
-PROCESSED_BUCKET_NAME = os.environ.get('PROCESSED_BUCKET_NAME')
+# 載入設定快照 (環境變數檔案的搜尋、載入與重新載入由 config.env_manager 負責)
+from config.env_manager import env_manager, get_settings, reload_settings_if_changed, require_settings
+from config.file_routes import resolve_route, record_route
+from config.file_routes import get_mime_type as lookup_mime_type
+from config.retry_ledger import get_ledger, STATUS_DONE, STATUS_DEAD
+from config.fair_scheduler import get_scheduler, ANONYMOUS_TENANT
+from config.tenant_quota import get_quota
+from config.progress_notifier import ProgressNotifier, line_push_sender
+from config.object_layout import result_base_name, md5_hex, find_results
+from config import metrics
+from config.dependency_guard import get_dependency, DependencyUnavailable
+from config import deadline
+from config.deadline import DeadlineExceeded
+from config import profiling
+from config import warmup
+from result_index import build_document_record
+from results_sink import get_result_sink
+from dispatch import DocumentDispatcher, load_registry
+from extraction import iter_structured_data
+from csv_export import upload_csv_chunks, aligned_chunk_size, CSV_CHUNK_BYTES
+from rendering import iter_csv_outputs, render_results, iter_file_chunks
+from cpu_pool import get_cpu_executor
+from result_store import encode_result, decode_result, RESULT_SUFFIX, RESULT_CONTENT_TYPE
+from local_extract import extract_local, supports as supports_local
+from archive_expand import expand_archive, supports as supports_archive, ArchiveRejected, read_chunk_bytes
+from result_compaction import find_compacted, read_entry
 
 # 初始化 GCP 客戶端
 docai_client = documentai.DocumentProcessorServiceClient()
 storage_client = storage.Client()
 
+# 部署後缺少時啟動失敗，重新載入時缺少則保留原設定
+require_settings('GCP_PROJECT', 'DOCAI_LOCATION', 'PROCESSED_BUCKET_NAME')
+
+def build_dispatcher(settings):
+    """依設定快照建立 Document AI 分派器"""
+    return DocumentDispatcher(
+        docai_client,
+        load_registry(settings.docai_processor_id, settings.get('DOCAI_PROCESSORS')),
+        settings.gcp_project,
+        settings.docai_location
+    )
+
+dispatcher = build_dispatcher(get_settings())
+
+def _on_settings_reload(settings):
+    """設定重新載入時重建分派器 (處理器 ID 可能已變更)；舊分派器等進行中的處理完成後才關閉"""
+    global dispatcher
+    previous = dispatcher
+    dispatcher = build_dispatcher(settings)
+    previous.retire()
+
+env_manager.on_reload(_on_settings_reload)
+
+# 處理完成 / 失敗通知 (PROGRESS_NOTIFY_PROCESSOR 啟用時)，每次呼叫結束前送出
+progress = ProgressNotifier(line_push_sender(lambda: get_settings().line_channel_access_token), window_seconds=0)
+
+def warm_storage():
+    """取得 Cloud Storage 存取權杖並建立連線 (讀取不存在物件的中繼資料)"""
+    bucket = storage_client.bucket(get_settings().bucket_name)
+    bucket.blob(f"{warmup.object_prefix()}ping").exists(timeout=warmup.timeout_seconds())
+
+def warm_docai():
+    """建立 Document AI 的 gRPC 通道 (讀取處理器中繼資料，不處理文件)"""
+    return {'processor': dispatcher.warm_up(warmup.timeout_seconds())}
+
+def warm_result_sink():
+    """開啟結果索引的資料庫連線池 (未設定 RESULT_INDEX_DSN 時不做任何事)"""
+    return {'enabled': get_result_sink(get_settings().result_index_dsn) is not None}
+
+def warm_imports():
+    """載入目前設定會用到的選用套件 (本地 PDF 擷取、zstd 壓縮)"""
+    modules = []
+    if local_extraction_enabled():
+        modules.append('pypdf')
+    if get_settings().get('RESULT_COMPRESSION', 'gzip') == 'zstd':
+        modules.append('zstandard')
+    return {'loaded': warmup.preload(*modules)}
+
+warmup.register('storage', warm_storage)
+warmup.register('docai', warm_docai)
+warmup.register('result_sink', warm_result_sink)
+warmup.register('imports', warm_imports)
+# CPU_EXECUTOR=process 時在預熱階段啟動行程池，第一個文件不必等待工作行程載入 (匯入本模組不會啟動行程池)
+warmup.register('cpu_pool', lambda: {'workers': get_cpu_executor().warm_up()})
+
+def notify_document_progress(event, stage, detail=None):
+    """通知上傳者文件的處理狀態"""
+    if not get_settings().get_bool('PROGRESS_NOTIFY_PROCESSOR'):
+        return
+    user_id = (event.get('metadata') or {}).get('line_user_id')
+    progress.update(user_id, event['name'], os.path.basename(event['name']), stage, detail=detail)
+
+# 暫時性錯誤 (期限不足、相依服務斷路器開啟或並行數已滿)；拋出例外讓 GCS 事件重送
+TRANSIENT_ERRORS = (DeadlineExceeded, DependencyUnavailable)
+
+def event_age_seconds(context):
+    """事件發生至今的秒數 (context 沒有時間戳記時為 None)"""
+    timestamp = getattr(context, 'timestamp', None)
+    if not timestamp:
+        return None
+    try:
+        created = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return (datetime.now(timezone.utc) - created).total_seconds()
+
 def process_document(event, context):
     """GCS 觸發的背景函式 (GCP上的進入點)"""
+    # 本次呼叫的期限 (FUNCTION_TIMEOUT_SECONDS)，各階段與網路呼叫的逾時依剩餘時間調整；
+    # 取樣到或接收器以標頭要求分析 (物件 metadata 帶有 line_profile) 時分析本次呼叫
+    metadata = event.get('metadata') or {}
+    with deadline.invocation(), profiling.request('document', forced=bool(metadata.get(profiling.PROFILE_METADATA_KEY)),
+                                                  file_name=event.get('name'), size=event.get('size')):
+        # 環境變數檔案變更時重新載入設定 (平常只是一次時間比較)
+        reload_settings_if_changed()
+        
+        try:
+            bucket_name = event['bucket']
+            file_name = event['name']
+            
+            # 重送超過 RETRY_MAX_EVENT_AGE_SECONDS 的事件不再處理，避免 --retry 無限重送
+            age = event_age_seconds(context)
+            if age is not None and age > get_settings().get_float('RETRY_MAX_EVENT_AGE_SECONDS', 3600):
+                print(f"☠️ 事件已超過重試時限 ({age:.0f} 秒)，放棄: {file_name}")
+                notify_document_progress(event, 'failed', detail='重試時間已超過上限，請重新上傳檔案')
+                return
+            
+            # 預熱用的物件 (例如排程寫入 _warmup/ping) 只預熱執行個體，不處理
+            if file_name.startswith(warmup.object_prefix()):
+                warmup.run()
+                return
+            
+            print(f"開始處理來自 {bucket_name} 的檔案: {file_name}")
+            
+            # 依共用路由表判斷是否需要處理，不支援的類型不呼叫 Document AI
+            route = resolve_route(file_name, event.get('contentType'))
+            profiling.annotate(route=route.name, engine=route.engine)
+            if not route.process:
+                record_route(route, 'skipped')
+                print(f"檔案類型不需處理 (路由: {route.name})，跳過: {file_name}")
+                return
+            
+            # 只能本地擷取的類型 (Office / 文字檔)，停用本地擷取或沒有擷取函式 (例如 .xls) 時跳過
+            if route.engine == 'local' and not (local_extraction_enabled() and supports_local(file_name)):
+                record_route(route, 'skipped')
+                print(f"無法在本地擷取 (路由: {route.name})，跳過: {file_name}")
+                return
+            
+            # 壓縮檔只展開支援的格式 (.zip)，其他 (.rar / .7z) 只儲存
+            if route.engine == 'archive' and not supports_archive(file_name):
+                record_route(route, 'skipped')
+                print(f"不支援展開此壓縮檔格式，跳過: {file_name}")
+                return
+            
+            # 超過租戶每日頁數額度時不呼叫 Document AI
+            tenant = get_event_tenant(event)
+            if not get_quota().allows(tenant):
+                record_route(route, 'over_quota')
+                print(f"🚫 租戶今日頁數額度已用完，跳過: {file_name}")
+                notify_document_progress(event, 'rejected')
+                return
+            
+            # 依重試帳本的檢查點執行，重送事件只重跑失敗的階段
+            job_id = f"{bucket_name}/{file_name}#{event.get('generation', '')}"
+            # 壓縮檔展開成員後由各成員各自觸發處理，不經 Document AI
+            is_archive = route.engine == 'archive'
+            job = get_ledger().start(job_id, 'archive' if is_archive else 'document', event)
+            if job['status'] == STATUS_DONE:
+                print(f"檔案 {file_name} 已處理完成，略過重送事件")
+                return
+            if job['status'] == STATUS_DEAD:
+                # 只能由 scripts/retry_jobs.py revive 恢復
+                record_route(route, 'dead')
+                print(f"☠️ 檔案 {file_name} 已在死信區，略過重送事件")
+                notify_document_progress(event, 'failed', detail='重試次數已達上限，請重新上傳檔案')
+                return
+            
+            # 經由租戶公平排程器執行，限制單一租戶在同一執行個體內的並行數
+            get_scheduler().run(tenant, profiling.attached(run_archive_job if is_archive else run_document_job),
+                                job, route)
+            
+            record_route(route, 'processed')
+            print(f"檔案 {file_name} 處理完成")
+            notify_document_progress(event, 'saved')
+            
+        except TRANSIENT_ERRORS as e:
+            # 階段尚未開始；拋出例外讓 GCS 事件重送 (部署時需加上 --retry)，重送時從檢查點繼續
+            print(f"⏰ {e}，等待事件重送: {file_name}")
+            notify_document_progress(event, 'deferred', detail=str(e))
+            raise
+            
+        except Exception as e:
+            # 其他錯誤重送也不會成功，已記錄到重試帳本 (可用 scripts/retry_jobs.py 重跑)，不觸發重送
+            print(f"處理文件時發生錯誤: {e}")
+            notify_document_progress(event, 'failed', detail=str(e))
+        
+        finally:
+            progress.flush(force=True)
+
+def run_document_job(job, route=None):
+    """依檢查點執行文件處理工作的剩餘階段 (擷取 → 儲存結果)，失敗時記錄到重試帳本，回傳擷取結果"""
+    ledger = get_ledger()
+    job_id = job['job_id']
+    event = job['payload']
+    bucket_name = event['bucket']
+    file_name = event['name']
+    route = route or resolve_route(file_name, event.get('contentType'))
+    processed = job['checkpoints'].get('processed')
+    stage = 'process'
+    
     try:
-        bucket_name = event['bucket']
-        file_name = event['name']
+        if processed and os.path.exists(processed['path']):
+            # 擷取已完成，從暫存的結果繼續
+            print(f"使用已處理的擷取結果: {processed['path']}")
+            with open(processed['path'], 'rb') as f:
+                document_bytes = f.read()
+            result = documentai.Document.deserialize(document_bytes)
+            processing_ms = processed['processing_ms']
+            engine = processed.get('engine', 'docai')
+        else:
+            started = time.perf_counter()
+            
+            # 處理文件 (沿用近似重複圖片的結果、本地擷取或 Document AI)
+            duplicate_of = (event.get('metadata') or {}).get('line_duplicate_of')
+            # 剩餘時間不足以完成擷取時不開始 (只能本地擷取的類型需要的時間較短)
+            with deadline.stage('extract' if route.engine == 'local' else 'process'):
+                result, engine = extract_document(bucket_name, file_name, route, duplicate_of, event.get('size'))
+            processing_ms = int((time.perf_counter() - started) * 1000)
+            if engine == 'docai':
+                # 只有 Document AI 處理的頁數計入租戶額度 (本地擷取與沿用的結果不計)
+                get_quota().consume(get_event_tenant(event), pages=len(result.pages))
+            
+            # 暫存結果，儲存失敗時重試不必再呼叫 Document AI
+            #   序列化結果同時作為 CPU 行程池的輸入
+            document_bytes = documentai.Document.serialize(result)
+            result_path = ledger.artifact_path(job_id, '.pb')
+            with open(result_path, 'wb') as f:
+                f.write(document_bytes)
+            ledger.checkpoint(job_id, 'processed', {'path': result_path, 'processing_ms': processing_ms,
+                                                    'engine': engine})
         
-        print(f"開始處理來自 {bucket_name} 的檔案: {file_name}")
+        stage = 'save'
         
-        # 處理文件
-        result = process_with_documentai(bucket_name, file_name)
+        # 儲存結果並寫入結果索引 (剩餘時間不足時保留暫存結果，重試時不必重新擷取)
+        processor = engine if engine != 'docai' else '+'.join(route.processors) or 'default'
+        with deadline.stage('save'):
+            save_results(file_name, result, document_bytes, processor=processor,
+                         content_hash=get_content_hash(event))
+            index_results(event, result, processing_ms)
         
-        # 儲存結果
-        save_results(file_name, result)
+        ledger.checkpoint(job_id, 'saved')
+        ledger.complete(job_id)
         
-        print(f"檔案 {file_name} 處理完成")
+        result_path = ledger.artifact_path(job_id, '.pb')
+        if os.path.exists(result_path):
+            os.remove(result_path)
+        return result
+        
+    except TRANSIENT_ERRORS as e:
+        # 階段尚未開始，不計入失敗次數
+        ledger.defer(job_id, stage, e)
+        raise
         
     except Exception as e:
-        print(f"處理文件時發生錯誤: {e}")
+        ledger.fail(job_id, stage, e)
         raise
 
-def process_with_documentai(bucket_name, file_name):
-    """使用 Document AI 處理文件"""
+def run_archive_job(job, route=None):
+    """
+    展開壓縮檔並上傳需要處理的成員 (由 Cloud Storage 串流讀取)，失敗時記錄到重試帳本
+
+    Returns:
+        展開統計；超過防護限制時回傳 None (不重試)
+    """
+    ledger = get_ledger()
+    job_id = job['job_id']
+    event = job['payload']
+    bucket = storage_client.bucket(event['bucket'])
+    
+    try:
+        with deadline.stage('expand'), bucket.blob(event['name']).open('rb', chunk_size=read_chunk_bytes()) as reader:
+            stats = expand_archive(reader, bucket, event['name'], metadata=event.get('metadata'))
+    except ArchiveRejected as e:
+        # 可疑的壓縮檔 (zip bomb) 重試也不會成功
+        metrics.increment('archive.rejected')
+        print(f"🚫 拒絕展開壓縮檔 {event['name']}: {e}")
+        ledger.complete(job_id)
+        return None
+    except TRANSIENT_ERRORS as e:
+        ledger.defer(job_id, 'expand', e)
+        raise
+    except Exception as e:
+        ledger.fail(job_id, 'expand', e)
+        raise
+    
+    print(f"📦 壓縮檔已展開: {stats['members']} 個成員，上傳 {stats['uploaded']} 個"
+          f" (已存在 {stats['existing']}，略過 {stats['skipped']})，{stats['seconds']:.1f} 秒")
+    ledger.complete(job_id)
+    return stats
+
+def replay_job(job):
+    """重跑重試帳本中的工作 (供 scripts/retry_jobs.py 使用)"""
+    if job['kind'] == 'archive':
+        run_archive_job(job)
+    else:
+        run_document_job(job)
+    return True
+
+def local_extraction_enabled():
+    return get_settings().get_bool('LOCAL_EXTRACTION', True)
+
+def should_extract_locally(file_name, route, size=None):
+    """
+    是否嘗試本地擷取；auto 路由 (例如 PDF) 的物件超過 LOCAL_AUTO_MAX_BYTES 時直接送交 Document AI，
+    不先下載整個檔案 (大型 PDF 多為掃描檔，本地擷取通常不會成功)
+    """
+    if route.engine not in ('local', 'auto') or not local_extraction_enabled() or not supports_local(file_name):
+        return False
+    if route.engine == 'auto' and size and int(size) > get_settings().get_int('LOCAL_AUTO_MAX_BYTES', 10 * 1024 * 1024):
+        metrics.increment('fastpath.too_large')
+        return False
+    return True
+
+def extract_document(bucket_name, file_name, route, duplicate_of=None, size=None):
+    """
+    擷取文件內容 (依路由的 engine 選擇本地擷取或 Document AI)
+
+    Args:
+        duplicate_of: 近似重複圖片的原圖物件名稱 (webhook 以感知雜湊判斷)，有結果時直接沿用
+        size: 物件大小 (GCS 事件的 size)，用於判斷是否值得下載後在本地擷取
+
+    Returns:
+        (Document, 'reuse'、'local' 或 'docai')
+    """
+    if duplicate_of:
+        document = load_previous_result(duplicate_of)
+        if document is not None:
+            metrics.increment('dedup.reused')
+            print(f"沿用近似重複圖片的結果 (不經 Document AI): {duplicate_of}")
+            return document, 'reuse'
+        metrics.increment('dedup.not_found')
+    
+    if should_extract_locally(file_name, route, size):
+        started = time.perf_counter()
+        data = get_dependency('gcs').call(storage_client.bucket(bucket_name).blob(file_name).download_as_bytes,
+                                          timeout=deadline.timeout_for(60))
+        document = extract_local(file_name, data)
+        if document is not None:
+            metrics.increment('fastpath.hit')
+            metrics.observe('fastpath.ms', (time.perf_counter() - started) * 1000)
+            print(f"本地擷取完成 (不經 Document AI)，頁數: {len(document.pages)}")
+            return document, 'local'
+        metrics.increment('fastpath.miss')
+    
+    if route.engine == 'local':
+        raise ValueError(f"無法在本地擷取: {file_name}")
+    
+    started = time.perf_counter()
+    document = process_with_documentai(bucket_name, file_name, route)
+    metrics.observe('docai.ms', (time.perf_counter() - started) * 1000)
+    return document, 'docai'
+
+def load_previous_result(source_name):
+    """讀取原始檔先前的處理結果 (.docpb 或 .json，小物件已壓實並刪除時讀取合併檔)，找不到時回傳 None"""
+    processed_bucket = storage_client.bucket(get_settings().processed_bucket_name)
+    for name in find_results(processed_bucket, source_name):
+        if name.endswith(RESULT_SUFFIX):
+            _, pb = decode_result(processed_bucket.blob(name).download_as_bytes())
+            return documentai.Document.wrap(pb)
+        if name.endswith('.json'):
+            return documentai.Document.from_json(processed_bucket.blob(name).download_as_text(),
+                                                 ignore_unknown_fields=True)
+    for entry in find_compacted(processed_bucket, source_name):
+        if entry['name'].endswith(RESULT_SUFFIX):
+            _, pb = decode_result(read_entry(processed_bucket, entry))
+            return documentai.Document.wrap(pb)
+        if entry['name'].endswith('.json'):
+            return documentai.Document.from_json(read_entry(processed_bucket, entry).decode('utf-8'),
+                                                 ignore_unknown_fields=True)
+    return None
+
+def process_with_documentai(bucket_name, file_name, route=None):
+    """使用 Document AI 處理文件 (依路由選擇處理器，多個處理器時並行處理並合併結果)"""
     gcs_uri = f"gs://{bucket_name}/{file_name}"
     
     # 根據檔案副檔名判斷 MIME 類型
     mime_type = get_mime_type(file_name)
     print(f"使用 MIME 類型: {mime_type}")
-
-    # 建立 Document AI 請求
-    gcs_document = documentai.GcsDocument(gcs_uri=gcs_uri, mime_type=mime_type)
-    request_payload = documentai.ProcessRequest(
-        name=docai_client.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID),
-        gcs_document=gcs_document
-    )
     
     # 呼叫 Document AI
     print("呼叫 Document AI...")
-    result = docai_client.process_document(request=request_payload)
-    document = result.document
+    document = dispatcher.process(
+        gcs_uri, mime_type,
+        processors=route.processors if route else (),
+        classifier=route.classifier if route else None
+    )
     
     print(f"Document AI 處理完成，頁數: {len(document.pages)}")
     
     return document
 
 def get_mime_type(file_name):
-    """根據檔案副檔名判斷 MIME 類型"""
-    file_extension = file_name.lower().split('.')[-1]
-    
-    mime_types = {
-        'pdf': 'application/pdf',
-        'png': 'image/png',
-        'jpg': 'image/jpeg',
-        'jpeg': 'image/jpeg',
-        'tiff': 'image/tiff',
-        'gif': 'image/gif'
-    }
-    
-    return mime_types.get(file_extension, 'application/pdf')
-
-def save_results(file_name, document):
-    """儲存處理結果"""
-    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    
-    # 1. 儲存原始 JSON 結果
-    json_blob_name = f"{timestamp}_{file_name}.json"
-    json_blob = storage_client.bucket(PROCESSED_BUCKET_NAME).blob(json_blob_name)
-    json_blob.upload_from_string(
-        documentai.Document.to_json(document),
-        content_type='application/json'
-    )
-    print(f"JSON 結果已儲存: {json_blob_name}")
+    """根據檔案副檔名判斷 MIME 類型 (查詢共用路由表)"""
+    return lookup_mime_type(file_name)
+
+def save_results(file_name, document, document_bytes=None, processor='default', content_hash=None):
+    """儲存處理結果 (JSON 轉換與 CSV 編碼依 CPU_EXECUTOR 在本行程或行程池中執行)"""
+    settings = get_settings()
+    # 結果名稱依 OBJECT_LAYOUT: results/yyyy/mm/dd/分片/雜湊_檔名 或舊格式 時間_檔名
+    result_base = result_base_name(file_name, content_hash)
+    processed_bucket = storage_client.bucket(settings.processed_bucket_name)
+    # 表格模式下 CSV 只包含實體，每個表格另存一份保留結構的 CSV
+    tables_mode = settings.get('EXTRACTION_MODE', 'flat') == 'tables'
+    # 原始結果格式: json (Document AI JSON) 或 protobuf (壓縮的 protobuf，見 result_store.py)
+    as_json = settings.get('RESULT_FORMAT', 'json') != 'protobuf'
+    chunk_bytes = aligned_chunk_size(CSV_CHUNK_BYTES)
+    executor = get_cpu_executor()
+    if document_bytes is None and (executor.offloads or not as_json):
+        document_bytes = documentai.Document.serialize(document)
     
-    # 2. 解析並儲存結構化資料
-    extracted_data = extract_structured_data(document)
-    if extracted_data:
-        csv_blob_name = f"{timestamp}_{file_name}.csv"
-        csv_blob = storage_client.bucket(PROCESSED_BUCKET_NAME).blob(csv_blob_name)
-        
-        df = pd.DataFrame(extracted_data)
-        csv_blob.upload_from_string(
-            df.to_csv(index=False, encoding='utf-8'),
-            content_type='text/csv'
+    spool_dir = tempfile.mkdtemp(prefix='render_') if executor.offloads else None
+    try:
+        return upload_results(processed_bucket, result_base, document, document_bytes, processor, executor,
+                              tables_mode, as_json, chunk_bytes, spool_dir)
+    finally:
+        if spool_dir:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+
+def upload_results(processed_bucket, result_base, document, document_bytes, processor, executor,
+                   tables_mode, as_json, chunk_bytes, spool_dir):
+    """產生並上傳原始結果與 CSV，回傳 CSV 資料列數"""
+    settings = get_settings()
+    json_text = json_path = None
+    if executor.offloads:
+        # 只傳遞序列化的 protobuf，工作行程將 JSON 與 CSV 寫入 spool_dir，由本行程逐塊讀取上傳
+        json_path, rendered = executor.run(
+            'render', render_results, document_bytes, tables_mode, chunk_bytes, spool_dir, as_json
         )
-        print(f"CSV 結果已儲存: {csv_blob_name}")
-        print("擷取的資料:")
-        print(df)
-
-def extract_structured_data(document):
-    """從 Document AI 結果中提取結構化資料"""
-    extracted_data = []
-    
-    # 提取實體 (Entities)
-    for entity in document.entities:
-        data = {
-            'type': entity.type_,
-            'value': entity.mention_text,
-            'confidence': entity.confidence,
-            'page': entity.page_anchor.page_refs[0].page if entity.page_anchor.page_refs else None
-        }
-        extracted_data.append(data)
-    
-    # 提取表格 (Tables)
-    for page in document.pages:
-        for table in page.tables:
-            for row in table.header_rows:
-                for cell in row.cells:
-                    data = {
-                        'type': 'table_header',
-                        'value': cell.text,
-                        'confidence': 1.0,
-                        'page': page.page_number
-                    }
-                    extracted_data.append(data)
-            
-            for row in table.body_rows:
-                for cell in row.cells:
-                    data = {
-                        'type': 'table_body',
-                        'value': cell.text,
-                        'confidence': 1.0,
-                        'page': page.page_number
-                    }
-                    extracted_data.append(data)
-    
-    return extracted_data
+        csv_outputs = [(suffix, iter_file_chunks(path, chunk_bytes), counter, shape)
+                       for suffix, path, counter, shape in rendered]
+    else:
+        json_text = executor.run('to_json', documentai.Document.to_json, document) if as_json else None
+        # 逐列編碼、分塊上傳，不在記憶體中組出完整 CSV
+        csv_outputs = iter_csv_outputs(document, tables_mode, chunk_bytes)
+    
+    # 1. 儲存原始結果
+    if as_json:
+        result_blob_name = f"{result_base}.json"
+        blob = processed_bucket.blob(result_blob_name)
+        if json_path:
+            get_dependency('gcs').call(blob.upload_from_filename, json_path, content_type='application/json',
+                                       timeout=deadline.timeout_for(60))
+        else:
+            get_dependency('gcs').call(blob.upload_from_string, json_text, content_type='application/json',
+                                       timeout=deadline.timeout_for(60))
+        print(f"JSON 結果已儲存: {result_blob_name}")
+    else:
+        # 壓縮在本行程執行 (zlib / zstd 壓縮時會釋放 GIL)
+        codec = settings.get('RESULT_COMPRESSION', 'gzip')
+        data = encode_result(document_bytes, processor, codec)
+        result_blob_name = f"{result_base}{RESULT_SUFFIX}"
+        get_dependency('gcs').call(processed_bucket.blob(result_blob_name).upload_from_string,
+                                   data, content_type=RESULT_CONTENT_TYPE,
+                                   timeout=deadline.timeout_for(60))
+        print(f"結果已儲存: {result_blob_name} ({codec}，{len(data)} bytes)")
+    
+    # 2. 儲存結構化資料
+    row_count = 0
+    for suffix, chunks, counter, shape in csv_outputs:
+        csv_blob_name = f"{result_base}{suffix}.csv"
+        get_dependency('gcs').call(upload_csv_chunks, processed_bucket.blob(csv_blob_name), chunks, counter, chunk_bytes)
+        row_count += counter['rows']
+        if shape:
+            print(f"表格已儲存: {csv_blob_name} ({shape[0]} 列 x {shape[1]} 欄，{counter['bytes']} bytes)")
+        elif counter['rows']:
+            print(f"CSV 結果已儲存: {csv_blob_name} ({counter['rows']} 筆，{counter['bytes']} bytes)")
+        else:
+            print("沒有擷取到結構化資料，略過 CSV")
+    
+    return row_count
+
+def get_document_hash(event):
+    """取得文件雜湊 (優先使用 GCS 提供的 md5Hash)"""
+    if event.get('md5Hash'):
+        return event['md5Hash']
+    source = f"{event['bucket']}/{event['name']}#{event.get('generation', '')}"
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def get_content_hash(event):
+    """原始檔的內容雜湊 (hex，用於結果的物件名稱)；沒有 md5Hash 時以文件雜湊代替"""
+    return md5_hex(event.get('md5Hash')) or get_document_hash(event)
+
+def get_event_tenant(event):
+    """由上傳時寫入的 metadata 取得租戶 ID (LINE 群組 / 聊天室 / 用戶)"""
+    metadata = event.get('metadata') or {}
+    return metadata.get('line_tenant_id') or metadata.get('line_user_id') or ANONYMOUS_TENANT
+
+def index_results(event, document, processing_ms):
+    """將處理結果寫入索引資料庫 (經由緩衝式批次寫入器)"""
+    result_sink = get_result_sink(get_settings().result_index_dsn)
+    if result_sink is None:
+        print("未設定 RESULT_INDEX_DSN，跳過結果索引")
+        return
+    
+    metadata = event.get('metadata') or {}
+    record = build_document_record(
+        document_hash=get_document_hash(event),
+        file_name=event['name'],
+        bucket_name=event['bucket'],
+        user_id=metadata.get('line_user_id'),
+        page_count=len(document.pages),
+        processing_ms=processing_ms
+    )
+    try:
+        result_sink.add(record, iter_structured_data(document))
+    except Exception as e:
+        # 結果檔案已儲存，索引失敗不影響主流程
+        print(f"寫入結果索引失敗: {e}")
 
 def local_trigger():
     """本地測試用的函式"""
@@ -168,6 +557,10 @@ def local_trigger():
 }
         ''')
 
+# 冷啟動時預熱 (WARMUP_ON_START，部署在 Cloud Functions 時預設開啟)
+if warmup.on_start():
+    warmup.run()
+
 if __name__ == "__main__":
     # 讓您可以在本地端直接執行 `python document_processor/main.py` 來測試此函式
     local_trigger()
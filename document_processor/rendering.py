@@ -0,0 +1,84 @@
+"""
+處理結果輸出內容的產生 (JSON 與 CSV 編碼)
+這些步驟是純 CPU 運算，可在本行程內以串流方式執行，也可交由 cpu_pool 的工作行程執行；
+送往工作行程時只傳遞序列化的 protobuf bytes，工作行程將 JSON 與 CSV 寫入暫存檔後只回傳路徑，
+完整內容不經由行程間傳遞，也不必在任何一方的記憶體中組出所有 CSV 區塊。
+"""
+
+import os
+from typing import Iterator, List, Optional, Tuple
+
+from google.cloud import documentai_v1 as documentai
+
+from extraction import (
+    iter_structured_data, iter_entity_data, iter_tables, STRUCTURED_COLUMNS, TABLE_COLUMNS
+)
+from csv_export import iter_csv_chunks
+
+# (檔名後綴, CSV 區塊, 計數 {'rows', 'bytes'}, 表格大小 (列, 欄) 或 None)
+CsvOutput = Tuple[str, Iterator[bytes], dict, Optional[Tuple[int, int]]]
+# (檔名後綴, CSV 暫存檔路徑, 計數, 表格大小 (列, 欄) 或 None)
+RenderedCsv = Tuple[str, str, dict, Optional[Tuple[int, int]]]
+
+
+def iter_csv_outputs(document, tables_mode: bool, chunk_bytes: int) -> Iterator[CsvOutput]:
+    """
+    逐一產生要輸出的 CSV (區塊為 generator，計數在區塊全部取出後才會填入)
+
+    Args:
+        document: Document AI 結果
+        tables_mode: 表格模式 (主 CSV 只包含實體，每個表格另存一份)
+        chunk_bytes: 區塊大小
+    """
+    if not tables_mode:
+        counter = {}
+        yield '', iter_csv_chunks(iter_structured_data(document), STRUCTURED_COLUMNS, chunk_bytes, counter), counter, None
+        return
+
+    counter = {}
+    yield '', iter_csv_chunks(iter_entity_data(document), STRUCTURED_COLUMNS, chunk_bytes, counter), counter, None
+    for table in iter_tables(document):
+        counter = {}
+        chunks = iter_csv_chunks(table.cells, TABLE_COLUMNS, chunk_bytes, counter)
+        yield f".{table.table_id}", chunks, counter, (table.row_count, len(table.columns))
+
+
+def render_results(document_bytes: bytes, tables_mode: bool, chunk_bytes: int, spool_dir: str,
+                   include_json: bool = True) -> Tuple[Optional[str], List[RenderedCsv]]:
+    """
+    由序列化的 Document 產生 JSON 與 CSV 並寫入 spool_dir 的暫存檔 (在工作行程中執行)
+
+    Args:
+        document_bytes: Document.serialize 的結果
+        tables_mode: 表格模式
+        chunk_bytes: 區塊大小
+        spool_dir: 暫存檔目錄 (由呼叫端建立與刪除)
+        include_json: 是否產生 JSON (RESULT_FORMAT=protobuf 時不需要)
+
+    Returns:
+        (JSON 暫存檔路徑或 None, [(檔名後綴, CSV 暫存檔路徑, 計數, 表格大小)])
+    """
+    document = documentai.Document.deserialize(document_bytes)
+    json_path = None
+    if include_json:
+        json_path = os.path.join(spool_dir, 'result.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            f.write(documentai.Document.to_json(document))
+    outputs = []
+    for position, (suffix, chunks, counter, shape) in enumerate(iter_csv_outputs(document, tables_mode, chunk_bytes)):
+        # CSV 區塊逐一寫入，不保留在記憶體中
+        path = os.path.join(spool_dir, f"{position}.csv")
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        outputs.append((suffix, path, counter, shape))
+    return json_path, outputs
+
+
+def iter_file_chunks(path: str, chunk_bytes: int) -> Iterator[bytes]:
+    """逐塊讀取 render_results 寫出的 CSV 暫存檔 (至少產生一個區塊，與 iter_csv_chunks 相同)"""
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_bytes)
+        yield chunk
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            yield chunk
@@ -0,0 +1,379 @@
+"""
+處理結果的每日壓實
+每份文件在 processed bucket 產生數個小物件 (results/yyyy/mm/dd/分片/雜湊_檔名.json / .docpb / .csv)，
+分析一個月的結果需要數十萬次列出與讀取。壓實將一天的結果依副檔名合併成少數幾個大型壓縮檔:
+
+  compacted/results/yyyy/mm/dd/{副檔名}-{序號}.gz   合併後的內容
+  compacted/results/yyyy/mm/dd/_index.jsonl.gz     索引: 每個原始物件一行 (所在檔案、區塊位置與區塊內的位置)
+  compacted/results/_state.json                    高水位 (已壓實的最後一天)
+
+- 區塊壓縮: 內容依序累積到 COMPACTION_BLOCK_BYTES 後壓縮成一個 gzip member，整個檔案仍是合法的 gzip
+  (可直接 gunzip 取得串接的內容)；讀取單一物件時只需範圍讀取所在的區塊
+- 遞增: run 從高水位的隔天壓實到 COMPACTION_MIN_AGE_DAYS 天前，每完成一天就更新高水位；
+  重新壓實同一天時，索引中已有 (MD5 相同) 的物件不再寫入，新的物件寫入新的序號
+- 刪除小物件 (tombstone，選用): 合併檔與索引上傳後，刪除已壓實的小物件 (以列出時的 generation 為條件，
+  期間被覆寫的物件不會被刪除)；索引即為已刪除物件的紀錄，load_previous_result 找不到小物件時改讀合併檔
+
+只處理 partitioned 格式的結果 (flat 格式請先以 scripts/object_layout.py migrate 遷移)。
+
+用法:
+  python document_processor/result_compaction.py run --bucket PROCESSED_BUCKET [--since 2024-06-01] [--tombstone]
+  python document_processor/result_compaction.py day --bucket PROCESSED_BUCKET --date 2024-06-01
+  python document_processor/result_compaction.py get --bucket PROCESSED_BUCKET --name results/2024/06/01/ab/..._invoice.pdf.csv
+  python document_processor/result_compaction.py status --bucket PROCESSED_BUCKET
+"""
+
+import os
+import sys
+import gzip
+import json
+import tempfile
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+# 添加專案根目錄到 Python 路徑 (直接執行時)
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from config.object_layout import (
+    RESULTS_CATEGORY, MANIFEST_NAME, partition_prefix, parse_object_name, object_name, md5_hex
+)
+
+COMPACTION_PREFIX = os.environ.get('COMPACTION_PREFIX', 'compacted')
+COMPACTION_BLOCK_BYTES = int(os.environ.get('COMPACTION_BLOCK_BYTES', str(1024 * 1024)))
+COMPACTION_PART_BYTES = int(os.environ.get('COMPACTION_PART_BYTES', str(256 * 1024 * 1024)))
+COMPACTION_WORKERS = int(os.environ.get('COMPACTION_WORKERS', '16'))
+COMPACTION_MIN_AGE_DAYS = int(os.environ.get('COMPACTION_MIN_AGE_DAYS', '1'))
+COMPACTION_LEVEL = int(os.environ.get('COMPACTION_LEVEL', '6'))
+
+INDEX_NAME = '_index.jsonl.gz'
+STATE_NAME = '_state.json'
+
+
+def compacted_prefix(day: date) -> str:
+    """某一天的合併檔前綴 (以 / 結尾)"""
+    return f"{COMPACTION_PREFIX}/{partition_prefix(RESULTS_CATEGORY, day)}"
+
+
+def extension_of(name: str) -> str:
+    """合併檔依副檔名分開 (表格 CSV 與實體 CSV 同為 csv)"""
+    return os.path.splitext(name)[1].lstrip('.').lower() or 'bin'
+
+
+class _PartWriter:
+    """寫入單一合併檔 (區塊壓縮)"""
+
+    def __init__(self, path: str, part_name: str, block_bytes: int, level: int):
+        self.path = path
+        self.part_name = part_name
+        self.block_bytes = block_bytes
+        self.level = level
+        self.raw_bytes = 0
+        self.size = 0
+        self._file = open(path, 'wb')
+        self._block = bytearray()
+        self._entries = []
+
+    def add(self, entry: dict, data: bytes):
+        """加入一個物件 (不跨區塊；大於區塊大小的物件自成一個區塊)"""
+        if self._block and len(self._block) + len(data) > self.block_bytes:
+            self._flush_block()
+        entry.update(part=self.part_name, offset=len(self._block), size=len(data))
+        self._block += data
+        self._entries.append(entry)
+        self.raw_bytes += len(data)
+        if len(self._block) >= self.block_bytes:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        compressed = gzip.compress(bytes(self._block), compresslevel=self.level, mtime=0)
+        for entry in self._entries:
+            entry.update(block_offset=self.size, block_size=len(compressed))
+        self._file.write(compressed)
+        self.size += len(compressed)
+        self._block = bytearray()
+        self._entries = []
+
+    def close(self):
+        self._flush_block()
+        self._file.close()
+
+
+def read_index(bucket, day: date) -> List[dict]:
+    """讀取某一天的索引 (尚未壓實時回傳空列表)"""
+    try:
+        data = bucket.blob(compacted_prefix(day) + INDEX_NAME).download_as_bytes()
+    except NotFound:
+        return []
+    return [json.loads(line) for line in gzip.decompress(data).splitlines() if line]
+
+
+def _write_index(bucket, day: date, entries: List[dict]):
+    body = ''.join(json.dumps(entry, ensure_ascii=False, sort_keys=True) + '\n' for entry in entries)
+    bucket.blob(compacted_prefix(day) + INDEX_NAME).upload_from_string(
+        gzip.compress(body.encode('utf-8'), mtime=0), content_type='application/gzip'
+    )
+
+
+def _download_in_order(blobs, workers: int) -> Iterator[Tuple[object, bytes]]:
+    """並行下載，依列出順序回傳 (同時在記憶體中的物件最多 workers x 4 個)"""
+    batch = max(1, workers * 4)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compaction') as executor:
+        for start in range(0, len(blobs), batch):
+            chunk = blobs[start:start + batch]
+            yield from zip(chunk, executor.map(lambda blob: blob.download_as_bytes(), chunk))
+
+
+def compact_day(bucket, day: date, tombstone: bool = False, workers: int = COMPACTION_WORKERS,
+                block_bytes: int = COMPACTION_BLOCK_BYTES, part_bytes: int = COMPACTION_PART_BYTES,
+                level: int = COMPACTION_LEVEL) -> dict:
+    """
+    壓實某一天的處理結果
+
+    Args:
+        bucket: processed bucket
+        day: 日期
+        tombstone: 合併後刪除已壓實的小物件
+
+    Returns:
+        統計 {'objects', 'compacted', 'raw_bytes', 'packed_bytes', 'parts', 'tombstoned'}
+    """
+    prefix = partition_prefix(RESULTS_CATEGORY, day)
+    out_prefix = compacted_prefix(day)
+    index = read_index(bucket, day)
+    known = {entry['name']: entry['md5'] for entry in index}
+    objects = [blob for blob in bucket.list_blobs(prefix=prefix) if not blob.name.endswith('/' + MANIFEST_NAME)]
+    pending = [blob for blob in objects if known.get(blob.name) != md5_hex(blob.md5_hash)]
+    stats = {'objects': len(objects), 'compacted': len(pending), 'raw_bytes': 0, 'packed_bytes': 0,
+             'parts': 0, 'tombstoned': 0}
+
+    if pending:
+        # 新的合併檔接在既有序號之後，不覆寫已上傳的檔案 (包含中途失敗、未寫入索引的檔案)
+        next_part = defaultdict(int)
+        for blob in bucket.list_blobs(prefix=out_prefix):
+            part = blob.name[len(out_prefix):]
+            if part.endswith('.gz') and part != INDEX_NAME:
+                extension, number = part[:-len('.gz')].rsplit('-', 1)
+                next_part[extension] = max(next_part[extension], int(number) + 1)
+
+        new_entries = []
+        with tempfile.TemporaryDirectory(prefix='compaction_') as work_dir:
+            writers: Dict[str, _PartWriter] = {}
+            finished: List[_PartWriter] = []
+            for blob, data in _download_in_order(pending, workers):
+                extension = extension_of(blob.name)
+                writer = writers.get(extension)
+                if writer is None or writer.raw_bytes >= part_bytes:
+                    if writer is not None:
+                        writer.close()
+                        finished.append(writer)
+                    part_name = f"{extension}-{next_part[extension]:05d}.gz"
+                    next_part[extension] += 1
+                    writer = writers[extension] = _PartWriter(os.path.join(work_dir, part_name), part_name,
+                                                              block_bytes, level)
+                entry = {'name': blob.name, 'md5': md5_hex(blob.md5_hash), 'generation': blob.generation}
+                writer.add(entry, data)
+                new_entries.append(entry)
+            for writer in writers.values():
+                writer.close()
+                finished.append(writer)
+
+            for writer in finished:
+                bucket.blob(out_prefix + writer.part_name).upload_from_filename(
+                    writer.path, content_type='application/gzip', if_generation_match=0
+                )
+                stats['raw_bytes'] += writer.raw_bytes
+                stats['packed_bytes'] += writer.size
+            stats['parts'] = len(finished)
+
+        # 索引在合併檔全部上傳後才更新，中途失敗時重跑會重新寫入新的序號
+        replaced = {entry['name'] for entry in new_entries}
+        index = [entry for entry in index if entry['name'] not in replaced] + new_entries
+        _write_index(bucket, day, index)
+
+    if tombstone:
+        indexed = {entry['name']: entry['md5'] for entry in index}
+        compacted = [blob for blob in objects if indexed.get(blob.name) == md5_hex(blob.md5_hash)]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compaction') as executor:
+            stats['tombstoned'] = sum(executor.map(_delete_compacted, compacted))
+    return stats
+
+
+def _delete_compacted(blob) -> bool:
+    """刪除已壓實的小物件 (列出後被覆寫或已刪除時略過)"""
+    try:
+        blob.delete(if_generation_match=blob.generation)
+        return True
+    except (NotFound, PreconditionFailed):
+        return False
+
+
+def load_state(bucket) -> dict:
+    """讀取高水位狀態"""
+    try:
+        return json.loads(bucket.blob(f"{COMPACTION_PREFIX}/{RESULTS_CATEGORY}/{STATE_NAME}").download_as_text())
+    except NotFound:
+        return {}
+
+
+def save_state(bucket, state: dict):
+    bucket.blob(f"{COMPACTION_PREFIX}/{RESULTS_CATEGORY}/{STATE_NAME}").upload_from_string(
+        json.dumps(state, ensure_ascii=False), content_type='application/json'
+    )
+
+
+def compact_pending(bucket, since: Optional[date] = None, until: Optional[date] = None,
+                    tombstone: bool = False, **kwargs) -> List[Tuple[date, dict]]:
+    """
+    從高水位的隔天 (或 since) 壓實到 until (預設為 COMPACTION_MIN_AGE_DAYS 天前)，每完成一天更新高水位
+
+    Returns:
+        [(日期, 統計)]
+    """
+    state = load_state(bucket)
+    if state.get('high_water'):
+        start = datetime.strptime(state['high_water'], '%Y-%m-%d').date() + timedelta(days=1)
+    elif since:
+        start = since
+    else:
+        raise ValueError("尚未壓實過，請以 since 指定開始日期")
+    until = until or date.today() - timedelta(days=COMPACTION_MIN_AGE_DAYS)
+
+    results = []
+    day = start
+    while day <= until:
+        stats = compact_day(bucket, day, tombstone=tombstone, **kwargs)
+        state['high_water'] = f"{day:%Y-%m-%d}"
+        state['updated'] = datetime.now().isoformat(timespec='seconds')
+        save_state(bucket, state)
+        results.append((day, stats))
+        day += timedelta(days=1)
+    return results
+
+
+def read_entry(bucket, entry: dict) -> bytes:
+    """以範圍讀取取得單一物件的內容 (只讀取所在的區塊)"""
+    key = parse_object_name(entry['name'])
+    blob = bucket.blob(compacted_prefix(key.day) + entry['part'])
+    block = blob.download_as_bytes(start=entry['block_offset'], end=entry['block_offset'] + entry['block_size'] - 1)
+    data = gzip.decompress(block)
+    return data[entry['offset']:entry['offset'] + entry['size']]
+
+
+def iter_day(bucket, day: date, extension: Optional[str] = None) -> Iterator[Tuple[dict, bytes]]:
+    """
+    依序讀取某一天所有已壓實的物件 (每個合併檔只讀取一次)
+
+    Args:
+        extension: 只讀取此副檔名 (例如 csv)
+
+    Returns:
+        (索引項目, 內容) 的迭代器
+    """
+    by_part = defaultdict(list)
+    for entry in read_index(bucket, day):
+        if extension is None or extension_of(entry['name']) == extension:
+            by_part[entry['part']].append(entry)
+    for part, entries in sorted(by_part.items()):
+        data = bucket.blob(compacted_prefix(day) + part).download_as_bytes()
+        blocks = {}
+        for entry in sorted(entries, key=lambda item: (item['block_offset'], item['offset'])):
+            offset = entry['block_offset']
+            if offset not in blocks:
+                blocks = {offset: gzip.decompress(data[offset:offset + entry['block_size']])}
+            yield entry, blocks[offset][entry['offset']:entry['offset'] + entry['size']]
+
+
+def find_compacted(bucket, source_name: str, days: int = 2) -> List[dict]:
+    """
+    在合併檔索引中找出原始檔的處理結果 (小物件已刪除時使用，日期規則同 object_layout.find_results)
+
+    Returns:
+        索引項目；找不到時回傳空列表
+    """
+    key = parse_object_name(source_name)
+    if not key:
+        return []
+    for offset in range(days):
+        day = key.day + timedelta(days=offset)
+        base = object_name(RESULTS_CATEGORY, key.file_name, key.content_hash, day, tenant=key.tenant) + '.'
+        entries = [entry for entry in read_index(bucket, day) if entry['name'].startswith(base)]
+        if entries:
+            return entries
+    return []
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _print_stats(day, stats):
+    ratio = stats['raw_bytes'] / stats['packed_bytes'] if stats['packed_bytes'] else 0
+    tombstoned = f"，刪除 {stats['tombstoned']} 個小物件" if stats['tombstoned'] else ''
+    print(f"📦 {day:%Y-%m-%d}: {stats['objects']} 個物件，壓實 {stats['compacted']} 個 -> {stats['parts']} 個合併檔 "
+          f"({stats['raw_bytes'] / 1024 / 1024:.1f} MB -> {stats['packed_bytes'] / 1024 / 1024:.1f} MB，{ratio:.1f}x){tombstoned}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='處理結果的每日壓實')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='從高水位遞增壓實到 COMPACTION_MIN_AGE_DAYS 天前')
+    run_parser.add_argument('--bucket', required=True)
+    run_parser.add_argument('--since', type=_parse_date, help='第一次執行時的開始日期')
+    run_parser.add_argument('--until', type=_parse_date)
+    run_parser.add_argument('--tombstone', action='store_true', help='壓實後刪除小物件')
+
+    day_parser = subparsers.add_parser('day', help='壓實 (或補壓實) 指定的一天，不變更高水位')
+    day_parser.add_argument('--bucket', required=True)
+    day_parser.add_argument('--date', required=True, type=_parse_date)
+    day_parser.add_argument('--tombstone', action='store_true')
+
+    get_parser = subparsers.add_parser('get', help='由合併檔讀取單一物件')
+    get_parser.add_argument('--bucket', required=True)
+    get_parser.add_argument('--name', required=True, help='原始物件名稱 (results/yyyy/mm/dd/...)')
+    get_parser.add_argument('-o', '--output', help='輸出檔案 (預設輸出到 stdout)')
+
+    status_parser = subparsers.add_parser('status', help='顯示高水位')
+    status_parser.add_argument('--bucket', required=True)
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    from google.cloud import storage
+    bucket = storage.Client().bucket(args.bucket)
+
+    if args.command == 'run':
+        for day, stats in compact_pending(bucket, args.since, args.until, tombstone=args.tombstone):
+            _print_stats(day, stats)
+    elif args.command == 'day':
+        _print_stats(args.date, compact_day(bucket, args.date, tombstone=args.tombstone))
+    elif args.command == 'get':
+        key = parse_object_name(args.name)
+        entry = next((entry for entry in read_index(bucket, key.day) if entry['name'] == args.name), None) if key else None
+        if entry is None:
+            print(f"❌ 合併檔索引中沒有: {args.name}", file=sys.stderr)
+            return 1
+        data = read_entry(bucket, entry)
+        if args.output:
+            with open(args.output, 'wb') as f:
+                f.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+    elif args.command == 'status':
+        print(json.dumps(load_state(bucket), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Document AI 結果的精簡儲存格式
+以壓縮的 protobuf wire format 取代 JSON (RESULT_FORMAT=protobuf)，體積與編解碼耗時都遠小於 Document.to_json。
+
+檔案格式 (.docpb，整數皆為 big-endian):
+  magic      4 bytes  b'LDPB'
+  schema     uint16   格式版本 (目前為 1)
+  codec      uint8    0 = 不壓縮, 1 = gzip, 2 = zstd
+  sha256     32 bytes 未壓縮 protobuf 的 SHA-256
+  raw_size   uint64   未壓縮 protobuf 的長度
+  size       uint64   payload (壓縮後) 的長度
+  proc_len   uint16   處理器 ID 長度
+  processor  proc_len bytes (UTF-8)
+  payload    size bytes
+
+未壓縮時直接以 memoryview 解析 payload，不另外複製。zstd 需要安裝 zstandard 套件。
+
+用法:
+  python document_processor/result_store.py info 2024-01-01_00-00-00_invoice.pdf.docpb
+  python document_processor/result_store.py to-json gs://processed-bucket/2024-01-01_00-00-00_invoice.pdf.docpb -o invoice.json
+"""
+
+import sys
+import gzip
+import struct
+import hashlib
+import argparse
+from typing import NamedTuple, Union
+
+from google.cloud import documentai_v1 as documentai
+
+RESULT_MAGIC = b'LDPB'
+RESULT_SCHEMA_VERSION = 1
+RESULT_SUFFIX = '.docpb'
+RESULT_CONTENT_TYPE = 'application/x-protobuf'
+
+CODECS = {'none': 0, 'gzip': 1, 'zstd': 2}
+CODEC_NAMES = {value: name for name, value in CODECS.items()}
+
+_HEADER = struct.Struct('>4sHB32sQQH')
+
+
+class ResultHeader(NamedTuple):
+    """結果檔案標頭"""
+    schema: int
+    codec: str
+    sha256: str
+    raw_size: int
+    size: int
+    processor: str
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("使用 zstd 壓縮需要安裝 zstandard")
+    return zstandard
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == 'gzip':
+        # mtime 固定為 0，相同內容產生相同的檔案
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if codec == 'zstd':
+        return _zstd().ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def _decompress(payload: memoryview, codec: str, raw_size: int):
+    if codec == 'gzip':
+        return gzip.decompress(payload)
+    if codec == 'zstd':
+        return _zstd().ZstdDecompressor().decompress(payload, max_output_size=raw_size)
+    return payload
+
+
+def encode_result(document_bytes: bytes, processor: str = '', codec: str = 'gzip') -> bytes:
+    """
+    將序列化的 Document 編碼為結果檔案
+
+    Args:
+        document_bytes: Document.serialize 的結果
+        processor: 產生結果的處理器 (名稱或 ID)
+        codec: none / gzip / zstd
+
+    Returns:
+        結果檔案內容
+    """
+    if codec not in CODECS:
+        raise ValueError(f"不支援的壓縮格式: {codec}")
+    payload = _compress(document_bytes, codec)
+    processor_bytes = processor.encode('utf-8')
+    header = _HEADER.pack(
+        RESULT_MAGIC, RESULT_SCHEMA_VERSION, CODECS[codec],
+        hashlib.sha256(document_bytes).digest(), len(document_bytes), len(payload), len(processor_bytes)
+    )
+    return b''.join((header, processor_bytes, payload))
+
+
+def read_header(data: Union[bytes, memoryview]) -> ResultHeader:
+    """讀取結果檔案標頭 (不解壓縮 payload)"""
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        raise ValueError("結果檔案長度不足")
+    magic, schema, codec, digest, raw_size, size, processor_length = _HEADER.unpack_from(view)
+    if magic != RESULT_MAGIC:
+        raise ValueError("不是結果檔案 (magic 不符)")
+    if schema > RESULT_SCHEMA_VERSION:
+        raise ValueError(f"不支援的結果檔案版本: {schema}")
+    if codec not in CODEC_NAMES:
+        raise ValueError(f"不支援的壓縮格式代碼: {codec}")
+    processor = bytes(view[_HEADER.size:_HEADER.size + processor_length]).decode('utf-8')
+    return ResultHeader(schema, CODEC_NAMES[codec], digest.hex(), raw_size, size, processor)
+
+
+def decode_result(data: Union[bytes, memoryview], verify: bool = True):
+    """
+    解碼結果檔案
+
+    Args:
+        data: 結果檔案內容
+        verify: 是否檢查 SHA-256
+
+    Returns:
+        (ResultHeader, Document protobuf)；需要 proto-plus 物件時以 documentai.Document.wrap 包裝
+    """
+    view = memoryview(data)
+    header = read_header(view)
+    start = _HEADER.size + len(header.processor.encode('utf-8'))
+    payload = view[start:start + header.size]
+    if len(payload) != header.size:
+        raise ValueError("結果檔案不完整")
+
+    raw = _decompress(payload, header.codec, header.raw_size)
+    if verify and hashlib.sha256(raw).hexdigest() != header.sha256:
+        raise ValueError("結果檔案內容雜湊不符")
+    return header, documentai.Document.pb().FromString(raw)
+
+
+def _read_source(source: str) -> bytes:
+    """讀取本地檔案或 gs://bucket/name"""
+    if source.startswith('gs://'):
+        from google.cloud import storage
+        bucket_name, _, blob_name = source[len('gs://'):].partition('/')
+        return storage.Client().bucket(bucket_name).blob(blob_name).download_as_bytes()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def main(argv=None):
+    """命令列工具 (除錯用)"""
+    parser = argparse.ArgumentParser(description='檢視 / 匯出 protobuf 格式的 Document AI 結果')
+    subparsers = parser.add_subparsers(dest='command')
+
+    info_parser = subparsers.add_parser('info', help='顯示標頭資訊')
+    info_parser.add_argument('source', help='本地檔案或 gs://bucket/name')
+
+    export_parser = subparsers.add_parser('to-json', help='匯出為 Document AI JSON (與 RESULT_FORMAT=json 相同)')
+    export_parser.add_argument('source', help='本地檔案或 gs://bucket/name')
+    export_parser.add_argument('-o', '--output', help='輸出檔案 (預設輸出到標準輸出)')
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    data = _read_source(args.source)
+    if args.command == 'info':
+        header = read_header(data)
+        for key, value in header._asdict().items():
+            print(f"{key}: {value}")
+        print(f"file_size: {len(data)}")
+        return 0
+
+    _, document = decode_result(data)
+    json_text = documentai.Document.to_json(documentai.Document.wrap(document))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json_text)
+        print(f"已匯出: {args.output}")
+    else:
+        print(json_text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
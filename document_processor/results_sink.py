@@ -0,0 +1,188 @@
+"""
+結果資料庫寫入器
+將 extract_structured_data 的輸出緩衝後批次寫入 Cloud SQL 結果資料表 (本地可用 SQLite 替代)。
+資料表結構與 result_index 共用，依 document_hash 進行 upsert，重試不會產生重複資料。
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+from result_index import SCHEMA_STATEMENTS, connect_index, write_documents
+
+# 緩衝設定：累積到指定列數或超過指定秒數即寫入；秒數為 0 表示每份文件立即寫入
+RESULT_SINK_BATCH_ROWS = int(os.environ.get('RESULT_SINK_BATCH_ROWS', '1000'))
+RESULT_SINK_FLUSH_SECONDS = float(os.environ.get('RESULT_SINK_FLUSH_SECONDS', '0'))
+RESULT_SINK_POOL_SIZE = int(os.environ.get('RESULT_SINK_POOL_SIZE', '2'))
+RESULT_SINK_ROWS_PER_STATEMENT = int(os.environ.get('RESULT_SINK_ROWS_PER_STATEMENT', '500'))
+
+
+class ConnectionPool:
+    """簡易 DB-API 連線池"""
+
+    def __init__(self, dsn: str, size: int = 2):
+        """
+        初始化連線池
+
+        Args:
+            dsn: 資料庫位置 (格式同 RESULT_INDEX_DSN)
+            size: 連線數量
+        """
+        self.dsn = dsn
+        self.placeholder = None
+        self._connections = queue.Queue()
+        for _ in range(max(1, size)):
+            conn, self.placeholder = connect_index(dsn)
+            self._connections.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """借用一條連線，用完歸還"""
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        """關閉所有連線"""
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+class ResultSink:
+    """緩衝式結果寫入器"""
+
+    def __init__(self, dsn: str, batch_rows: int = RESULT_SINK_BATCH_ROWS,
+                 flush_seconds: float = RESULT_SINK_FLUSH_SECONDS,
+                 pool_size: int = RESULT_SINK_POOL_SIZE,
+                 rows_per_statement: int = RESULT_SINK_ROWS_PER_STATEMENT):
+        """
+        初始化寫入器
+
+        Args:
+            dsn: 資料庫位置
+            batch_rows: 緩衝列數上限，達到即寫入
+            flush_seconds: 緩衝時間上限 (秒)，0 表示每份文件立即寫入
+            pool_size: 連線池大小
+            rows_per_statement: 每個 INSERT 語句包含的列數
+        """
+        self.pool = ConnectionPool(dsn, pool_size)
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.rows_per_statement = rows_per_statement
+        self._buffer = []
+        self._buffered_rows = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._ensure_schema()
+
+        if self.flush_seconds > 0:
+            # 背景執行緒負責依時間門檻寫入，避免低流量時資料一直停留在緩衝區
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+        atexit.register(self.close)
+
+    def _ensure_schema(self):
+        """建立資料表與索引"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for statement in SCHEMA_STATEMENTS:
+                cursor.execute(statement)
+            conn.commit()
+
+    def add(self, document: dict, entities: Iterable[dict]):
+        """
+        加入一份文件的結果；達到列數或時間門檻時寫入資料庫
+
+        Args:
+            document: 文件資訊 (見 result_index.build_document_record)
+            entities: extract_structured_data 的輸出
+        """
+        entities = list(entities)
+        with self._lock:
+            self._buffer.append((document, entities))
+            self._buffered_rows += len(entities) + 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = self._is_due()
+        if due:
+            self.flush()
+
+    def _is_due(self) -> bool:
+        """檢查是否達到寫入門檻 (呼叫端需持有鎖)"""
+        if not self._buffer:
+            return False
+        if self._buffered_rows >= self.batch_rows:
+            return True
+        return time.monotonic() - self._oldest >= self.flush_seconds
+
+    def flush(self) -> int:
+        """
+        將緩衝區寫入資料庫
+
+        Returns:
+            寫入的實體筆數
+        """
+        with self._lock:
+            batch = self._buffer
+            self._buffer = []
+            self._buffered_rows = 0
+            self._oldest = None
+        if not batch:
+            return 0
+
+        try:
+            with self.pool.connection() as conn:
+                written = write_documents(conn, self.pool.placeholder, batch,
+                                          self.rows_per_statement)
+        except Exception:
+            # 寫入失敗時放回緩衝區，下次再試
+            with self._lock:
+                self._buffer = batch + self._buffer
+                self._buffered_rows += sum(len(entities) + 1 for _, entities in batch)
+                self._oldest = time.monotonic()
+            raise
+        print(f"結果已寫入資料庫: {len(batch)} 份文件，{written} 筆實體")
+        return written
+
+    def _flush_loop(self):
+        """背景依時間門檻寫入"""
+        while not self._stopped.wait(self.flush_seconds / 2):
+            with self._lock:
+                due = self._is_due()
+            if due:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"背景寫入結果資料庫失敗: {e}")
+
+    def close(self):
+        """寫入剩餘資料並關閉連線池"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        try:
+            self.flush()
+        finally:
+            self.pool.close()
+
+
+_sink: Optional[ResultSink] = None
+_sink_lock = threading.Lock()
+
+
+def get_result_sink(dsn: Optional[str]) -> Optional[ResultSink]:
+    """取得共用的結果寫入器 (未設定 DSN 時回傳 None)"""
+    global _sink
+    if not dsn:
+        return None
+    with _sink_lock:
+        if _sink is None:
+            _sink = ResultSink(dsn)
+    return _sink
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+下載准入控制效能測試
+多個執行緒同時「下載」大小不一的檔案 (多數為文件與圖片，少數為大型影片)，
+以模擬頻寬的耗時與位元組帳目 (不實際配置記憶體) 比較有無准入控制時:
+  - 同時留在記憶體中的位元組數峰值 (相當於執行個體的記憶體用量)
+  - 等待預算的時間、交給重試帳本的數量與總耗時
+
+用法:
+  python local_test/bench_admission.py
+  python local_test/bench_admission.py --threads 32 --files 300 --budget-mb 128 --stream-mb 32
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+# 添加專案根目錄與 Webhook 接收器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'webhook_receiver'))
+
+import admission
+from admission import ByteBudget, AdmissionDeferred
+from config.env_manager import env_manager
+
+MB = 1024 * 1024
+
+
+def make_sizes(count, seed=0):
+    """檔案大小分布: 70% 小型文件、25% 掃描檔 / 圖片、5% 影片"""
+    rng = random.Random(seed)
+    sizes = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.70:
+            sizes.append(rng.randint(50, 500) * 1024)
+        elif roll < 0.95:
+            sizes.append(rng.randint(2, 10) * MB)
+        else:
+            sizes.append(rng.randint(80, 250) * MB)
+    return sizes
+
+
+class Memory:
+    """下載中留在記憶體的位元組數帳目"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = 0
+        self.peak = 0
+
+    def hold(self, byte_count):
+        with self.lock:
+            self.held += byte_count
+            self.peak = max(self.peak, self.held)
+
+    def free(self, byte_count):
+        with self.lock:
+            self.held -= byte_count
+
+
+def run(args, sizes, guarded):
+    memory = Memory()
+    env_manager.override(ADMISSION_ENABLED=str(guarded).lower(), ADMISSION_MAX_BYTES=args.budget_mb * MB)
+    admission._budget = ByteBudget(args.budget_mb * MB)
+    queue = list(sizes)
+    lock = threading.Lock()
+    waits, deferred = [], [0]
+
+    def download(size):
+        # 串流下載只留一個區塊在記憶體，一般下載將整個內容留在記憶體直到寫入檔案
+        held = admission.stream_chunk_bytes() if guarded and admission.is_streamed(size) else size
+        memory.hold(held)
+        time.sleep(size / (args.bandwidth_mb * MB))
+        memory.free(held)
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                size = queue.pop()
+            started = time.perf_counter()
+            try:
+                with admission.admit(size):
+                    waited = time.perf_counter() - started
+                    download(size)
+            except AdmissionDeferred:
+                with lock:
+                    deferred[0] += 1
+                continue
+            with lock:
+                waits.append(waited * 1000)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    waits.sort()
+    return {
+        'seconds': time.perf_counter() - started,
+        'peak_mb': memory.peak / MB,
+        'wait_p50': waits[len(waits) // 2] if waits else 0,
+        'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0,
+        'deferred': deferred[0],
+        'done': len(waits),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下載准入控制效能測試')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--budget-mb', type=int, default=128)
+    parser.add_argument('--stream-mb', type=int, default=32)
+    parser.add_argument('--bandwidth-mb', type=float, default=400, help='模擬每個下載的頻寬 (MB/秒)')
+    parser.add_argument('--wait-seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    env_manager.override(ADMISSION_STREAM_BYTES=args.stream_mb * MB, ADMISSION_WAIT_SECONDS=args.wait_seconds)
+    sizes = make_sizes(args.files)
+    print(f"{args.files} 個檔案 (共 {sum(sizes) / MB:.0f} MB，最大 {max(sizes) / MB:.0f} MB)，{args.threads} 個執行緒，"
+          f"預算 {args.budget_mb} MB，{args.stream_mb} MB 以上串流")
+    print(f"{'模式':<8} {'完成':>6} {'延後':>6} {'秒數':>8} {'記憶體峰值 (MB)':>16} {'等待 p50 (ms)':>14} {'等待 p95 (ms)':>14}")
+    for guarded in (False, True):
+        result = run(args, sizes, guarded)
+        print(f"{'准入控制' if guarded else '無限制':<8} {result['done']:>6} {result['deferred']:>6} {result['seconds']:>8.2f} "
+              f"{result['peak_mb']:>16.1f} {result['wait_p50']:>14.1f} {result['wait_p95']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
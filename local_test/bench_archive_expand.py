@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+壓縮檔展開效能測試
+在記憶體中產生含數百個成員的 .zip (PDF / 圖片，加上會被略過的影片、__MACOSX 與巢狀壓縮檔)，
+以模擬上傳延遲的假 bucket 量測不同並行數的展開吞吐量，並確認 zip bomb 會在解壓縮前被拒絕。
+
+用法:
+  python local_test/bench_archive_expand.py
+  python local_test/bench_archive_expand.py --members 500 --member-kb 200 --upload-ms 40 --workers 1 4 8 16
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import zipfile
+import argparse
+import threading
+
+# 添加專案根目錄與文件處理器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'document_processor'))
+
+from google.api_core.exceptions import PreconditionFailed
+
+from archive_expand import expand_archive, ArchiveLimits, ArchiveRejected
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+
+    def upload_from_file(self, fileobj, rewind=False, content_type=None, if_generation_match=None, timeout=None):
+        if rewind:
+            fileobj.seek(0)
+        data = fileobj.read()
+        # 模擬 Cloud Storage 上傳的網路延遲
+        time.sleep(self.bucket.upload_seconds)
+        with self.bucket.lock:
+            if if_generation_match == 0 and self.name in self.bucket.objects:
+                raise PreconditionFailed('exists')
+            self.bucket.objects[self.name] = (len(data), content_type, self.metadata)
+
+
+class FakeBucket:
+    def __init__(self, upload_seconds):
+        self.upload_seconds = upload_seconds
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+def make_archive(members, member_kb, seed=0):
+    """產生測試用壓縮檔 (約 1/10 的成員會被略過)"""
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for index in range(members):
+            kind = index % 10
+            # 半隨機內容: 壓縮比接近掃描檔
+            body = rng.randbytes(member_kb * 512) + bytes(member_kb * 512)
+            if kind == 0:
+                archive.writestr(f"影片/clip{index}.mp4", body)
+            elif kind < 6:
+                archive.writestr(f"發票/invoice_{index:04d}.pdf", body)
+            else:
+                archive.writestr(f"收據/receipt_{index:04d}.jpg", body)
+        archive.writestr('__MACOSX/發票/._invoice_0001.pdf', b'\0' * 64)
+        archive.writestr('nested.zip', b'PK\x05\x06' + b'\0' * 18)
+    return buffer.getvalue()
+
+
+def make_bomb(megabytes):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('invoice.pdf', 'w') as member:
+            chunk = bytes(1024 * 1024)
+            for _ in range(megabytes):
+                member.write(chunk)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='壓縮檔展開效能測試')
+    parser.add_argument('--members', type=int, default=300)
+    parser.add_argument('--member-kb', type=int, default=100)
+    parser.add_argument('--upload-ms', type=float, default=30, help='模擬每個成員的上傳延遲')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    data = make_archive(args.members, args.member_kb)
+    print(f"壓縮檔: {args.members} 個成員，{len(data) / 1024 / 1024:.1f} MB，上傳延遲 {args.upload_ms:.0f} ms")
+    print(f"{'並行數':>6} {'上傳':>6} {'略過':>6} {'秒數':>8} {'成員/秒':>10} {'MB/秒':>8}")
+    for workers in args.workers:
+        bucket = FakeBucket(args.upload_ms / 1000)
+        stats = expand_archive(io.BytesIO(data), bucket, 'line-archives/batch.zip',
+                               metadata={'line_user_id': 'U0'}, workers=workers)
+        # 重跑時全部成員已存在，不會重複上傳
+        rerun = expand_archive(io.BytesIO(data), bucket, 'line-archives/batch.zip', workers=workers)
+        assert rerun['uploaded'] == 0 and rerun['existing'] == stats['uploaded']
+        print(f"{workers:>6} {stats['uploaded']:>6} {stats['skipped']:>6} {stats['seconds']:>8.2f} "
+              f"{stats['uploaded'] / stats['seconds']:>10.1f} {stats['bytes'] / 1024 / 1024 / stats['seconds']:>8.1f}")
+
+    bomb = make_bomb(256)
+    started = time.perf_counter()
+    try:
+        expand_archive(io.BytesIO(bomb), FakeBucket(0), 'line-archives/bomb.zip', limits=ArchiveLimits())
+        print("⚠️ zip bomb 未被拒絕")
+    except ArchiveRejected as e:
+        print(f"\nzip bomb ({len(bomb) / 1024:.0f} KB -> 256 MB) 已拒絕 ({(time.perf_counter() - started) * 1000:.1f} ms): {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+處理結果壓實效能測試
+在模擬延遲的假 bucket 中產生一個月的處理結果 (每份文件一個 JSON 與一個 CSV)，比較壓實前後讀取整個月的:
+  - 請求數 (列出 + 讀取)
+  - 秒數、物件/秒與 MB/秒
+並確認壓實後刪除小物件時，單一物件仍可由合併檔讀回相同內容。
+
+假 bucket 的每次讀取耗時為 --get-ms 加上依 --bandwidth-mb 計算的傳輸時間，每頁 (1000 個) 列出為 --list-ms。
+
+用法:
+  python local_test/bench_compaction.py
+  python local_test/bench_compaction.py --days 30 --docs-per-day 500 --get-ms 20 --workers 16
+"""
+
+import os
+import sys
+import time
+import json
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加專案根目錄與文件處理器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'document_processor'))
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from config.object_layout import RESULTS_CATEGORY, object_name, partition_prefix
+from result_compaction import compact_pending, iter_day, read_index, read_entry, find_compacted
+
+MB = 1024 * 1024
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def _stored(self):
+        stored = self.bucket.objects.get(self.name)
+        if stored is None:
+            raise NotFound(self.name)
+        return stored
+
+    @property
+    def md5_hash(self):
+        return base64.b64encode(hashlib.md5(self._stored[0]).digest()).decode()
+
+    @property
+    def generation(self):
+        return self._stored[1]
+
+    @property
+    def size(self):
+        return len(self._stored[0])
+
+    def download_as_bytes(self, start=None, end=None):
+        data = self._stored[0]
+        if start is not None:
+            data = data[start:end + 1]
+        self.bucket.request(len(data))
+        return data
+
+    def download_as_text(self):
+        return self.download_as_bytes().decode('utf-8')
+
+    def _store(self, data, if_generation_match=None):
+        self.bucket.request(0)
+        with self.bucket.lock:
+            if if_generation_match == 0 and self.name in self.bucket.objects:
+                raise PreconditionFailed(self.name)
+            self.bucket.generation += 1
+            self.bucket.objects[self.name] = (data, self.bucket.generation)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        self._store(data.encode('utf-8') if isinstance(data, str) else data, if_generation_match)
+
+    def upload_from_filename(self, path, content_type=None, if_generation_match=None):
+        with open(path, 'rb') as f:
+            self._store(f.read(), if_generation_match)
+
+    def delete(self, if_generation_match=None):
+        self.bucket.request(0)
+        with self.bucket.lock:
+            if if_generation_match is not None and self._stored[1] != if_generation_match:
+                raise PreconditionFailed(self.name)
+            del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    """以字典保存物件，每次請求依延遲與頻寬休眠並計數"""
+
+    def __init__(self, get_ms, list_ms, bandwidth_mb):
+        self.get_seconds = get_ms / 1000
+        self.list_seconds = list_ms / 1000
+        self.bandwidth = bandwidth_mb * MB
+        self.objects = {}
+        self.generation = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request(self, byte_count):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.get_seconds + byte_count / self.bandwidth)
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=''):
+        with self.lock:
+            names = sorted(name for name in self.objects if name.startswith(prefix))
+        for page in range(0, max(1, len(names)), 1000):
+            with self.lock:
+                self.requests += 1
+            time.sleep(self.list_seconds)
+            for name in names[page:page + 1000]:
+                if name in self.objects:
+                    yield FakeBlob(self, name)
+
+
+def make_month(bucket, first_day, days, docs_per_day, seed=0):
+    """產生處理結果 (類似 Document AI JSON 與實體 CSV 的文字內容)"""
+    rng = random.Random(seed)
+    vendors = ['台灣電力公司', '中華電信', '全家便利商店', '統一超商', '台灣自來水公司', '好市多']
+    count = 0
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        when = datetime(day.year, day.month, day.day, 12)
+        for index in range(docs_per_day):
+            content_hash = hashlib.md5(f"{day}-{index}".encode()).hexdigest()
+            base = object_name(RESULTS_CATEGORY, f"invoice_{index:04d}.pdf", content_hash, when)
+            vendor = rng.choice(vendors)
+            entities = [{'type': 'line_item', 'mentionText': f"品項 {j} {rng.randint(1, 9999)}",
+                         'confidence': round(rng.random(), 3)} for j in range(rng.randint(20, 80))]
+            document = {'text': f"{vendor} 發票 " * rng.randint(50, 200), 'entities': entities,
+                        'pages': [{'pageNumber': 1, 'dimension': {'width': 1654, 'height': 2339}}]}
+            rows = '\n'.join(f"line_item,品項 {j},{rng.randint(1, 9999)},0.9" for j in range(len(entities)))
+            bucket.objects[f"{base}.json"] = (json.dumps(document, ensure_ascii=False).encode('utf-8'), 1)
+            bucket.objects[f"{base}.csv"] = (f"type,value,amount,confidence\n{rows}\n".encode('utf-8'), 1)
+            count += 2
+    return count
+
+
+def read_month_small(bucket, first_day, days, workers):
+    """壓實前: 每天列出一次，再並行讀取每個小物件"""
+    def read_day(offset):
+        day = first_day + timedelta(days=offset)
+        blobs = list(bucket.list_blobs(prefix=partition_prefix(RESULTS_CATEGORY, day)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            sizes = list(executor.map(lambda blob: len(blob.download_as_bytes()), blobs))
+        return len(sizes), sum(sizes)
+
+    totals = [read_day(offset) for offset in range(days)]
+    return sum(count for count, _ in totals), sum(size for _, size in totals)
+
+
+def read_month_compacted(bucket, first_day, days, workers):
+    """壓實後: 每天讀取索引與合併檔 (各天並行)"""
+    def read_day(offset):
+        day = first_day + timedelta(days=offset)
+        count = size = 0
+        for _, data in iter_day(bucket, day):
+            count += 1
+            size += len(data)
+        return count, size
+
+    with ThreadPoolExecutor(max_workers=min(workers, days)) as executor:
+        totals = list(executor.map(read_day, range(days)))
+    return sum(count for count, _ in totals), sum(size for _, size in totals)
+
+
+def measure(label, bucket, reader, args, first_day):
+    requests_before = bucket.requests
+    started = time.perf_counter()
+    count, size = reader(bucket, first_day, args.days, args.workers)
+    seconds = time.perf_counter() - started
+    requests = bucket.requests - requests_before
+    print(f"{label:<10} {count:>8} {requests:>8} {seconds:>8.2f} {count / seconds:>10.0f} {size / MB / seconds:>8.1f}")
+    return count, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='處理結果壓實效能測試')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--docs-per-day', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--get-ms', type=float, default=15, help='每次請求的延遲')
+    parser.add_argument('--list-ms', type=float, default=50, help='每頁列出的延遲')
+    parser.add_argument('--bandwidth-mb', type=float, default=100, help='每個請求的傳輸速率 (MB/秒)')
+    args = parser.parse_args()
+
+    bucket = FakeBucket(args.get_ms, args.list_ms, args.bandwidth_mb)
+    first_day = date(2024, 6, 1)
+    objects = make_month(bucket, first_day, args.days, args.docs_per_day)
+    raw_bytes = sum(len(data) for data, _ in bucket.objects.values())
+    print(f"{args.days} 天 x {args.docs_per_day} 份文件 = {objects} 個小物件 ({raw_bytes / MB:.1f} MB)，"
+          f"延遲 {args.get_ms:.0f} ms / 請求，{args.workers} 個並行讀取")
+    print(f"{'讀取方式':<10} {'物件':>8} {'請求數':>8} {'秒數':>8} {'物件/秒':>10} {'MB/秒':>8}")
+    before = measure('小物件', bucket, read_month_small, args, first_day)
+
+    started = time.perf_counter()
+    results = compact_pending(bucket, since=first_day, until=first_day + timedelta(days=args.days - 1),
+                              tombstone=True, workers=args.workers)
+    packed = sum(stats['packed_bytes'] for _, stats in results)
+    print(f"\n壓實 {len(results)} 天: {time.perf_counter() - started:.1f} 秒，"
+          f"{raw_bytes / MB:.1f} MB -> {packed / MB:.1f} MB，刪除 {sum(s['tombstoned'] for _, s in results)} 個小物件，"
+          f"剩餘 {len(bucket.objects)} 個物件\n")
+
+    after = measure('合併檔', bucket, read_month_compacted, args, first_day)
+    assert before == after, (before, after)
+
+    # 單一物件: 小物件已刪除，由索引範圍讀取區塊
+    entry = read_index(bucket, first_day + timedelta(days=3))[7]
+    requests_before = bucket.requests
+    started = time.perf_counter()
+    data = read_entry(bucket, entry)
+    print(f"\n單一物件 (範圍讀取): {len(data)} bytes，{bucket.requests - requests_before} 次請求，"
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+    source = entry['name'].replace(f"{RESULTS_CATEGORY}/", 'line-documents/', 1).rsplit('.', 1)[0]
+    assert any(item['name'] == entry['name'] for item in find_compacted(bucket, source))
+
+
+if __name__ == "__main__":
+    main()
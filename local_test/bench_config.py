@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+效能測試：設定查詢成本
+比較每次呼叫 os.getenv 並解析 (舊做法) 與設定快照 (屬性存取 / 快取的型別轉換) 的查詢耗時
+
+用法:
+  python local_test/bench_config.py
+"""
+
+import os
+import sys
+import timeit
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.env_manager import get_settings, reload_settings_if_changed
+
+ITERATIONS = 200000
+
+
+def legacy_get_bool(key, default=False):
+    """舊版 EnvironmentManager.get_bool 的做法：每次都讀取並解析"""
+    value = os.getenv(key, str(default)).lower()
+    return value in ('true', '1', 'yes', 'on')
+
+
+def legacy_get_int(key, default=0):
+    """舊版 EnvironmentManager.get_int 的做法：每次都讀取並解析"""
+    try:
+        return int(os.getenv(key, str(default)))
+    except ValueError:
+        return default
+
+
+def main():
+    os.environ.setdefault('AUTO_REPLY_ENABLED', 'true')
+    os.environ.setdefault('RETRY_MAX_ATTEMPTS', '5')
+    settings = get_settings()
+
+    cases = [
+        ("os.getenv + 解析布林值 (舊)", lambda: legacy_get_bool('AUTO_REPLY_ENABLED')),
+        ("os.getenv + 解析整數 (舊)", lambda: legacy_get_int('RETRY_MAX_ATTEMPTS', 5)),
+        ("快照屬性 settings.auto_reply_enabled", lambda: settings.auto_reply_enabled),
+        ("get_settings().auto_reply_enabled", lambda: get_settings().auto_reply_enabled),
+        ("快照 get_bool (快取)", lambda: settings.get_bool('AUTO_REPLY_ENABLED')),
+        ("快照 get_int (快取)", lambda: settings.get_int('RETRY_MAX_ATTEMPTS', 5)),
+        ("reload_settings_if_changed (請求開始時)", reload_settings_if_changed),
+    ]
+
+    print(f"每項執行 {ITERATIONS:,} 次")
+    print(f"{'查詢方式':<40} | {'ns/次':>8}")
+    print("-" * 52)
+    for name, func in cases:
+        elapsed = min(timeit.repeat(func, number=ITERATIONS, repeat=3))
+        print(f"{name:<40} | {elapsed / ITERATIONS * 1e9:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+CPU 行程池效能測試
+以多個執行緒同時處理多份表格密集的假文件 (JSON 轉換 + CSV 編碼，與 save_results 相同的 CPU 工作)，
+比較 inline (受 GIL 限制) 與不同大小的 process 行程池的吞吐量。
+需要多核心機器才能看到行程池的擴展效果；單核心時行程池只會增加序列化成本。
+
+用法:
+  python local_test/bench_cpu_offload.py
+  python local_test/bench_cpu_offload.py --documents 16 --threads 8 --workers 1 2 4 8
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加專案根目錄與文件處理器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'document_processor'))
+
+from google.cloud import documentai_v1 as documentai
+
+from bench_table_extraction import build_document
+from csv_export import aligned_chunk_size, CSV_CHUNK_BYTES
+from rendering import iter_csv_outputs, render_results, iter_file_chunks
+from cpu_pool import InlineExecutor, ProcessExecutor, available_cpus
+
+
+def render_inline(executor, document, document_bytes, tables_mode, chunk_bytes):
+    """與 save_results 的 inline 路徑相同: JSON 轉換 + 串流 CSV 編碼 (區塊直接丟棄)"""
+    executor.run('to_json', documentai.Document.to_json, document)
+    return sum(sum(len(chunk) for chunk in chunks)
+               for _, chunks, _, _ in iter_csv_outputs(document, tables_mode, chunk_bytes))
+
+
+def render_offloaded(executor, document, document_bytes, tables_mode, chunk_bytes):
+    """與 save_results 的 process 路徑相同: 傳遞序列化 protobuf，工作行程寫入暫存檔後逐塊讀回"""
+    spool_dir = tempfile.mkdtemp(prefix='render_')
+    try:
+        _, outputs = executor.run('render', render_results, document_bytes, tables_mode, chunk_bytes, spool_dir)
+        return sum(sum(len(chunk) for chunk in iter_file_chunks(path, chunk_bytes)) for _, path, _, _ in outputs)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def run(executor, documents, threads, tables_mode, chunk_bytes):
+    render = render_offloaded if executor.offloads else render_inline
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        total = sum(pool.map(lambda item: render(executor, item[0], item[1], tables_mode, chunk_bytes), documents))
+    return time.perf_counter() - started, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU 行程池效能測試')
+    parser.add_argument('--documents', type=int, default=8, help='同時處理的文件數')
+    parser.add_argument('--threads', type=int, default=8, help='呼叫端執行緒數 (模擬並行的文件處理工作)')
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--tables', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='測試的行程池大小 (預設 1、2、4... 到 CPU 數)')
+    parser.add_argument('--tables-mode', action='store_true', help='使用 EXTRACTION_MODE=tables 的輸出')
+    args = parser.parse_args()
+
+    cpus = available_cpus()
+    workers_list = args.workers or [2 ** power for power in range(8) if 2 ** power < cpus] + [cpus]
+    chunk_bytes = aligned_chunk_size(CSV_CHUNK_BYTES)
+
+    documents = []
+    for index in range(args.documents):
+        pb = build_document(args.pages, args.tables, args.rows, args.columns, seed=index)
+        documents.append((documentai.Document.wrap(pb), pb.SerializeToString()))
+    cells = args.pages * args.tables * args.rows * args.columns
+    print(f"可用 CPU: {cpus}，{args.documents} 份文件 x {cells} 個儲存格，呼叫端 {args.threads} 個執行緒")
+    print(f"{'執行器':<12} {'耗時 (s)':>10} {'文件/秒':>10} {'加速':>8}")
+
+    baseline, _ = run(InlineExecutor(), documents, args.threads, args.tables_mode, chunk_bytes)
+    print(f"{'inline':<12} {baseline:>10.2f} {args.documents / baseline:>10.2f} {1.0:>7.2f}x")
+
+    for workers in workers_list:
+        executor = ProcessExecutor(workers)
+        executor.warm_up()
+        elapsed, _ = run(executor, documents, args.threads, args.tables_mode, chunk_bytes)
+        executor.shutdown()
+        print(f"{f'process x{workers}':<12} {elapsed:>10.2f} {args.documents / elapsed:>10.2f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+CSV 輸出效能測試
+比較舊的寫法 (完整列表 → DataFrame → CSV 字串) 與串流寫法 (generator → 分塊上傳) 的
+耗時與記憶體峰值 (tracemalloc)，文件大小為 10k / 100k / 1M 個表格儲存格。
+
+用法:
+  python local_test/bench_csv_export.py
+  python local_test/bench_csv_export.py --cells 10000 100000 1000000 --chunk-bytes 1048576
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+# 添加專案根目錄與文件處理器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'document_processor'))
+
+from google.cloud import documentai_v1 as documentai
+
+from extraction import iter_structured_data, extract_structured_data
+from csv_export import write_csv_blob
+
+
+class DiscardWriter:
+    """模擬 blob.open('wb')，只計算寫入的位元組數"""
+
+    def __init__(self, blob):
+        self.blob = blob
+
+    def write(self, data):
+        self.blob.uploaded += len(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class DiscardBlob:
+    """模擬 Cloud Storage Blob，不保留上傳內容"""
+
+    def __init__(self):
+        self.uploaded = 0
+
+    def upload_from_string(self, data, content_type=None):
+        self.uploaded += len(data)
+
+    def open(self, mode, chunk_size=None, content_type=None):
+        return DiscardWriter(self)
+
+
+def build_document(cells, columns=10, rows_per_table=1000):
+    """建立含指定儲存格數的 Document (直接操作 protobuf 以加快建立速度)"""
+    pb = documentai.Document.pb(documentai.Document())
+    words = [f"品項{index:05d}" for index in range(1000)]
+    offsets = []
+    position = 0
+    for word in words:
+        offsets.append((position, position + len(word)))
+        position += len(word) + 1
+    pb.text = ' '.join(words)
+
+    page = pb.pages.add(page_number=1)
+    table = None
+    for index in range(cells // columns):
+        if index % rows_per_table == 0:
+            table = page.tables.add()
+            header = table.header_rows.add()
+            for column in range(columns):
+                header.cells.add().layout.text_anchor.text_segments.add(
+                    start_index=offsets[column][0], end_index=offsets[column][1])
+        row = table.body_rows.add()
+        for column in range(columns):
+            start, end = offsets[(index * columns + column) % len(offsets)]
+            row.cells.add().layout.text_anchor.text_segments.add(start_index=start, end_index=end)
+    return pb
+
+
+def legacy_csv(document):
+    """舊寫法: 完整列表 → DataFrame → CSV 字串"""
+    import pandas as pd
+
+    extracted_data = extract_structured_data(document)
+    df = pd.DataFrame(extracted_data)
+    data = df.to_csv(index=False, encoding='utf-8')
+    DiscardBlob().upload_from_string(data, content_type='text/csv')
+    return len(extracted_data)
+
+
+def streaming_csv(document, chunk_bytes):
+    """串流寫法"""
+    rows, _ = write_csv_blob(DiscardBlob(), iter_structured_data(document), chunk_bytes=chunk_bytes)
+    return rows
+
+
+def measure(func, *args):
+    """分別量測耗時與記憶體峰值 (tracemalloc 本身會大幅拖慢執行)"""
+    started = time.perf_counter()
+    rows = func(*args)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSV 輸出效能測試')
+    parser.add_argument('--cells', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--chunk-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--skip-legacy', action='store_true', help='不測試舊寫法 (需要 pandas)')
+    args = parser.parse_args()
+
+    try:
+        import pandas  # noqa: F401
+        has_pandas = not args.skip_legacy
+    except ImportError:
+        has_pandas = False
+        print("未安裝 pandas，只測試串流寫法")
+
+    print(f"{'儲存格':>10} {'寫法':<6} {'列數':>10} {'耗時 (s)':>10} {'記憶體峰值 (MB)':>16}")
+    for cells in args.cells:
+        document = build_document(cells)
+        candidates = [('串流', streaming_csv, (document, args.chunk_bytes))]
+        if has_pandas:
+            candidates.insert(0, ('舊', legacy_csv, (document,)))
+        for label, func, func_args in candidates:
+            rows, elapsed, peak = measure(func, *func_args)
+            print(f"{cells:>10} {label:<6} {rows:>10} {elapsed:>10.2f} {peak / 1024 / 1024:>16.1f}")
+        del document
+
+
+if __name__ == "__main__":
+    main()
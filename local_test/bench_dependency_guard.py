@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+相依服務防護效能測試
+模擬一個相依服務: 正常 (耗時 --latency-ms) → 異常 (每次呼叫等到 --timeout-ms 逾時後失敗) → 恢復，
+多個執行緒持續呼叫，比較有無斷路器 / 自適應並行數時:
+  - 等待相依服務的執行緒秒數 (相當於執行個體被占用的時間與成本)，全部與異常期間分開列出
+  - 成功、失敗與被快速拒絕 (交給重試帳本延後) 的呼叫數
+  - 恢復後第一次成功呼叫所需的時間
+
+用法:
+  python local_test/bench_dependency_guard.py
+  python local_test/bench_dependency_guard.py --threads 64 --degraded-seconds 5 --timeout-ms 1000
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+# 添加專案根目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from config.dependency_guard import Dependency, DependencySettings, DependencyUnavailable
+
+
+class SimulatedService:
+    """依時間切換正常 / 異常的相依服務"""
+
+    def __init__(self, latency_ms, timeout_ms, degraded_from, degraded_until):
+        self.latency = latency_ms / 1000
+        self.timeout = timeout_ms / 1000
+        self.degraded_from = degraded_from
+        self.degraded_until = degraded_until
+        self.first_success_after_recovery = None
+
+    def __call__(self):
+        now = time.monotonic()
+        if self.degraded_from <= now < self.degraded_until:
+            time.sleep(self.timeout)
+            raise TimeoutError('逾時')
+        time.sleep(self.latency)
+        if now >= self.degraded_until and self.first_success_after_recovery is None:
+            self.first_success_after_recovery = now
+        return True
+
+
+def run(args, guarded):
+    started = time.monotonic()
+    service = SimulatedService(args.latency_ms, args.timeout_ms, started + args.healthy_seconds,
+                               started + args.healthy_seconds + args.degraded_seconds)
+    settings = DependencySettings(
+        slow_ms=args.timeout_ms / 2, target_ms=args.latency_ms * 4,
+        initial_concurrency=args.threads // 2, max_concurrency=args.threads,
+        failure_threshold=5, open_seconds=args.open_seconds, queue_seconds=0.05
+    )
+    dependency = Dependency('bench', settings)
+    end = started + args.healthy_seconds + args.degraded_seconds + args.recovery_seconds
+    lock = threading.Lock()
+    counts = {'ok': 0, 'failed': 0, 'rejected': 0, 'busy_seconds': 0.0, 'degraded_busy_seconds': 0.0}
+
+    def worker():
+        while time.monotonic() < end:
+            call_started = time.monotonic()
+            try:
+                if guarded:
+                    dependency.call(service)
+                else:
+                    service()
+                outcome = 'ok'
+            except DependencyUnavailable:
+                outcome = 'rejected'
+            except TimeoutError:
+                outcome = 'failed'
+            elapsed = time.monotonic() - call_started
+            with lock:
+                counts[outcome] += 1
+                counts['busy_seconds'] += elapsed
+                if service.degraded_from <= call_started < service.degraded_until:
+                    counts['degraded_busy_seconds'] += elapsed
+            if outcome == 'rejected':
+                # 被拒絕的工作交給重試帳本，執行緒可以處理其他工作
+                time.sleep(args.latency_ms / 1000)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    recovered = service.first_success_after_recovery
+    counts['recovery_ms'] = (recovered - service.degraded_until) * 1000 if recovered else float('nan')
+    counts['limit'] = dependency.limiter.limit
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='相依服務防護效能測試')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--timeout-ms', type=float, default=600)
+    parser.add_argument('--healthy-seconds', type=float, default=1)
+    parser.add_argument('--degraded-seconds', type=float, default=3)
+    parser.add_argument('--recovery-seconds', type=float, default=2)
+    parser.add_argument('--open-seconds', type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"{args.threads} 個執行緒，正常 {args.latency_ms:.0f} ms，異常時 {args.timeout_ms:.0f} ms 逾時 "
+          f"({args.healthy_seconds:g}s 正常 / {args.degraded_seconds:g}s 異常 / {args.recovery_seconds:g}s 恢復)")
+    print(f"{'模式':<8} {'成功':>8} {'失敗':>8} {'快速拒絕':>10} {'占用 (執行緒秒)':>16} {'異常期間占用':>12} {'恢復 (ms)':>10} {'並行上限':>8}")
+    for guarded in (False, True):
+        counts = run(args, guarded)
+        print(f"{'防護' if guarded else '無防護':<8} {counts['ok']:>8} {counts['failed']:>8} {counts['rejected']:>10} "
+              f"{counts['busy_seconds']:>16.1f} {counts['degraded_busy_seconds']:>12.1f} {counts['recovery_ms']:>10.0f} {counts['limit'] if guarded else '-':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+圖片感知雜湊效能測試
+1. 偵測效果: 產生類似收據的圖片，模擬 LINE 轉傳 (縮小 + 重新壓縮 JPEG)，比較同一張圖片與不同圖片的漢明距離
+2. 雜湊成本: 每張圖片的解碼 + 縮圖 + 雜湊耗時，以及 NumPy 批次計算的耗時
+3. 搜尋成本: 索引大小 1K ~ 1M 時單次搜尋的耗時，以及索引序列化 / 載入的耗時與大小
+
+需要 Pillow 與 NumPy。
+
+用法:
+  python local_test/bench_image_hash.py
+  python local_test/bench_image_hash.py --images 200 --sizes 1000 100000 1000000 --algorithm dhash
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import argparse
+
+# 添加專案根目錄與 webhook 目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'webhook_receiver'))
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from image_hash import ImageHashIndex, image_hash, phash_pixels, dhash_pixels, PHASH_SIZE
+
+
+def make_receipt(seed, width=1080, height=1920):
+    """產生類似收據的圖片 (白底與隨機長度的文字列)"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), (250, 250, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([60, 60, width - 60, 220], fill=(30, 30, 30))
+    y = 280
+    while y < height - 120:
+        x = 80
+        while x < width - 200:
+            length = rng.randint(40, 260)
+            draw.rectangle([x, y, x + length, y + 22], fill=(rng.randint(0, 80),) * 3)
+            x += length + rng.randint(20, 60)
+        y += rng.randint(40, 90)
+    return image
+
+
+def to_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def forwarded(image, seed):
+    """模擬轉傳: 縮小、輕微調整亮度後以較低品質重新壓縮"""
+    rng = random.Random(seed)
+    scale = rng.uniform(0.5, 0.9)
+    resized = image.resize((int(image.width * scale), int(image.height * scale)), Image.BILINEAR)
+    adjusted = resized.point(lambda value: min(255, int(value * rng.uniform(0.95, 1.05))))
+    return to_jpeg(adjusted, rng.randint(50, 80))
+
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def bench_detection(args):
+    originals = [to_jpeg(make_receipt(seed), 92) for seed in range(args.images)]
+    copies = [forwarded(Image.open(io.BytesIO(data)), seed) for seed, data in enumerate(originals)]
+
+    started = time.perf_counter()
+    original_hashes = [image_hash(data, args.algorithm) for data in originals]
+    hash_ms = (time.perf_counter() - started) * 1000 / len(originals)
+    copy_hashes = [image_hash(data, args.algorithm) for data in copies]
+
+    same = [distance(a, b) for a, b in zip(original_hashes, copy_hashes)]
+    different = [distance(original_hashes[i], original_hashes[j])
+                 for i in range(len(originals)) for j in range(i + 1, len(originals))]
+    print(f"[偵測] {args.algorithm}，{args.images} 張 ({sum(map(len, originals)) / len(originals) / 1024:.0f} KB/張)")
+    print(f"  解碼 + 縮圖 + 雜湊: {hash_ms:.2f} ms/張")
+    print(f"  同一張 (轉傳後) 距離: 平均 {np.mean(same):.1f}，最大 {max(same)}")
+    print(f"  不同張距離:           平均 {np.mean(different):.1f}，最小 {min(different)}")
+    for threshold in (4, 6, 8, 10):
+        recall = sum(d <= threshold for d in same) / len(same)
+        false_rate = sum(d <= threshold for d in different) / len(different)
+        print(f"  門檻 {threshold:>2}: 偵測率 {recall:6.1%}，誤判率 {false_rate:7.3%}")
+
+
+def bench_batch(args):
+    rng = np.random.default_rng(0)
+    if args.algorithm == 'dhash':
+        pixels = rng.random((10000, 8, 9), dtype=np.float32)
+        func = dhash_pixels
+    else:
+        pixels = rng.random((10000, PHASH_SIZE, PHASH_SIZE), dtype=np.float32)
+        func = phash_pixels
+    started = time.perf_counter()
+    func(pixels)
+    elapsed = time.perf_counter() - started
+    print(f"\n[批次雜湊] 10000 張縮圖: {elapsed * 1000:.1f} ms ({elapsed * 1e6 / 10000:.1f} µs/張，不含解碼)")
+
+
+def bench_lookup(args):
+    print(f"\n[搜尋] {'索引大小':>10} {'搜尋 (ms)':>10} {'序列化 (ms)':>12} {'載入 (ms)':>10} {'大小 (MB)':>10}")
+    rng = np.random.default_rng(1)
+    for size in args.sizes:
+        index = ImageHashIndex()
+        hashes = rng.integers(0, 2 ** 63, size=size, dtype=np.uint64)
+        for position, value in enumerate(hashes):
+            # 單一租戶 (最壞情況: 整個索引在同一個分區)
+            index.add(int(value), f"line-images/2024/06/01/{position % 256:02x}/{position:016x}_image.jpg", 'Cbench')
+        queries = rng.integers(0, 2 ** 63, size=args.queries, dtype=np.uint64)
+        started = time.perf_counter()
+        for query in queries:
+            index.nearest(int(query), 'Cbench')
+        lookup_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        started = time.perf_counter()
+        data = index.to_bytes()
+        save_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        loaded = ImageHashIndex.from_bytes(data)
+        load_ms = (time.perf_counter() - started) * 1000
+        assert len(loaded) == size
+        print(f"       {size:>10} {lookup_ms:>10.3f} {save_ms:>12.1f} {load_ms:>10.1f} {len(data) / 1024 / 1024:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='圖片感知雜湊效能測試')
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--algorithm', choices=['phash', 'dhash'], default='phash')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    bench_detection(args)
+    bench_batch(args)
+    bench_lookup(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+本地擷取效能測試
+在記憶體中產生 .xlsx / .docx / .pptx / .txt (已安裝 pypdf 時加上 PDF)，量測 local_extract 的延遲、
+命中率與表格輸出，並與 Document AI 的典型延遲 (--docai-ms) 比較節省的時間。
+
+用法:
+  python local_test/bench_local_extract.py
+  python local_test/bench_local_extract.py --rows 5000 --columns 20 --docai-ms 4000
+"""
+
+import io
+import os
+import sys
+import time
+import zipfile
+import argparse
+from xml.sax.saxutils import escape
+
+# 添加專案根目錄與文件處理器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'document_processor'))
+
+from local_extract import extract_local
+from rendering import iter_csv_outputs
+
+_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_A = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+
+
+def column_letters(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def make_xlsx(rows, columns, sheets=2):
+    """產生 .xlsx (第一列為表頭，文字使用 sharedStrings，數值直接寫入)"""
+    shared = []
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        sheet_entries = []
+        relations = []
+        for sheet in range(sheets):
+            lines = []
+            for row in range(rows + 1):
+                cells = []
+                for column in range(columns):
+                    ref = f"{column_letters(column)}{row + 1}"
+                    if row == 0 or column == 0:
+                        shared.append(f"欄位{column}" if row == 0 else f"項目{sheet}-{row}")
+                        cells.append(f'<c r="{ref}" t="s"><v>{len(shared) - 1}</v></c>')
+                    else:
+                        cells.append(f'<c r="{ref}"><v>{row * column}</v></c>')
+                lines.append(f'<row r="{row + 1}">{"".join(cells)}</row>')
+            archive.writestr(f'xl/worksheets/sheet{sheet + 1}.xml',
+                             f'<worksheet xmlns="{_MAIN}"><sheetData>{"".join(lines)}</sheetData></worksheet>')
+            sheet_entries.append(f'<sheet name="工作表{sheet + 1}" sheetId="{sheet + 1}" r:id="rId{sheet + 1}"/>')
+            relations.append(f'<Relationship Id="rId{sheet + 1}" Target="worksheets/sheet{sheet + 1}.xml"/>')
+        archive.writestr('xl/workbook.xml',
+                         f'<workbook xmlns="{_MAIN}" xmlns:r="{_REL}"><sheets>{"".join(sheet_entries)}</sheets></workbook>')
+        archive.writestr('xl/_rels/workbook.xml.rels',
+                         f'<Relationships xmlns="{_PKG}">{"".join(relations)}</Relationships>')
+        items = ''.join(f'<si><t>{escape(text)}</t></si>' for text in shared)
+        archive.writestr('xl/sharedStrings.xml', f'<sst xmlns="{_MAIN}">{items}</sst>')
+    return buffer.getvalue()
+
+
+def make_docx(paragraphs, rows, columns):
+    """產生 .docx (段落加上一個表格)"""
+    body = ''.join(f'<w:p><w:r><w:t>第 {i} 段: 報價單內容說明</w:t></w:r></w:p>' for i in range(paragraphs))
+    table_rows = ''.join(
+        '<w:tr>' + ''.join(f'<w:tc><w:p><w:r><w:t>{row}-{column}</w:t></w:r></w:p></w:tc>'
+                           for column in range(columns)) + '</w:tr>'
+        for row in range(rows + 1)
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('word/document.xml',
+                         f'<w:document xmlns:w="{_W}"><w:body>{body}<w:tbl>{table_rows}</w:tbl></w:body></w:document>')
+    return buffer.getvalue()
+
+
+def make_pptx(slides):
+    """產生 .pptx (每張投影片兩個段落)"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for slide in range(slides):
+            archive.writestr(f'ppt/slides/slide{slide + 1}.xml',
+                             f'<p:sld xmlns:p="p" xmlns:a="{_A}"><a:p><a:r><a:t>標題 {slide + 1}</a:t></a:r></a:p>'
+                             f'<a:p><a:r><a:t>內容說明 {slide + 1}</a:t></a:r></a:p></p:sld>')
+    return buffer.getvalue()
+
+
+def make_text(pages, lines):
+    return '\f'.join('\n'.join(f"第 {page + 1} 頁第 {line + 1} 行" for line in range(lines))
+                     for page in range(pages)).encode('utf-8')
+
+
+def make_pdf(pages):
+    """產生有文字層的 PDF (需要 pypdf 與 reportlab，未安裝時回傳 None)"""
+    try:
+        from reportlab.pdfgen import canvas
+    except ImportError:
+        return None
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for page in range(pages):
+        for line in range(20):
+            pdf.drawString(72, 800 - line * 14, f"Invoice page {page + 1} line {line + 1} amount {line * 100}")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地擷取效能測試')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--docai-ms', type=float, default=3000, help='Document AI 的典型延遲 (毫秒)')
+    args = parser.parse_args()
+
+    samples = [
+        ('sample.xlsx', make_xlsx(args.rows, args.columns)),
+        ('sample.docx', make_docx(args.pages * 20, args.rows // 10, args.columns)),
+        ('sample.pptx', make_pptx(args.pages)),
+        ('sample.txt', make_text(args.pages, 40)),
+        ('sample.xls', b'\xd0\xcf\x11\xe0' + b'\0' * 512),
+    ]
+    pdf = make_pdf(args.pages)
+    if pdf:
+        samples.append(('sample.pdf', pdf))
+    else:
+        print("略過 PDF (需要 reportlab 與 pypdf)")
+
+    print(f"{'檔案':<14} {'大小 (KB)':>10} {'結果':>6} {'頁數':>6} {'表格':>6} {'儲存格':>8} {'擷取 (ms)':>10} {'節省 (ms)':>10}")
+    hits = 0
+    saved = 0.0
+    for file_name, data in samples:
+        best = float('inf')
+        document = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            document = extract_local(file_name, data)
+            best = min(best, time.perf_counter() - started)
+        if document is None:
+            print(f"{file_name:<14} {len(data) / 1024:>10.1f} {'miss':>6}")
+            continue
+        hits += 1
+        saved += args.docai_ms - best * 1000
+        tables = sum(len(page.tables) for page in document.pages)
+        rows = 0
+        for _, chunks, counter, _ in iter_csv_outputs(document, True, 64 * 1024):
+            for _ in chunks:
+                pass
+            rows += counter['rows']
+        print(f"{file_name:<14} {len(data) / 1024:>10.1f} {'hit':>6} {len(document.pages):>6} {tables:>6} "
+              f"{rows:>8} {best * 1000:>10.1f} {args.docai_ms - best * 1000:>10.1f}")
+
+    print(f"\n命中率: {hits}/{len(samples)}，相對 Document AI ({args.docai_ms:.0f} ms) 共節省 {saved / 1000:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
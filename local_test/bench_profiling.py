@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+請求層級效能分析的負擔測試
+以模擬的請求 (解析 JSON、計算雜湊、交給工作執行緒處理) 比較每個請求的耗時:
+  - 未使用分析 (基準)
+  - 停用 (PROFILE_SAMPLE_RATE=0，進入點、attached() 與 annotate() 只做布林判斷)
+  - 依取樣率分析 (cprofile / stack，可加上 tracemalloc)
+
+各模式以相同的設定值在同一個行程中執行 (以 env_manager.override 覆寫設定快照)，
+分析結果寫入暫存目錄後以 scripts/profile_report.py 的方式彙整。
+
+用法:
+  python local_test/bench_profiling.py
+  python local_test/bench_profiling.py --requests 5000 --rate 0.01
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加專案根目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from config import profiling
+from config.env_manager import env_manager
+
+BODY = json.dumps({'events': [{'type': 'message', 'message': {'type': 'file', 'id': str(index),
+                                                               'fileName': f"invoice_{index}.pdf", 'fileSize': 1024}}
+                              for index in range(5)]}).encode('utf-8')
+CONTENT = os.urandom(64 * 1024)
+
+
+def handle_event(event):
+    profiling.annotate(message_type=event['message']['type'])
+    digest = hashlib.md5(CONTENT).hexdigest()
+    return json.dumps({'event': event, 'hash': digest})
+
+
+def handle_request(executor):
+    """模擬 line_webhook_handler: 解析後交給工作執行緒處理每個事件"""
+    events = json.loads(BODY)['events']
+    futures = [executor.submit(contextvars.copy_context().run, profiling.attached(handle_event), event)
+               for event in events]
+    return [future.result() for future in futures]
+
+
+def run(executor, count, wrap):
+    started = time.perf_counter()
+    for _ in range(count):
+        with wrap():
+            handle_request(executor)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def configure(rate, engine='cprofile', trace=False):
+    env_manager.override(PROFILE_SAMPLE_RATE=rate, PROFILE_ENGINE=engine, PROFILE_TRACEMALLOC=str(trace).lower())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='請求層級效能分析的負擔測試')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=0.01, help='取樣模式的取樣率')
+    args = parser.parse_args()
+
+    output = tempfile.mkdtemp(prefix='profile_bench_')
+    env_manager.override(PROFILE_OUTPUT=output)
+    executor = ThreadPoolExecutor(max_workers=4)
+    modes = [
+        ('未使用分析', 0, 'cprofile', False, contextlib.nullcontext),
+        ('停用', 0, 'cprofile', False, None),
+        (f"cprofile 取樣 {args.rate:g}", args.rate, 'cprofile', False, None),
+        ('cprofile 全部', 1, 'cprofile', False, None),
+        ('stack 全部', 1, 'stack', False, None),
+        ('cprofile + tracemalloc 全部', 1, 'cprofile', True, None),
+    ]
+    # 暖機
+    run(executor, 200, contextlib.nullcontext)
+
+    print(f"{args.requests} 個請求 (每個 5 個事件)，單位: 微秒 / 請求")
+    baseline = None
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        results = []
+        for label, rate, engine, trace, wrap in modes:
+            configure(rate, engine, trace)
+            count = args.requests if rate < 1 else max(50, args.requests // 10)
+            elapsed = run(executor, count, wrap or (lambda: profiling.request('webhook')))
+            results.append((label, elapsed))
+    for label, elapsed in results:
+        baseline = baseline or elapsed
+        print(f"{label:<30} {elapsed:>10.1f} {(elapsed / baseline - 1) * 100:>+8.1f}%")
+
+    written = sum(len(files) for _, _, files in os.walk(output)) // 2
+    print(f"\n寫出 {written} 個分析結果到 {output}")
+    shutil.rmtree(output)
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
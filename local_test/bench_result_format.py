@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+結果儲存格式效能測試
+比較 Document AI JSON (目前的 .json 結果) 與 result_store 的 protobuf 格式 (不壓縮 / gzip / zstd)
+的檔案大小、編碼耗時與解碼耗時。zstd 需要安裝 zstandard，未安裝時略過。
+
+用法:
+  python local_test/bench_result_format.py
+  python local_test/bench_result_format.py --pages 50 --tables 4 --rows 200 --columns 12
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# 添加專案根目錄與文件處理器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'document_processor'))
+
+from google.cloud import documentai_v1 as documentai
+
+from bench_table_extraction import build_document
+from result_store import encode_result, decode_result
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def json_encode(document):
+    return documentai.Document.to_json(document).encode('utf-8')
+
+
+def json_decode(data):
+    return documentai.Document.from_json(data.decode('utf-8'), ignore_unknown_fields=True)
+
+
+def protobuf_encode(document, codec):
+    # 與 save_results 相同: 先序列化 (重試帳本檢查點) 再編碼
+    return encode_result(documentai.Document.serialize(document), 'default', codec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='結果儲存格式效能測試')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--tables', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    document = documentai.Document.wrap(build_document(args.pages, args.tables, args.rows, args.columns))
+    print(f"文件: {args.pages} 頁 x {args.tables} 表格 x {args.rows} 列 x {args.columns} 欄")
+    print(f"{'格式':<14} {'大小 (KB)':>12} {'相對 JSON':>10} {'編碼 (ms)':>10} {'解碼 (ms)':>10}")
+
+    encode_time, data = best_of(args.repeat, json_encode, document)
+    decode_time, _ = best_of(args.repeat, json_decode, data)
+    json_size = len(data)
+    print(f"{'json':<14} {json_size / 1024:>12.1f} {1.0:>9.2f}x {encode_time * 1000:>10.1f} {decode_time * 1000:>10.1f}")
+
+    for codec in ('none', 'gzip', 'zstd'):
+        try:
+            encode_time, data = best_of(args.repeat, protobuf_encode, document, codec)
+        except ImportError as e:
+            print(f"{'protobuf+' + codec:<14} 略過 ({e})")
+            continue
+        decode_time, (_, decoded) = best_of(args.repeat, decode_result, data)
+        assert decoded == documentai.Document.pb(document)
+        print(f"{'protobuf+' + codec:<14} {len(data) / 1024:>12.1f} {len(data) / json_size:>9.2f}x "
+              f"{encode_time * 1000:>10.1f} {decode_time * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Webhook 接收器服務模式效能測試
+以假 LINE / GCS 服務分別啟動 Flask 開發伺服器與正式服務模式 (gunicorn 多工作行程)，
+再以 replay_webhook.py 全速送出相同的記錄檔，比較吞吐量與延遲。
+
+用法:
+  python local_test/bench_server.py
+  python local_test/bench_server.py --capture /tmp/burst.jsonl.gz --concurrency 32 --workers 4 --threads 8
+
+  # 只啟動使用假服務的接收器 (手動測試用)
+  python local_test/bench_server.py serve --mode prefork --port 18080
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+import requests
+
+# 添加專案根目錄與 webhook 接收器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'webhook_receiver'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+REPLAY = os.path.join(project_root, 'local_test', 'replay_webhook.py')
+
+
+def serve(args):
+    """以假服務載入接收器並啟動指定的服務模式"""
+    from replay_webhook import load_receiver
+    from fake_services import install_fakes
+
+    work_dir = tempfile.mkdtemp(prefix='line_server_bench_')
+    receiver = load_receiver(work_dir, auto_reply=False)
+    install_fakes(receiver, download_latency=args.download_latency / 1000, upload_latency=args.upload_latency / 1000)
+    # 接收器每個請求都會輸出完整內容，測試時不顯示
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        if args.mode == 'prefork':
+            from server import serve as serve_prefork
+            serve_prefork(receiver.app, f"127.0.0.1:{args.port}", workers=args.workers, threads=args.threads,
+                          on_worker_start=receiver.init_worker, on_worker_exit=receiver.drain_worker)
+        else:
+            receiver.app.run(host='127.0.0.1', port=args.port, threaded=True)
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}health", timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+def run_mode(args, mode, port):
+    url = f"http://127.0.0.1:{port}/"
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve', '--mode', mode, '--port', str(port),
+         '--workers', str(args.workers), '--threads', str(args.threads),
+         '--download-latency', str(args.download_latency), '--upload-latency', str(args.upload_latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_ready(url):
+            print(f"⚠️ {mode} 伺服器未啟動")
+            return
+        output = subprocess.run(
+            [sys.executable, REPLAY, 'replay', args.capture, '--url', url, '--speed', '0',
+             '--concurrency', str(args.concurrency)],
+            capture_output=True, text=True
+        ).stdout
+        print(f"\n[{mode}]")
+        for line in output.splitlines():
+            if line.startswith(('完成', '狀態', '處理耗時')):
+                print(f"  {line}")
+    finally:
+        # 正式服務模式收到 SIGTERM 後等待進行中的請求完成
+        child.terminate()
+        child.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook 接收器服務模式效能測試')
+    parser.add_argument('command', nargs='?', default='bench', choices=['bench', 'serve'])
+    parser.add_argument('--mode', default='dev', choices=['dev', 'prefork'])
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--capture', help='記錄檔 (未指定時以 replay_webhook.py synth 產生)')
+    parser.add_argument('--events', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--download-latency', type=float, default=50, help='假下載延遲 (ms)')
+    parser.add_argument('--upload-latency', type=float, default=30, help='假上傳延遲 (ms)')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args)
+        return
+
+    if not args.capture:
+        args.capture = os.path.join(tempfile.mkdtemp(prefix='line_server_bench_'), 'burst.jsonl')
+        subprocess.run([sys.executable, REPLAY, 'synth', args.capture, '--events', str(args.events), '--users', '20'],
+                       check=True, stdout=subprocess.DEVNULL)
+    print(f"記錄檔: {args.capture}，並行 {args.concurrency}，正式服務模式 {args.workers} 個工作行程 x {args.threads} 個執行緒")
+    run_mode(args, 'dev', args.port)
+    run_mode(args, 'prefork', args.port + 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+表格擷取效能測試
+以表格密集的假文件 (多頁、每頁多個表格、含跨欄表頭) 比較:
+  flat          - 攤平成 table_header / table_body 列 (不含位置)
+  per-cell      - 逐格呼叫 layout_text，以列 / 欄序號當作位置 (下游重建表格的常見做法，不處理跨欄跨列)
+  tables        - iter_tables: 保留表格結構，一次解析所有儲存格文字
+
+用法:
+  python local_test/bench_table_extraction.py
+  python local_test/bench_table_extraction.py --pages 50 --tables 4 --rows 200 --columns 12
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# 添加專案根目錄與文件處理器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'document_processor'))
+
+from google.cloud import documentai_v1 as documentai
+
+from extraction import iter_structured_data, iter_tables, layout_text
+
+
+def build_document(pages, tables, rows, columns, seed=7):
+    """建立表格密集的 Document (直接操作 protobuf)；表頭第一列為跨兩欄的群組名稱"""
+    rng = random.Random(seed)
+    words = [f"值{index:04d}" for index in range(2000)]
+    offsets = []
+    position = 0
+    for word in words:
+        offsets.append((position, position + len(word)))
+        position += len(word) + 1
+
+    pb = documentai.Document.pb(documentai.Document())
+    pb.text = ' '.join(words)
+
+    def add_cell(row, col_span=1):
+        cell = row.cells.add(col_span=col_span, row_span=1)
+        start, end = offsets[rng.randrange(len(offsets))]
+        cell.layout.confidence = rng.uniform(0.6, 1.0)
+        cell.layout.text_anchor.text_segments.add(start_index=start, end_index=end)
+
+    for page_number in range(1, pages + 1):
+        page = pb.pages.add(page_number=page_number)
+        for _ in range(tables):
+            table = page.tables.add()
+            group_row = table.header_rows.add()
+            for _ in range(columns // 2):
+                add_cell(group_row, col_span=2)
+            name_row = table.header_rows.add()
+            for _ in range(columns):
+                add_cell(name_row)
+            for _ in range(rows):
+                body_row = table.body_rows.add()
+                for _ in range(columns):
+                    add_cell(body_row)
+    return pb
+
+
+def run_flat(document):
+    return sum(1 for _ in iter_structured_data(document))
+
+
+def run_per_cell(document):
+    """逐格解析文字，以列 / 欄序號當作位置 (不處理跨欄跨列)，輸出與 tables 模式相同的列"""
+    cells = []
+    text = document.text
+    for page in document.pages:
+        for table_index, table in enumerate(page.tables):
+            for row_index, row in enumerate(table.body_rows):
+                for column, cell in enumerate(row.cells):
+                    cells.append({
+                        'table_id': f"p{page.page_number}_t{table_index + 1}",
+                        'page': page.page_number,
+                        'row_index': row_index,
+                        'column_index': column,
+                        'column': f"column_{column + 1}",
+                        'value': layout_text(text, cell.layout),
+                        'confidence': round(cell.layout.confidence, 4)
+                    })
+    return len(cells)
+
+
+def run_tables(document):
+    return sum(len(table.cells) for table in iter_tables(document))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='表格擷取效能測試')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--tables', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    document = build_document(args.pages, args.tables, args.rows, args.columns)
+    cells = args.pages * args.tables * args.rows * args.columns
+    print(f"文件: {args.pages} 頁 x {args.tables} 表格 x {args.rows} 列 x {args.columns} 欄 = {cells} 個內容儲存格")
+    print(f"{'模式':<10} {'輸出列數':>10} {'最佳耗時 (s)':>14} {'儲存格/秒':>12}")
+
+    for label, func in (('flat', run_flat), ('per-cell', run_per_cell), ('tables', run_tables)):
+        best = float('inf')
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            count = func(document)
+            best = min(best, time.perf_counter() - started)
+        print(f"{label:<10} {count:>10} {best:>14.3f} {cells / best:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
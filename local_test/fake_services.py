@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+本地假 LINE / Cloud Storage 服務
+提供 webhook_receiver/main.py 使用到的 requests、LineBotApi 與 storage.Client 測試替身，
+可設定下載內容大小與模擬延遲，用於不連線外部服務的情況下重播 Webhook 流量。
+
+connect_latency 模擬新執行個體第一次連線的成本 (DNS、TLS 交握、取得存取權杖)：
+每個 LINE 主機的第一個請求與每個 storage.Client 的第一個請求各多等待一次，之後視為沿用連線池。
+"""
+
+import time
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import requests
+
+
+class FakeResponse:
+    """假的 HTTP 回應"""
+
+    def __init__(self, status_code=200, content=b'', content_type='application/octet-stream'):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {'content-type': content_type, 'content-length': str(len(content))}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+
+class FakeLineHttp:
+    """
+    假的 LINE HTTP API (取代 main.requests)
+
+    下載 (api-data.line.me) 回傳指定大小的內容，回覆 / push 訊息直接回傳 200。
+    """
+
+    exceptions = requests.exceptions
+    adapters = requests.adapters
+
+    def __init__(self, content_size=200 * 1024, download_latency=0.05, message_latency=0.02, connect_latency=0.0):
+        """
+        初始化假服務
+
+        Args:
+            content_size: 下載內容大小 (bytes)
+            download_latency: 每次下載的模擬延遲 (秒)
+            message_latency: 每次回覆 / push 的模擬延遲 (秒)
+            connect_latency: 每個主機第一次連線的模擬延遲 (秒)
+        """
+        self.content = b'\0' * content_size
+        self.download_latency = download_latency
+        self.message_latency = message_latency
+        self.connect_latency = connect_latency
+        self.calls = {'download': 0, 'message': 0}
+        self._connected = set()
+        self._lock = threading.Lock()
+
+    def _count(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+
+    def _connect(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host in self._connected:
+                return
+            self._connected.add(host)
+        time.sleep(self.connect_latency)
+
+    def Session(self):
+        return self
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def head(self, url, headers=None, timeout=None, **kwargs):
+        self._connect(url)
+        return FakeResponse(404)
+
+    def get(self, url, headers=None, timeout=None, **kwargs):
+        self._connect(url)
+        if url.endswith('/bot/info'):
+            return FakeResponse(200, b'{}', 'application/json')
+        if url.endswith('/content/header'):
+            return FakeResponse(200, b'{}', 'application/json')
+        self._count('download')
+        time.sleep(self.download_latency)
+        return FakeResponse(200, self.content)
+
+    def post(self, url, headers=None, json=None, timeout=None, **kwargs):
+        if 'api-data.line.me' in url:
+            return self.get(url, headers=headers, timeout=timeout)
+        self._connect(url)
+        self._count('message')
+        time.sleep(self.message_latency)
+        return FakeResponse(200, b'{}', 'application/json')
+
+
+class FakeLineBotApi:
+    """假的 LineBotApi (僅提供 get_message_content)"""
+
+    http = None
+
+    def __init__(self, channel_access_token=None):
+        self.channel_access_token = channel_access_token
+
+    def get_message_content(self, message_id, timeout=None):
+        self.http._count('download')
+        time.sleep(self.http.download_latency)
+        return SimpleNamespace(content=self.http.content, content_type='image/jpeg')
+
+
+class FakeBlob:
+    """假的 GCS Blob"""
+
+    def __init__(self, client, bucket_name, name):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.name = name
+        self.metadata = None
+
+    def exists(self, timeout=None):
+        self.client._connect()
+        return f"{self.bucket_name}/{self.name}" in self.client.objects
+
+    def upload_from_filename(self, file_path, timeout=None):
+        self.client._connect()
+        time.sleep(self.client.upload_latency)
+        with open(file_path, 'rb') as f:
+            size = len(f.read())
+        with self.client.lock:
+            type(self.client).uploads += 1
+            self.client.objects[f"{self.bucket_name}/{self.name}"] = size
+
+
+class FakeBucket:
+    """假的 GCS Bucket"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self.client, self.name, name)
+
+
+class FakeStorageClient:
+    """假的 storage.Client (上傳內容只記錄大小)"""
+
+    upload_latency = 0.03
+    connect_latency = 0.0
+    uploads = 0
+    objects = {}
+    lock = threading.Lock()
+
+    def __init__(self):
+        self._connected = threading.Event()
+
+    def _connect(self):
+        # 第一個請求取得存取權杖並建立連線
+        with self.lock:
+            if self._connected.is_set():
+                return
+            time.sleep(self.connect_latency)
+            self._connected.set()
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+
+def install_fakes(module, content_size=200 * 1024, download_latency=0.05,
+                  message_latency=0.02, upload_latency=0.03, connect_latency=0.0):
+    """
+    將 webhook_receiver 模組的外部服務替換為假服務
+
+    Args:
+        module: 已載入的 webhook_receiver main 模組
+        content_size: 下載內容大小 (bytes)
+        download_latency: 每次下載的模擬延遲 (秒)
+        message_latency: 每次回覆 / push 的模擬延遲 (秒)
+        upload_latency: 每次上傳的模擬延遲 (秒)
+        connect_latency: 第一次連線的模擬延遲 (秒，每個 LINE 主機與每個 storage.Client 各一次)
+
+    Returns:
+        FakeLineHttp (可查詢呼叫次數) 與 FakeStorageClient 類別
+    """
+    http = FakeLineHttp(content_size, download_latency, message_latency, connect_latency)
+    FakeLineBotApi.http = http
+    FakeStorageClient.upload_latency = upload_latency
+    FakeStorageClient.connect_latency = connect_latency
+    FakeStorageClient.objects = {}
+    FakeStorageClient.uploads = 0
+
+    module.requests = http
+    module.LineBotApi = FakeLineBotApi
+    module.storage = SimpleNamespace(Client=FakeStorageClient)
+    return http, FakeStorageClient
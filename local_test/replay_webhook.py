@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Webhook 重播工具
+將 WEBHOOK_CAPTURE_PATH 錄下的請求依原始間隔 (或 N 倍速、全速) 重新送進 webhook 接收器，
+接收器使用本地假 LINE / GCS 服務 (local_test/fake_services.py)，最後輸出吞吐量與延遲分佈。
+
+用法:
+  # 產生合成的突發流量記錄檔 (一位用戶大量傳圖 + 其他用戶零星傳檔)
+  python local_test/replay_webhook.py synth /tmp/burst.jsonl.gz --events 300 --users 5
+
+  # 依原始間隔重播 / 10 倍速 / 全速
+  python local_test/replay_webhook.py replay /tmp/webhook_capture.jsonl.gz --speed 1
+  python local_test/replay_webhook.py replay /tmp/burst.jsonl.gz --speed 10 --concurrency 8
+  python local_test/replay_webhook.py replay /tmp/burst.jsonl.gz --speed 0
+
+  # 送往實際執行中的接收器 (例如 python webhook_receiver/main.py)
+  python local_test/replay_webhook.py replay /tmp/burst.jsonl.gz --url http://localhost:8080/
+
+  # 比較冷啟動 / 預熱後第一個請求的延遲 (先呼叫 GET /warmup 再重播)
+  python local_test/replay_webhook.py replay /tmp/burst.jsonl.gz --speed 0 --limit 50
+  python local_test/replay_webhook.py replay /tmp/burst.jsonl.gz --speed 0 --limit 50 --warm-up
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+import threading
+import contextlib
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加專案根目錄與 webhook 接收器目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'webhook_receiver'))
+
+from replay_recorder import WebhookRecorder, read_capture
+
+
+class FakeRequest:
+    """最小的 Flask request 替身 (接收器只用到這些屬性)"""
+
+    method = 'POST'
+    path = '/'
+
+    def __init__(self, body: bytes, headers: dict):
+        self._body = body
+        self.headers = headers
+
+    def get_data(self, cache=True):
+        return self._body
+
+    def get_json(self):
+        return json.loads(self._body) if self._body else None
+
+
+def load_receiver(work_dir, auto_reply, prefetch=True):
+    """
+    以隔離的暫存目錄載入 webhook 接收器 (下載目錄、重試帳本都放在 work_dir)
+
+    重播時關閉錄製，避免把重播流量再錄一次。
+    """
+    os.environ['HOME'] = work_dir
+    os.environ['RETRY_LEDGER_PATH'] = os.path.join(work_dir, 'retry_ledger.db')
+    os.environ['WEBHOOK_CAPTURE_PATH'] = ''
+    os.environ['AUTO_REPLY_ENABLED'] = 'true' if auto_reply else 'false'
+    os.environ['PREFETCH_ENABLED'] = 'true' if prefetch else 'false'
+    os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'replay-token')
+
+    module_path = os.path.join(project_root, 'webhook_receiver', 'main.py')
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        spec = importlib.util.spec_from_file_location('webhook_receiver_main', module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    # 走雲端路徑，讓上傳階段也使用假 GCS
+    module.ENVIRONMENT = 'cloud'
+    return module
+
+
+def make_local_sender(args, work_dir):
+    """建立送往本地接收器 (假 LINE / GCS) 的發送函式"""
+    from fake_services import install_fakes
+
+    receiver = load_receiver(work_dir, args.auto_reply, not args.no_prefetch)
+    install_fakes(receiver, content_size=args.content_size,
+                  download_latency=args.download_latency / 1000,
+                  message_latency=args.message_latency / 1000,
+                  upload_latency=args.upload_latency / 1000,
+                  connect_latency=args.connect_latency / 1000)
+
+    def send(body, headers):
+        return receiver.line_webhook(FakeRequest(body, headers))[1]
+    return send, receiver
+
+
+def warm_up_local(receiver):
+    """呼叫本地接收器的 GET /warmup"""
+    request = FakeRequest(b'', {})
+    request.method = 'GET'
+    request.path = '/warmup'
+    return receiver.line_webhook(request)[0]
+
+
+def warm_up_http(url):
+    """呼叫實際 HTTP 端點的 GET /warmup"""
+    import requests
+
+    return requests.get(f"{url.rstrip('/')}/warmup", timeout=120).json()
+
+
+def make_http_sender(url):
+    """建立送往實際 HTTP 端點的發送函式"""
+    import requests
+
+    session = requests.Session()
+
+    def send(body, headers):
+        headers = {k: v for k, v in headers.items() if k in ('Content-Type', 'User-Agent')}
+        return session.post(url, data=body, headers=headers, timeout=120).status_code
+    return send
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def replay(args):
+    """重播記錄檔並輸出統計"""
+    entries = [entry for entry in read_capture(args.capture) if entry.get('body')]
+    entries.sort(key=lambda entry: entry['t'])
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print("記錄檔沒有可重播的請求")
+        return 1
+
+    work_dir = tempfile.mkdtemp(prefix='line_replay_')
+    receiver = None
+    if args.url:
+        send = make_http_sender(args.url)
+        target = args.url
+    else:
+        send, receiver = make_local_sender(args, work_dir)
+        target = f"本地接收器 (假 LINE/GCS，工作目錄 {work_dir})"
+
+    speed = args.speed
+    first_t = entries[0]['t']
+    span = entries[-1]['t'] - first_t
+    print(f"🔁 重播 {len(entries)} 個請求 (原始時間跨度 {span:.2f} s)")
+    print(f"   目標: {target}")
+    print(f"   速度: {'全速' if speed <= 0 else f'{speed:g}x'}  並行: {args.concurrency}")
+
+    warmup_ms = None
+    if args.warm_up:
+        warmup_started = time.perf_counter()
+        output = open(os.devnull, 'w') if not args.verbose else sys.stdout
+        with contextlib.redirect_stdout(output):
+            report = warm_up_http(args.url) if args.url else warm_up_local(receiver)
+        warmup_ms = (time.perf_counter() - warmup_started) * 1000
+        steps = ', '.join(f"{name} {step['ms']:.0f} ms" for name, step in report.get('steps', {}).items())
+        print(f"   預熱: {warmup_ms:.1f} ms ({steps})")
+
+    service_ms = []
+    total_ms = []
+    by_index = {}
+    statuses = {}
+    lock = threading.Lock()
+
+    def run(index, entry, scheduled_at):
+        body = entry['body'].encode('utf-8')
+        headers = dict(entry.get('headers') or {})
+        headers['Content-Type'] = headers.get('Content-Type', 'application/json')
+        started = time.perf_counter()
+        try:
+            status = send(body, headers)
+        except Exception as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        with lock:
+            service_ms.append((finished - started) * 1000)
+            total_ms.append((finished - scheduled_at) * 1000)
+            by_index[index] = (finished - started) * 1000
+            statuses[status] = statuses.get(status, 0) + 1
+
+    output = open(os.devnull, 'w') if not args.verbose else sys.stdout
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for index, entry in enumerate(entries):
+                # 依原始時間間隔排程；全速模式下直接送出
+                scheduled_at = started
+                if speed > 0:
+                    scheduled_at = started + (entry['t'] - first_t) / speed
+                    delay = scheduled_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                executor.submit(run, index, entry, scheduled_at)
+    elapsed = time.perf_counter() - started
+
+    errors = sum(count for status, count in statuses.items() if status != 200)
+    print("\n--- 結果 ---")
+    print(f"完成 {len(service_ms)} 個請求，耗時 {elapsed:.2f} s，吞吐量 {len(service_ms) / elapsed:.1f} req/s")
+    print(f"狀態: {statuses}  (錯誤 {errors})")
+    for label, values in (('處理耗時', service_ms), ('含排隊耗時', total_ms)):
+        print(f"{label} (ms): p50={percentile(values, 50):.1f}  p95={percentile(values, 95):.1f}  "
+              f"p99={percentile(values, 99):.1f}  max={max(values):.1f}")
+
+    # 新執行個體的第一個請求 (未預熱時包含建立客戶端與連線的時間) 與之後的請求
+    first_batch = [by_index[index] for index in range(min(args.concurrency, len(entries))) if index in by_index]
+    later = [value for index, value in by_index.items() if index >= args.concurrency]
+    if first_batch:
+        print(f"第一個請求 ({'已預熱' if warmup_ms is not None else '冷啟動'}) (ms): {by_index.get(0, 0):.1f}  "
+              f"前 {len(first_batch)} 個 p50={percentile(first_batch, 50):.1f}  "
+              f"之後 p50={percentile(later, 50):.1f}")
+
+    original = [entry['latency_ms'] for entry in entries if entry.get('latency_ms') is not None]
+    if original and any(original):
+        print(f"錄製時處理耗時 (ms): p50={percentile(original, 50):.1f}  p95={percentile(original, 95):.1f}")
+
+    if receiver is not None:
+        # 送出時間窗內尚未發送的進度通知，讓訊息數完整計入
+        with contextlib.redirect_stdout(output):
+            receiver.progress.flush(force=True)
+        http = receiver.requests
+        print(f"假服務呼叫: 下載 {http.calls['download']} 次、訊息 {http.calls['message']} 次 "
+              f"(每個請求 {http.calls['message'] / len(entries):.2f} 則)、上傳 {receiver.storage.Client.uploads} 次")
+        # 各階段耗時 (排隊、處理器看到的下載 / 上傳耗時、預先下載)
+        for prefix in ('scheduler.', 'file.stage.', 'prefetch.', 'admission.', 'dependency.', 'deadline.', 'warmup.'):
+            snapshot = receiver.metrics.snapshot(prefix)
+            for name, stats in sorted(snapshot['observations'].items()):
+                unit = '%' if name.endswith('_pct') else ' ms'
+                print(f"{name}: 平均 {stats['avg']:.1f}{unit}  最大 {stats['max']:.1f}{unit}  ({stats['count']} 個)")
+            if snapshot['counters']:
+                print('  '.join(f"{name}={value}" for name, value in sorted(snapshot['counters'].items())))
+    return 1 if errors else 0
+
+
+def synth(args):
+    """產生合成的突發流量記錄檔 (格式與錄製模式相同)"""
+    rng = random.Random(args.seed)
+    recorder = WebhookRecorder(args.output, salt='synth')
+    users = [f"U{index:032x}" for index in range(args.users)]
+    t = 1_700_000_000.0
+
+    for index in range(args.events):
+        # 第一位用戶佔大部分流量 (模擬一次丟進大量照片)，其餘用戶零星傳檔
+        if rng.random() < args.heavy_share:
+            user_id = users[0]
+            message = {'type': 'image', 'id': f"{100000 + index}"}
+            t += rng.expovariate(args.rate * 4)
+        else:
+            user_id = rng.choice(users[1:] or users)
+            file_name = rng.choice(['invoice.pdf', 'receipt.jpg', 'report.xlsx', 'notes.txt'])
+            message = {'type': 'file', 'id': f"{100000 + index}", 'fileName': file_name,
+                       'fileSize': rng.randint(10_000, 2_000_000)}
+            t += rng.expovariate(args.rate)
+
+        body = json.dumps({
+            'destination': 'Ubot',
+            'events': [{
+                'type': 'message',
+                'replyToken': f"r{index:08d}",
+                'source': {'type': 'user', 'userId': user_id},
+                'timestamp': int(t * 1000),
+                'message': message,
+            }]
+        }).encode('utf-8')
+        recorder.record(t, {'Content-Type': 'application/json', 'User-Agent': 'LineBotWebhook/2.0'},
+                        body, 200, 0.0)
+    recorder.close()
+    print(f"✅ 已產生 {args.events} 個事件 ({args.users} 位用戶): {args.output}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook 重播工具')
+    subparsers = parser.add_subparsers(dest='command')
+
+    replay_parser = subparsers.add_parser('replay', help='重播記錄檔')
+    replay_parser.add_argument('capture', help='記錄檔路徑 (WEBHOOK_CAPTURE_PATH)')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='重播速度倍率，0 表示全速 (預設 1)')
+    replay_parser.add_argument('--concurrency', type=int, default=8, help='同時處理的請求數 (預設 8)')
+    replay_parser.add_argument('--limit', type=int, default=0, help='只重播前 N 個請求')
+    replay_parser.add_argument('--url', help='送往實際 HTTP 端點而非本地接收器')
+    replay_parser.add_argument('--content-size', type=int, default=200 * 1024, help='假下載內容大小 (bytes)')
+    replay_parser.add_argument('--download-latency', type=float, default=50, help='假下載延遲 (ms)')
+    replay_parser.add_argument('--message-latency', type=float, default=20, help='假回覆延遲 (ms)')
+    replay_parser.add_argument('--upload-latency', type=float, default=30, help='假上傳延遲 (ms)')
+    replay_parser.add_argument('--connect-latency', type=float, default=80,
+                               help='第一次連線的假延遲 (ms，DNS / TLS / 存取權杖，每個主機與 GCS 客戶端各一次)')
+    replay_parser.add_argument('--warm-up', action='store_true', help='重播前先呼叫 GET /warmup (比較冷啟動與預熱後的延遲)')
+    replay_parser.add_argument('--auto-reply', action='store_true', help='啟用自動回覆 (包含回覆 / push 的耗時)')
+    replay_parser.add_argument('--no-prefetch', action='store_true', help='停用預先下載 (比較各階段耗時)')
+    replay_parser.add_argument('--verbose', action='store_true', help='顯示接收器輸出')
+
+    synth_parser = subparsers.add_parser('synth', help='產生合成的突發流量記錄檔')
+    synth_parser.add_argument('output', help='輸出路徑 (.gz 結尾時壓縮)')
+    synth_parser.add_argument('--events', type=int, default=300)
+    synth_parser.add_argument('--users', type=int, default=5)
+    synth_parser.add_argument('--rate', type=float, default=20, help='平均每秒事件數')
+    synth_parser.add_argument('--heavy-share', type=float, default=0.7, help='大量傳圖用戶的流量比例')
+    synth_parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+    if args.command == 'replay':
+        return replay(args)
+    if args.command == 'synth':
+        return synth(args)
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -47,6 +47,11 @@ deploy_function() {
         exit 1
     fi
     
+    # 複製共用模組到函式目錄 (Cloud Function 只會上傳 --source 目錄)
+    rm -rf webhook_receiver/config
+    cp -r config webhook_receiver/config
+    trap 'rm -rf webhook_receiver/config' EXIT
+    
     gcloud functions deploy $FUNCTION_NAME \
         --runtime python311 \
         --trigger-http \
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+物件命名 (日期分區) 管理工具
+列出某一天的物件、產生分區 manifest，並將舊格式 (flat) 的物件遷移到日期分區格式。
+
+用法:
+  python scripts/object_layout.py list --bucket BUCKET --category line-images --date 2024-06-01
+  python scripts/object_layout.py manifest --bucket BUCKET --category results --date 2024-06-01 [--days 7]
+  python scripts/object_layout.py migrate --bucket BUCKET                       # 只列出遷移計畫
+  python scripts/object_layout.py migrate --bucket BUCKET --apply [--delete-source] [--manifest]
+
+遷移規則:
+  line-{類型}/{檔名}                    -> line-{類型}/yyyy/mm/dd/分片/{MD5}[-{租戶}]_{檔名} (日期取自建立時間)
+  {時間}_{原始檔路徑}[.p1_t1].json/.csv   -> results/yyyy/mm/dd/分片/{雜湊}[-{租戶}]_{檔名}[.p1_t1].json/.csv
+  處理結果的雜湊與租戶標籤取自原始檔 (以 --source-bucket 查詢原始檔)；查不到時以舊名稱的雜湊代替，
+  同一份文件的 JSON / CSV 仍會得到相同的名稱。租戶標籤取自物件 metadata 的 line_tenant_id，沒有時省略。
+"""
+
+import os
+import re
+import sys
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+
+# 添加專案根目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from google.api_core.exceptions import PreconditionFailed
+from google.cloud import storage
+
+from config.object_layout import (
+    RESULTS_CATEGORY, list_partition, md5_hex, object_name, parse_object_name, tenant_label, write_manifest
+)
+
+# 舊格式的處理結果: {時間}_{原始檔路徑}{表格後綴}.{副檔名}
+_LEGACY_RESULT = re.compile(
+    r'^(?P<timestamp>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})_(?P<source>.+?)'
+    r'(?P<suffix>\.p\d+_t\d+)?\.(?P<extension>json|csv|docpb)$'
+)
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def blob_tenant(blob):
+    """物件 metadata 記錄的租戶標籤 (沒有時回傳 None)"""
+    return tenant_label((blob.metadata or {}).get('line_tenant_id'))
+
+
+def plan_migration(blob, source_info=None):
+    """
+    計算舊格式物件的新名稱
+
+    Args:
+        blob: Cloud Storage Blob
+        source_info: 原始檔名稱 -> (MD5 (hex), 租戶標籤) 的查詢函式 (處理結果用)
+
+    Returns:
+        新名稱；已是新格式或無法辨識時回傳 None
+    """
+    name = blob.name
+    if parse_object_name(name) or name.endswith('_manifest.jsonl'):
+        return None
+
+    match = _LEGACY_RESULT.match(name)
+    if match:
+        source = match['source']
+        source_md5, tenant = (source_info(source) if source_info else None) or (None, None)
+        content_hash = source_md5 or hashlib.sha256(f"{match['timestamp']}_{source}".encode('utf-8')).hexdigest()
+        when = datetime.strptime(match['timestamp'], '%Y-%m-%d_%H-%M-%S')
+        base = object_name(RESULTS_CATEGORY, os.path.basename(source), content_hash, when, tenant=tenant)
+        return f"{base}{match['suffix'] or ''}.{match['extension']}"
+
+    parts = name.split('/')
+    if len(parts) == 2 and parts[0].startswith('line-') and parts[1]:
+        content_hash = md5_hex(blob.md5_hash)
+        if not content_hash:
+            # 組合物件 (composite) 沒有 MD5
+            print(f"⚠️ 沒有 MD5，略過: {name}")
+            return None
+        return object_name(parts[0], parts[1], content_hash, blob.time_created, tenant=blob_tenant(blob))
+    return None
+
+
+def make_source_lookup(client, bucket_name):
+    """建立原始檔 (MD5, 租戶標籤) 查詢函式 (查詢結果快取)"""
+    if not bucket_name:
+        return None
+    bucket = client.bucket(bucket_name)
+    cache = {}
+
+    def lookup(source):
+        if source not in cache:
+            blob = bucket.get_blob(source)
+            cache[source] = (md5_hex(blob.md5_hash), blob_tenant(blob)) if blob else None
+        return cache[source]
+    return lookup
+
+
+def migrate(client, args):
+    """遷移舊格式物件"""
+    bucket = client.bucket(args.bucket)
+    source_info = make_source_lookup(client, args.source_bucket)
+    planned = 0
+    copied = 0
+    partitions = set()
+
+    for blob in client.list_blobs(args.bucket, prefix=args.prefix or None):
+        new_name = plan_migration(blob, source_info)
+        if not new_name:
+            continue
+        planned += 1
+        print(f"{blob.name} -> {new_name}")
+        if not args.apply:
+            continue
+        try:
+            # 目標已存在時不覆蓋 (重複執行遷移是安全的)
+            bucket.copy_blob(blob, bucket, new_name, if_generation_match=0)
+            copied += 1
+        except PreconditionFailed:
+            print(f"   目標已存在，略過複製: {new_name}")
+        except Exception as e:
+            print(f"❌ 複製失敗: {blob.name}: {e}")
+            continue
+        key = parse_object_name(new_name)
+        partitions.add((key.category, key.day))
+        if args.delete_source:
+            blob.delete()
+
+    print(f"\n{'已遷移' if args.apply else '待遷移'} {copied if args.apply else planned} 個物件")
+    if args.apply and args.manifest:
+        for category, day in sorted(partitions):
+            count = write_manifest(bucket, category, day)
+            print(f"📋 manifest: {category}/{day:%Y/%m/%d}/ ({count} 個物件)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='物件命名 (日期分區) 管理工具')
+    subparsers = parser.add_subparsers(dest='command')
+
+    list_parser = subparsers.add_parser('list', help='列出某一天的物件 (有 manifest 時只讀取 manifest)')
+    list_parser.add_argument('--bucket', required=True)
+    list_parser.add_argument('--category', required=True, help='例如 line-images、line-documents、results')
+    list_parser.add_argument('--date', required=True, type=parse_date)
+    list_parser.add_argument('--no-manifest', action='store_true', help='忽略 manifest，直接列出前綴')
+
+    manifest_parser = subparsers.add_parser('manifest', help='產生分區 manifest')
+    manifest_parser.add_argument('--bucket', required=True)
+    manifest_parser.add_argument('--category', required=True)
+    manifest_parser.add_argument('--date', type=parse_date, help='預設為昨天')
+    manifest_parser.add_argument('--days', type=int, default=1, help='從 --date 往前產生的天數')
+
+    migrate_parser = subparsers.add_parser('migrate', help='將舊格式物件遷移到日期分區')
+    migrate_parser.add_argument('--bucket', required=True)
+    migrate_parser.add_argument('--prefix', help='只處理此前綴下的物件')
+    migrate_parser.add_argument('--source-bucket', help='原始檔所在的 bucket (處理結果以原始檔 MD5 命名)')
+    migrate_parser.add_argument('--apply', action='store_true', help='實際複製 (預設只列出計畫)')
+    migrate_parser.add_argument('--delete-source', action='store_true', help='複製後刪除舊物件')
+    migrate_parser.add_argument('--manifest', action='store_true', help='遷移後產生受影響分區的 manifest')
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    client = storage.Client()
+
+    if args.command == 'list':
+        entries = list_partition(client.bucket(args.bucket), args.category, args.date,
+                                 use_manifest=not args.no_manifest)
+        for entry in entries:
+            print(f"{entry['name']}  {entry['size']} bytes")
+        print(f"\n共 {len(entries)} 個物件")
+    elif args.command == 'manifest':
+        day = args.date or (datetime.now() - timedelta(days=1)).date()
+        bucket = client.bucket(args.bucket)
+        for offset in range(args.days):
+            current = day - timedelta(days=offset)
+            count = write_manifest(bucket, args.category, current)
+            print(f"📋 manifest: {args.category}/{current:%Y/%m/%d}/ ({count} 個物件)")
+    elif args.command == 'migrate':
+        return migrate(client, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+效能分析彙整工具
+讀取 config/profiling.py 寫出的分析結果 (本地目錄或 gs://bucket/prefix)，彙整多個取樣中最耗時的函式、
+呼叫堆疊與記憶體配置位置，並可依中繼資料 (例如副檔名、路由) 篩選與分組。
+
+用法:
+  python scripts/profile_report.py [來源] [--kind webhook|document] [--since 2024-06-01]
+  python scripts/profile_report.py /tmp/profiles --kind webhook --where extension=.pdf --top 30
+  python scripts/profile_report.py gs://my-bucket/profiles --kind document --group-by route --sort cumtime
+"""
+
+import os
+import sys
+import json
+import glob
+import marshal
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+
+# 添加專案根目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from config.profiling import default_output
+
+DATA_SUFFIXES = ('.prof', '.stacks')
+
+
+def download_profiles(source, kind, since):
+    """將 gs://bucket/prefix 下的分析結果下載到暫存目錄 (依進入點與日期篩選，減少下載量)"""
+    from google.cloud import storage
+
+    bucket_name, _, prefix = source[5:].partition('/')
+    prefix = f"{prefix.strip('/')}/" if prefix.strip('/') else ''
+    target = tempfile.mkdtemp(prefix='profiles_')
+    bucket = storage.Client().bucket(bucket_name)
+    for blob in bucket.list_blobs(prefix=f"{prefix}{kind}/" if kind else prefix):
+        relative = blob.name[len(prefix):]
+        parts = relative.split('/')
+        if len(parts) != 3 or (since and parts[1] < since):
+            continue
+        path = os.path.join(target, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob.download_to_filename(path)
+    return target
+
+
+def matches(meta, where):
+    """中繼資料是否符合所有 key=value 條件 (值為清單時包含即可)"""
+    fields = {**meta.get('metadata', {}), 'trigger': meta.get('trigger'), 'engine': meta.get('engine')}
+    for key, expected in where:
+        value = fields.get(key)
+        values = value if isinstance(value, list) else [value]
+        if expected not in [str(item) for item in values]:
+            return False
+    return True
+
+
+def load_samples(directory, kind, since, where):
+    """
+    讀取符合條件的取樣
+
+    Returns:
+        [(資料檔路徑, 中繼資料)]
+    """
+    samples = []
+    for meta_path in sorted(glob.glob(os.path.join(directory, kind or '*', '*', '*.json'))):
+        day = os.path.basename(os.path.dirname(meta_path))
+        if since and day < since:
+            continue
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if not matches(meta, where):
+            continue
+        base = meta_path[:-len('.json')]
+        data_path = next((f"{base}{suffix}" for suffix in DATA_SUFFIXES if os.path.exists(f"{base}{suffix}")), None)
+        if data_path:
+            samples.append((data_path, meta))
+    return samples
+
+
+def percentile(values, ratio):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))] if ordered else 0
+
+
+def print_summary(samples, group_by):
+    """取樣數與耗時分布 (可依中繼資料欄位分組)"""
+    durations = [meta['duration_ms'] for _, meta in samples]
+    triggers = Counter(meta['trigger'] for _, meta in samples)
+    print(f"取樣 {len(samples)} 筆 ({', '.join(f'{name} {count}' for name, count in triggers.most_common())})，"
+          f"耗時 p50 {percentile(durations, 0.5):.0f} ms / p95 {percentile(durations, 0.95):.0f} ms / "
+          f"最大 {max(durations):.0f} ms")
+    if not group_by:
+        return
+    groups = defaultdict(list)
+    for _, meta in samples:
+        value = meta.get('metadata', {}).get(group_by, '-')
+        for item in value if isinstance(value, list) else [value]:
+            groups[str(item)].append(meta['duration_ms'])
+    print(f"\n{group_by:<20} {'取樣':>6} {'p50 ms':>10} {'p95 ms':>10} {'最大 ms':>10}")
+    for name, values in sorted(groups.items(), key=lambda item: -percentile(item[1], 0.95)):
+        print(f"{name:<20} {len(values):>6} {percentile(values, 0.5):>10.0f} "
+              f"{percentile(values, 0.95):>10.0f} {max(values):>10.0f}")
+
+
+def report_cprofile(paths, total_ms, top, sort):
+    """合併 cProfile 結果，列出最耗時的函式"""
+    merged = {}
+    presence = Counter()
+    for path in paths:
+        with open(path, 'rb') as f:
+            stats = marshal.load(f)
+        for func, (primitive, calls, tottime, cumtime, _) in stats.items():
+            previous = merged.get(func, (0, 0, 0.0, 0.0))
+            merged[func] = (previous[0] + primitive, previous[1] + calls,
+                            previous[2] + tottime, previous[3] + cumtime)
+            presence[func] += 1
+
+    column = 2 if sort == 'tottime' else 3
+    rows = sorted(merged.items(), key=lambda item: item[1][column], reverse=True)[:top]
+    print(f"\n最耗時的函式 (cProfile，{len(paths)} 筆取樣，依 {sort} 排序；佔比以取樣總耗時計算)")
+    print(f"{'呼叫次數':>10} {'自身秒數':>9} {'累計秒數':>9} {'佔比':>6} {'出現':>5}  函式")
+    for (filename, line, name), (_, calls, tottime, cumtime) in rows:
+        share = (tottime if sort == 'tottime' else cumtime) * 1000 / total_ms * 100 if total_ms else 0
+        location = f"{os.path.basename(filename)}:{line}({name})" if line else name
+        print(f"{calls:>10} {tottime:>9.3f} {cumtime:>9.3f} {share:>5.1f}% {presence[(filename, line, name)]:>5}  {location}")
+
+
+def report_stacks(paths, top, flamegraph):
+    """合併堆疊取樣，列出自身與包含子呼叫的取樣數最多的函式"""
+    stacks = Counter()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] += int(count)
+
+    own = Counter()
+    inclusive = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    total = sum(stacks.values()) or 1
+
+    print(f"\n取樣最多的函式 (堆疊取樣，{len(paths)} 筆取樣，共 {total} 個樣本)")
+    print(f"{'自身':>8} {'自身%':>7} {'包含':>8} {'包含%':>7}  函式")
+    for frame, count in own.most_common(top):
+        print(f"{count:>8} {count / total * 100:>6.1f}% {inclusive[frame]:>8} {inclusive[frame] / total * 100:>6.1f}%  {frame}")
+
+    if flamegraph:
+        with open(flamegraph, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"\n合併的 collapsed stack 已寫入 {flamegraph} (可用 flamegraph.pl 或 speedscope 開啟)")
+
+
+def report_allocations(samples, top):
+    """合併 tracemalloc 結果，列出配置最多的程式位置"""
+    metas = [meta['tracemalloc'] for _, meta in samples if meta.get('tracemalloc')]
+    if not metas:
+        return
+    sizes = Counter()
+    counts = Counter()
+    for allocation in metas:
+        for item in allocation['top']:
+            sizes[item['where']] += item['size']
+            counts[item['where']] += item['count']
+    peaks = [allocation['peak_bytes'] for allocation in metas]
+    print(f"\n記憶體配置 (tracemalloc，{len(metas)} 筆取樣，峰值 p50 {percentile(peaks, 0.5) / 1024 / 1024:.1f} MB / "
+          f"最大 {max(peaks) / 1024 / 1024:.1f} MB；各取樣結束時仍存在的配置)")
+    print(f"{'平均 KB':>10} {'平均個數':>10}  位置")
+    for where, size in sizes.most_common(top):
+        print(f"{size / len(metas) / 1024:>10.1f} {counts[where] / len(metas):>10.0f}  {where}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='效能分析彙整工具')
+    parser.add_argument('source', nargs='?', default=default_output(), help='本地目錄或 gs://bucket/prefix')
+    parser.add_argument('--kind', choices=['webhook', 'document'], help='只彙整指定進入點')
+    parser.add_argument('--since', help='只彙整此日期 (YYYY-MM-DD) 之後的取樣')
+    parser.add_argument('--where', action='append', default=[], metavar='KEY=VALUE',
+                        help='依中繼資料篩選，例如 extension=.pdf、route=images (可重複)')
+    parser.add_argument('--group-by', help='依中繼資料欄位分組列出耗時分布，例如 extension、route')
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--sort', choices=['tottime', 'cumtime'], default='tottime')
+    parser.add_argument('--flamegraph', help='堆疊取樣: 將合併的 collapsed stack 寫入此檔案')
+    args = parser.parse_args()
+
+    where = []
+    for condition in args.where:
+        key, separator, value = condition.partition('=')
+        if not separator:
+            parser.error(f"篩選條件格式應為 KEY=VALUE: {condition}")
+        where.append((key, value))
+
+    directory = download_profiles(args.source, args.kind, args.since) if args.source.startswith('gs://') else args.source
+    samples = load_samples(directory, args.kind, args.since, where)
+    if not samples:
+        print(f"{args.source} 沒有符合條件的取樣")
+        return
+
+    print_summary(samples, args.group_by)
+    profiles = [(path, meta) for path, meta in samples if path.endswith('.prof')]
+    if profiles:
+        report_cprofile([path for path, _ in profiles], sum(meta['duration_ms'] for _, meta in profiles),
+                        args.top, args.sort)
+    stacks = [path for path, _ in samples if path.endswith('.stacks')]
+    if stacks:
+        report_stacks(stacks, args.top, args.flamegraph)
+    report_allocations(samples, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+重試帳本管理工具
+查看待重試 / 死信區的工作，並只重跑失敗的階段
+
+用法:
+  python scripts/retry_jobs.py list [--status pending|dead|done|running]
+  python scripts/retry_jobs.py replay <job_id>
+  python scripts/retry_jobs.py replay --due
+  python scripts/retry_jobs.py revive <job_id>
+"""
+
+import os
+import sys
+import argparse
+import importlib.util
+from datetime import datetime
+
+# 添加專案根目錄到 Python 路徑
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from config.retry_ledger import get_ledger
+
+# 工作類型 -> 負責重跑的函式模組
+JOB_MODULES = {
+    'line_file': 'webhook_receiver',
+    'line_image': 'webhook_receiver',
+    'document': 'document_processor',
+    'archive': 'document_processor',
+}
+
+_loaded_modules = {}
+
+
+def load_function_module(directory):
+    """載入 Cloud Function 的 main.py (兩個函式的模組名稱相同，因此以路徑載入)"""
+    if directory not in _loaded_modules:
+        function_dir = os.path.join(project_root, directory)
+        sys.path.insert(0, function_dir)
+        spec = importlib.util.spec_from_file_location(f"{directory}_main", os.path.join(function_dir, 'main.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded_modules[directory] = module
+    return _loaded_modules[directory]
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else '-'
+
+
+def list_jobs(status):
+    """列出工作"""
+    jobs = get_ledger().list_jobs(status=status)
+    if not jobs:
+        print("沒有符合條件的工作")
+        return
+    for job in jobs:
+        stages = ', '.join(job['checkpoints'].keys()) or '-'
+        print(f"[{job['status']}] {job['job_id']} ({job['kind']})")
+        print(f"    已完成階段: {stages}  失敗階段: {job['failed_stage'] or '-'}  次數: {job['attempts']}")
+        print(f"    下次重試: {format_time(job['next_attempt_at'])}  錯誤: {job['last_error'] or '-'}")
+
+
+def replay(job):
+    """重跑單一工作"""
+    print(f"🔄 重跑 {job['job_id']} (失敗階段: {job['failed_stage'] or '-'})")
+    module = load_function_module(JOB_MODULES[job['kind']])
+    try:
+        ok = module.replay_job(job)
+    except Exception as e:
+        print(f"❌ 重跑失敗: {e}")
+        return False
+    print("✅ 重跑成功" if ok else "❌ 重跑失敗")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重試帳本管理工具')
+    subparsers = parser.add_subparsers(dest='command')
+
+    list_parser = subparsers.add_parser('list', help='列出工作')
+    list_parser.add_argument('--status', choices=['pending', 'dead', 'done', 'running'])
+
+    replay_parser = subparsers.add_parser('replay', help='重跑失敗的階段')
+    replay_parser.add_argument('job_id', nargs='?')
+    replay_parser.add_argument('--due', action='store_true', help='重跑所有已到重試時間的工作')
+
+    revive_parser = subparsers.add_parser('revive', aliases=['requeue'], help='將死信區的工作重新排入待重試')
+    revive_parser.add_argument('job_id')
+
+    args = parser.parse_args()
+    ledger = get_ledger()
+
+    if args.command == 'list':
+        list_jobs(args.status)
+    elif args.command == 'replay':
+        if args.due:
+            jobs = ledger.list_jobs(due_only=True)
+        elif args.job_id:
+            job = ledger.get(args.job_id)
+            jobs = [job] if job else []
+        else:
+            replay_parser.print_help()
+            return 1
+        if not jobs:
+            print("沒有需要重跑的工作")
+            return 0
+        results = [replay(job) for job in jobs]
+        print(f"\n完成 {sum(results)}/{len(results)} 個工作")
+        return 0 if all(results) else 1
+    elif args.command in ('revive', 'requeue'):
+        job = ledger.get(args.job_id)
+        if not job:
+            print(f"找不到工作: {args.job_id}")
+            return 1
+        ledger.revive(args.job_id)
+        print(f"✅ 已重新排入: {args.job_id} (原狀態: {job['status']})")
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+下載准入控制 (依位元組數)
+LINE 檔案事件帶有 message.fileSize，下載前先依宣告大小向同一執行個體的共用預算保留位元組數，
+避免同時下載幾個大型影片就耗盡小型執行個體的記憶體與頻寬。
+
+- 預算: ADMISSION_MAX_BYTES 為同時下載中的內容總位元組數上限 (處理器與預先下載共用)；
+  單一超過上限的檔案在沒有其他下載時仍可執行
+- 等待: 預算不足時最多等待 ADMISSION_WAIT_SECONDS (不超過呼叫期限的剩餘時間)，
+  之後拋出 AdmissionDeferred，由呼叫端交給重試帳本延後處理；預先下載不等待，預算不足時直接略過
+- 串流: 宣告大小達到 ADMISSION_STREAM_BYTES 的檔案以串流逐塊寫入磁碟 (只保留一個區塊在記憶體)，
+  只保留 ADMISSION_STREAM_CHUNK_BYTES 的預算
+- 圖片大小要下載後才知道，以 ADMISSION_IMAGE_BYTES 估計
+
+指標: admission.admitted / admission.deferred / admission.streamed、admission.wait_ms (等待預算的時間)、
+admission.utilization_pct (取得預算時的使用率)；目前狀態由 get_budget().stats() 取得 (webhook 的 /metrics)。
+各設定在使用時由設定快照讀取；重新載入後 ADMISSION_MAX_BYTES 直接調整共用預算的上限。
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from config import metrics
+from config import deadline
+from config.env_manager import env_manager, get_settings
+
+MB = 1024 * 1024
+
+
+def max_bytes(settings=None) -> int:
+    """共用預算的上限 (ADMISSION_MAX_BYTES)"""
+    return (settings or get_settings()).get_int('ADMISSION_MAX_BYTES', 128 * MB)
+
+
+def stream_chunk_bytes() -> int:
+    """串流下載的區塊大小，也是串流下載保留的預算 (ADMISSION_STREAM_CHUNK_BYTES)"""
+    return get_settings().get_int('ADMISSION_STREAM_CHUNK_BYTES', MB)
+
+
+class AdmissionDeferred(RuntimeError):
+    """等待下載預算逾時 (尚未開始下載，可安全地交給重試)"""
+
+
+class ByteBudget:
+    """同時下載中的位元組數預算"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._condition = threading.Condition()
+        self._in_use = 0
+        self._peak = 0
+        self._waiting = 0
+
+    def _fits(self, byte_count: int) -> bool:
+        # 超過上限的單一請求在預算閒置時放行，不會永遠等待
+        return self._in_use + byte_count <= self.capacity or self._in_use == 0
+
+    def _take(self, byte_count: int):
+        self._in_use += byte_count
+        self._peak = max(self._peak, self._in_use)
+        metrics.observe('admission.utilization_pct', min(100.0, self._in_use * 100 / self.capacity))
+
+    def try_acquire(self, byte_count: int) -> bool:
+        """不等待地保留預算 (預先下載用)；有其他請求在等待時讓給等待中的請求"""
+        with self._condition:
+            if self._waiting or not self._fits(byte_count):
+                return False
+            self._take(byte_count)
+            return True
+
+    def acquire(self, byte_count: int, timeout: float) -> bool:
+        """保留預算，timeout 秒內預算不足時回傳 False"""
+        expires_at = time.monotonic() + timeout
+        with self._condition:
+            self._waiting += 1
+            try:
+                while not self._fits(byte_count):
+                    remaining = expires_at - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self._take(byte_count)
+                return True
+            finally:
+                self._waiting -= 1
+
+    def resize(self, capacity: int):
+        """調整上限 (設定重新載入時)；調降時已保留的預算照常歸還，之後的請求依新的上限等待"""
+        with self._condition:
+            self.capacity = capacity
+            self._condition.notify_all()
+
+    def release(self, byte_count: int):
+        """歸還預算"""
+        with self._condition:
+            self._in_use -= byte_count
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'capacity': self.capacity,
+                'in_use': self._in_use,
+                'peak': self._peak,
+                'waiting': self._waiting,
+            }
+
+
+def is_streamed(byte_count: Optional[int]) -> bool:
+    """是否以串流路徑下載 (宣告大小達到 ADMISSION_STREAM_BYTES)"""
+    return bool(byte_count) and byte_count >= get_settings().get_int('ADMISSION_STREAM_BYTES', 32 * MB)
+
+
+def reservation_bytes(byte_count: Optional[int]) -> int:
+    """
+    下載需要保留的預算
+
+    Args:
+        byte_count: LINE 宣告的檔案大小；圖片 (未知) 為 None
+
+    Returns:
+        位元組數 (串流下載只保留一個區塊)
+    """
+    if byte_count is None:
+        return get_settings().get_int('ADMISSION_IMAGE_BYTES', 2 * MB)
+    if is_streamed(byte_count):
+        return stream_chunk_bytes()
+    return byte_count
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_budget() -> Optional[ByteBudget]:
+    """取得共用的下載預算 (ADMISSION_ENABLED=false 時回傳 None)"""
+    global _budget
+    if not get_settings().get_bool('ADMISSION_ENABLED', True):
+        return None
+    with _budget_lock:
+        if _budget is None:
+            _budget = ByteBudget(max_bytes())
+        return _budget
+
+
+def _on_settings_reload(settings):
+    """設定重新載入時調整共用預算的上限"""
+    with _budget_lock:
+        budget = _budget
+    if budget is not None and budget.capacity != max_bytes(settings):
+        budget.resize(max_bytes(settings))
+
+
+env_manager.on_reload(_on_settings_reload)
+
+
+@contextmanager
+def admit(byte_count: Optional[int]):
+    """
+    保留下載預算後執行下載
+
+    Args:
+        byte_count: LINE 宣告的檔案大小；圖片 (未知) 為 None
+
+    Raises:
+        AdmissionDeferred: 等待預算逾時
+    """
+    budget = get_budget()
+    if budget is None:
+        yield
+        return
+
+    reserved = reservation_bytes(byte_count)
+    if is_streamed(byte_count):
+        metrics.increment('admission.streamed')
+    started = time.perf_counter()
+    # 等待時間不超過呼叫期限的剩餘時間
+    timeout = min(get_settings().get_float('ADMISSION_WAIT_SECONDS', 5), deadline.current().remaining())
+    admitted = budget.acquire(reserved, timeout)
+    metrics.observe('admission.wait_ms', (time.perf_counter() - started) * 1000)
+    if not admitted:
+        metrics.increment('admission.deferred')
+        raise AdmissionDeferred(f"下載預算不足 (需要 {reserved} bytes，已使用 {budget.stats()['in_use']} bytes)")
+    metrics.increment('admission.admitted')
+    try:
+        yield
+    finally:
+        budget.release(reserved)
@@ -0,0 +1,341 @@
+"""
+圖片感知雜湊 (近似重複偵測)
+LINE 會重新壓縮圖片，同一張收據在不同聊天室間轉傳時內容位元組不同，MD5 無法判斷為重複。
+下載完成後以縮小的灰階圖計算 64 位元感知雜湊 (pHash: 32x32 DCT 的低頻 8x8；dHash: 9x8 相鄰像素差)，
+在記憶體索引中以漢明距離搜尋，距離不超過 IMAGE_DEDUP_MAX_DISTANCE 時視為近似重複；
+距離不超過 IMAGE_DEDUP_REUSE_MAX_DISTANCE 時，上傳時在 metadata 記錄先前的物件 (line_duplicate_of)，
+由文件處理器沿用先前的 Document AI 結果。
+
+索引依租戶分區 (每筆記錄所屬租戶)，只在同一租戶的圖片中搜尋，其他租戶的結果不會被沿用；
+未知來源 (anonymous) 的圖片不比對也不加入索引。
+每個分區為 NumPy uint64 陣列 (每張圖片 8 bytes) 與物件名稱列表，搜尋為整個陣列的 XOR 與位元計數。
+設定 IMAGE_HASH_INDEX_PATH (本地路徑或 gs://bucket/name) 時於啟動時載入，每新增 IMAGE_HASH_SAVE_EVERY 筆寫回一次；
+多個執行個體同時寫回時以最後寫入者為準 (遺失的項目只會少偵測到重複，不影響正確性)。
+其他設定在每次使用時由設定快照讀取，重新載入後即生效。
+
+需要 Pillow (解碼與縮圖) 與 NumPy。
+"""
+
+import io
+import os
+import time
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from config import metrics
+from config.fair_scheduler import ANONYMOUS_TENANT
+from config.env_manager import get_settings
+
+# pHash 縮圖邊長與取用的低頻係數邊長
+PHASH_SIZE = 32
+PHASH_LOW_FREQUENCY = 8
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("圖片感知雜湊需要 numpy，請執行 pip install numpy")
+    return numpy
+
+
+def load_grayscale(source, size):
+    """
+    解碼圖片並縮小為灰階陣列
+
+    Args:
+        source: 檔案路徑或圖片 bytes
+        size: (寬, 高)
+
+    Returns:
+        float32 陣列 (高 x 寬)
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError("圖片感知雜湊需要 Pillow，請執行 pip install Pillow")
+    np = _numpy()
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        # JPEG 直接以縮小的比例解碼 (只解碼需要的 DCT 係數)，大圖不必完整解碼
+        image.draft('L', (size[0] * 4, size[1] * 4))
+        gray = image.convert('L').resize(size, Image.BILINEAR)
+        return np.asarray(gray, dtype=np.float32)
+
+
+_dct_matrix = None
+
+
+def _dct(np):
+    """PHASH_SIZE 點的 DCT-II 矩陣 (只計算一次)"""
+    global _dct_matrix
+    if _dct_matrix is None:
+        n = np.arange(PHASH_SIZE)
+        _dct_matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * PHASH_SIZE)).astype(np.float32)
+    return _dct_matrix
+
+
+def _pack_bits(np, bits):
+    """將 (..., 64) 的布林陣列轉為 uint64"""
+    return np.packbits(bits, axis=-1).view('>u8')[..., 0].astype(np.uint64)
+
+
+def phash_pixels(pixels):
+    """
+    由 32x32 灰階陣列計算 pHash (可一次傳入 (N, 32, 32) 批次計算)
+
+    Returns:
+        uint64 (批次時為 uint64 陣列)
+    """
+    np = _numpy()
+    matrix = _dct(np)
+    coefficients = matrix @ pixels @ matrix.T
+    low = coefficients[..., :PHASH_LOW_FREQUENCY, :PHASH_LOW_FREQUENCY].reshape(*pixels.shape[:-2], -1)
+    # 直流分量 (平均亮度) 不參與中位數
+    median = np.median(low[..., 1:], axis=-1, keepdims=True)
+    return _pack_bits(np, low > median)
+
+
+def dhash_pixels(pixels):
+    """由 8x9 (高 x 寬) 灰階陣列計算 dHash (可批次)"""
+    np = _numpy()
+    return _pack_bits(np, (pixels[..., 1:] > pixels[..., :-1]).reshape(*pixels.shape[:-2], -1))
+
+
+def dedup_enabled() -> bool:
+    """是否啟用近似重複偵測 (IMAGE_DEDUP_ENABLED)"""
+    return get_settings().get_bool('IMAGE_DEDUP_ENABLED')
+
+
+def index_path() -> Optional[str]:
+    """索引的保存位置 (IMAGE_HASH_INDEX_PATH，未設定時只在記憶體)"""
+    return get_settings().get('IMAGE_HASH_INDEX_PATH') or None
+
+
+def image_hash(source, algorithm: Optional[str] = None) -> int:
+    """
+    計算圖片的 64 位元感知雜湊
+
+    Args:
+        source: 檔案路徑或圖片 bytes
+        algorithm: phash 或 dhash (預設依 IMAGE_HASH_ALGORITHM)
+    """
+    algorithm = algorithm or get_settings().get('IMAGE_HASH_ALGORITHM', 'phash')
+    if algorithm == 'dhash':
+        return int(dhash_pixels(load_grayscale(source, (9, 8))))
+    return int(phash_pixels(load_grayscale(source, (PHASH_SIZE, PHASH_SIZE))))
+
+
+def _popcount(np, values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    # NumPy 2.0 以前: 以位元組查表
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+class Match(NamedTuple):
+    """最接近的已知圖片"""
+    name: str
+    distance: int
+    tenant: str
+
+
+class _Partition:
+    """單一租戶的雜湊陣列與物件名稱"""
+
+    def __init__(self, np, hashes=None, names=None):
+        self.hashes = np.empty(max(len(names or ()), 1024), dtype=np.uint64)
+        self.names: List[str] = list(names or ())
+        if hashes is not None:
+            self.hashes[:len(hashes)] = hashes
+
+
+class ImageHashIndex:
+    """感知雜湊索引 (漢明距離搜尋)；依租戶分區，只在同一租戶的圖片中搜尋"""
+
+    def __init__(self):
+        np = _numpy()
+        self._np = np
+        self._lock = threading.Lock()
+        self._partitions: Dict[str, _Partition] = {}
+        self._unsaved = 0
+
+    def __len__(self):
+        return sum(len(partition.names) for partition in self._partitions.values())
+
+    def add(self, hash_value: int, name: str, tenant: str):
+        """新增一筆 (陣列容量不足時加倍)"""
+        np = self._np
+        with self._lock:
+            partition = self._partitions.get(tenant)
+            if partition is None:
+                partition = self._partitions[tenant] = _Partition(np)
+            count = len(partition.names)
+            if count == len(partition.hashes):
+                grown = np.empty(count * 2, dtype=np.uint64)
+                grown[:count] = partition.hashes
+                partition.hashes = grown
+            partition.hashes[count] = hash_value
+            partition.names.append(name)
+            self._unsaved += 1
+
+    def nearest(self, hash_value: int, tenant: str, max_distance: Optional[int] = None) -> Optional[Match]:
+        """
+        在同一租戶的圖片中搜尋漢明距離最小者 (不會比對其他租戶的圖片)
+
+        Returns:
+            距離不超過 max_distance (預設依 IMAGE_DEDUP_MAX_DISTANCE) 時回傳 Match，否則回傳 None
+        """
+        if max_distance is None:
+            max_distance = get_settings().get_int('IMAGE_DEDUP_MAX_DISTANCE', 6)
+        np = self._np
+        with self._lock:
+            partition = self._partitions.get(tenant)
+            count = len(partition.names) if partition else 0
+            if not count:
+                return None
+            distances = _popcount(np, partition.hashes[:count] ^ np.uint64(hash_value))
+            index = int(distances.argmin())
+            distance = int(distances[index])
+            name = partition.names[index]
+        return Match(name, distance, tenant) if distance <= max_distance else None
+
+    def to_bytes(self) -> bytes:
+        """序列化 (NumPy .npz: 雜湊陣列、以換行分隔的 UTF-8 名稱與每筆的租戶)"""
+        np = self._np
+        with self._lock:
+            hashes = [partition.hashes[:len(partition.names)] for partition in self._partitions.values()]
+            names = [name for partition in self._partitions.values() for name in partition.names]
+            tenants = [tenant for tenant, partition in self._partitions.items() for _ in partition.names]
+            hashes = np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64)
+        buffer = io.BytesIO()
+        np.savez(buffer, hashes=hashes,
+                 names=np.frombuffer('\n'.join(names).encode('utf-8'), dtype=np.uint8),
+                 tenants=np.frombuffer('\n'.join(tenants).encode('utf-8'), dtype=np.uint8))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ImageHashIndex':
+        """還原索引；沒有租戶欄位的舊格式無法判斷所屬租戶，全部捨棄"""
+        index = cls()
+        np = index._np
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            if 'tenants' not in archive.files:
+                print("⚠️ 感知雜湊索引沒有租戶資訊 (舊格式)，捨棄後重新建立")
+                return index
+            hashes = archive['hashes']
+            names = archive['names'].tobytes().decode('utf-8')
+            tenants = archive['tenants'].tobytes().decode('utf-8')
+        names = names.split('\n') if names else []
+        tenants = tenants.split('\n') if tenants else []
+        grouped = {}
+        for position, tenant in enumerate(tenants):
+            grouped.setdefault(tenant, []).append(position)
+        for tenant, positions in grouped.items():
+            index._partitions[tenant] = _Partition(np, hashes[positions], [names[position] for position in positions])
+        return index
+
+    def save(self, path: str):
+        """寫入本地檔案或 gs://bucket/name"""
+        data = self.to_bytes()
+        if path.startswith('gs://'):
+            from google.cloud import storage
+            bucket_name, _, blob_name = path[len('gs://'):].partition('/')
+            storage.Client().bucket(bucket_name).blob(blob_name).upload_from_string(
+                data, content_type='application/octet-stream')
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+        self._unsaved = 0
+
+    @classmethod
+    def load(cls, path: str) -> 'ImageHashIndex':
+        """由本地檔案或 gs://bucket/name 載入，不存在時回傳空索引"""
+        if path.startswith('gs://'):
+            from google.cloud import storage
+            bucket_name, _, blob_name = path[len('gs://'):].partition('/')
+            blob = storage.Client().bucket(bucket_name).blob(blob_name)
+            return cls.from_bytes(blob.download_as_bytes()) if blob.exists() else cls()
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def save_if_due(self, path: Optional[str], every: Optional[int] = None):
+        """累積 every 筆 (預設依 IMAGE_HASH_SAVE_EVERY) 新項目後寫回"""
+        if every is None:
+            every = get_settings().get_int('IMAGE_HASH_SAVE_EVERY', 20)
+        if path and self._unsaved >= every:
+            self.save(path)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_image_index() -> Optional[ImageHashIndex]:
+    """取得共用的感知雜湊索引 (IMAGE_DEDUP_ENABLED=false 時回傳 None)"""
+    global _index
+    if not dedup_enabled():
+        return None
+    with _index_lock:
+        if _index is None:
+            path = index_path()
+            _index = ImageHashIndex.load(path) if path else ImageHashIndex()
+            print(f"🖼️ 感知雜湊索引已載入: {len(_index)} 筆")
+        return _index
+
+
+def warm_up() -> Optional[dict]:
+    """預熱: 載入 NumPy / Pillow、建立 DCT 矩陣並載入索引 (IMAGE_DEDUP_ENABLED=false 時不做任何事)"""
+    if not dedup_enabled():
+        return {'skipped': '未啟用'}
+    from PIL import Image  # noqa: F401
+    _dct(_numpy())
+    return {'indexed': len(get_image_index())}
+
+
+def find_duplicate(file_path: str, tenant: Optional[str]):
+    """
+    計算圖片的感知雜湊並在同一租戶的圖片中搜尋近似重複
+
+    Args:
+        file_path: 圖片路徑
+        tenant: 租戶 ID；未知來源時不比對
+
+    Returns:
+        (雜湊 hex, Match 或 None)；未啟用或未知來源時回傳 (None, None)
+    """
+    index = get_image_index()
+    if index is None or not tenant or tenant == ANONYMOUS_TENANT:
+        return None, None
+    started = time.perf_counter()
+    hash_value = image_hash(file_path)
+    hashed = time.perf_counter()
+    match = index.nearest(hash_value, tenant)
+    metrics.observe('dedup.hash_ms', (hashed - started) * 1000)
+    metrics.observe('dedup.lookup_ms', (time.perf_counter() - hashed) * 1000)
+    metrics.increment('dedup.duplicate' if match else 'dedup.unique')
+    return f"{hash_value:016x}", match
+
+
+def is_reusable(match: Optional[Match], tenant: Optional[str]) -> bool:
+    """
+    近似重複的原圖結果是否可以沿用 (同一租戶且距離不超過 IMAGE_DEDUP_REUSE_MAX_DISTANCE)
+
+    距離上限預設為 0 (雜湊完全相同)；超過時只記錄為近似重複，照常處理。
+    """
+    max_distance = get_settings().get_int('IMAGE_DEDUP_REUSE_MAX_DISTANCE', 0)
+    return bool(match) and match.tenant == tenant and match.distance <= max_distance
+
+
+def register_image(hash_hex: str, name: str, tenant: Optional[str]):
+    """將已上傳的圖片加入租戶的索引 (定期寫回 IMAGE_HASH_INDEX_PATH)；沿用原圖結果的圖片不需加入，由原圖代表"""
+    index = get_image_index()
+    if index is None or not hash_hex or not tenant or tenant == ANONYMOUS_TENANT:
+        return
+    index.add(int(hash_hex, 16), name, tenant)
+    try:
+        index.save_if_due(index_path())
+    except Exception as e:
+        print(f"⚠️ 感知雜湊索引寫回失敗: {e}")
@@ -1,49 +1,49 @@
 import os
+import sys
 import requests
 import json
+import time
 import logging
 from datetime import datetime, timedelta
 from flask import Flask, request, abort
-from dotenv import load_dotenv
 from pathlib import Path
 from linebot import LineBotApi
 from linebot.exceptions import LineBotApiError
 from google.cloud import storage
 
-# 取得專案根目錄並載入環境變數
+# 共用模組 (config/) 位於專案根目錄；部署時由部署腳本複製到函式目錄
 project_root = Path(__file__).parent.parent
-env_file = project_root / '.env.local'
-
+if str(project_root) not in sys.path:
+    sys.path.append(str(project_root))
+
+# 載入設定快照 (環境變數檔案的搜尋、載入與重新載入由 config.env_manager 負責)
+from config.env_manager import env_manager, get_settings, reload_settings_if_changed, require_settings
+from config import metrics
+from config.file_routes import resolve_route, record_route, extension_for_mime
+from config.object_layout import upload_object_name
+from config.retry_ledger import get_ledger, STATUS_DONE, STATUS_DEAD
+from config.fair_scheduler import get_scheduler, tenant_of
+from config.tenant_quota import get_quota
+from config.progress_notifier import ProgressNotifier
+from config.dependency_guard import get_dependency, dependency_states, is_degraded, DependencyUnavailable
+from config import deadline
+from config.deadline import DeadlineExceeded
+from config import profiling
+from config import warmup
+from replay_recorder import get_recorder
+from prefetch import get_prefetcher
+from admission import admit, reservation_bytes, is_streamed, get_budget, AdmissionDeferred, stream_chunk_bytes
+from image_hash import find_duplicate, register_image, is_reusable
+from image_hash import warm_up as warm_up_image_hash
+
+settings = get_settings()
 print(f"專案根目錄: {project_root}")
-print(f"環境變數檔案: {env_file}")
-print(f"檔案是否存在: {env_file.exists()}")
-
-# 載入環境變數
-if env_file.exists():
-    load_dotenv(env_file)
-    print(f"✅ 成功載入環境變數檔案: {env_file}")
-else:
-    print(f"❌ 環境變數檔案不存在: {env_file}")
-    # 嘗試載入當前目錄的 .env.local
-    current_env = Path.cwd() / '.env.local'
-    if current_env.exists():
-        load_dotenv(current_env)
-        print(f"✅ 成功載入當前目錄環境變數檔案: {current_env}")
-    else:
-        print(f"❌ 當前目錄環境變數檔案也不存在: {current_env}")
+print(f"環境變數檔案: {', '.join(settings.env_files) or '未找到，使用系統環境變數'}")
 
 app = Flask(__name__)
 
-# --- 從環境變數讀取設定 ---
-LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
-LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
-LINE_CHANNEL_ID = os.getenv('LINE_CHANNEL_ID')
-WEBHOOK_URL = os.getenv('WEBHOOK_URL')
-
-
-
-# Cloud Storage 設定
-BUCKET_NAME = os.getenv('BUCKET_NAME', 'line-document-processor-annular-welder')
+# 暫時無法處理的事件 (期限不足、下載預算不足、相依服務斷路器開啟或並行數已滿)；請求回應 503 讓 LINE 重送
+DEFERRED_ERRORS = (DeadlineExceeded, AdmissionDeferred, DependencyUnavailable)
 
 # 環境檢測
 IS_CLOUD_FUNCTION = os.getenv('FUNCTION_TARGET') is not None
@@ -51,24 +51,48 @@ ENVIRONMENT = 'cloud' if IS_CLOUD_FUNCTION else 'local'
 print(f"🌍 當前環境: {ENVIRONMENT}")
 
 # Bot 回覆設定
-AUTO_REPLY_ENABLED = os.getenv('AUTO_REPLY_ENABLED', 'False').lower() == 'true'
-print(f"🤖 自動回覆模式: {'啟用' if AUTO_REPLY_ENABLED else '停用'}")
+print(f"🤖 自動回覆模式: {'啟用' if settings.auto_reply_enabled else '停用'}")
 
-# 檢查環境變數是否正確載入
-if not LINE_CHANNEL_ACCESS_TOKEN:
+# 檢查環境變數是否正確載入 (部署後缺少時啟動失敗，重新載入時缺少則保留原設定)
+require_settings('LINE_CHANNEL_ACCESS_TOKEN', 'LINE_CHANNEL_SECRET')
+if not settings.line_channel_access_token:
     print("⚠️  警告: LINE_CHANNEL_ACCESS_TOKEN 未設定")
 else:
-    print(f"✅ LINE Token 已載入: {LINE_CHANNEL_ACCESS_TOKEN[:20]}...")
+    print(f"✅ LINE Token 已載入: {settings.line_channel_access_token[:20]}...")
 
-if not LINE_CHANNEL_SECRET:
+if not settings.line_channel_secret:
     print("⚠️  警告: LINE_CHANNEL_SECRET 未設定")
 else:
-    print(f"✅ LINE Secret 已載入: {LINE_CHANNEL_SECRET[:10]}...")
+    print(f"✅ LINE Secret 已載入: {settings.line_channel_secret[:10]}...")
 
 
 
 def line_webhook_handler(request):
     """處理 LINE Webhook 請求 (適用於 Flask 和 Cloud Function)"""
+    # 本次呼叫的期限 (FUNCTION_TIMEOUT_SECONDS)，各階段與網路呼叫的逾時依剩餘時間調整；
+    # 取樣到或帶有 X-Profile-Token 標頭時分析本次呼叫 (見 config/profiling.py)
+    with deadline.invocation(), profiling.request('webhook', getattr(request, 'headers', None)):
+        # 環境變數檔案變更時重新載入設定 (平常只是一次時間比較)
+        settings = reload_settings_if_changed()
+        
+        # 錄製模式: 記錄原始請求內容、標頭與處理耗時 (去識別化)，供 local_test/replay_webhook.py 重播
+        recorder = get_recorder(settings.get('WEBHOOK_CAPTURE_PATH'), settings.get('WEBHOOK_CAPTURE_SALT'))
+        if recorder is None:
+            return process_webhook_request(request)
+        
+        received_at = time.time()
+        started = time.perf_counter()
+        body = request.get_data(cache=True)
+        response = process_webhook_request(request)
+        try:
+            recorder.record(received_at, request.headers, body, response[1],
+                            (time.perf_counter() - started) * 1000)
+        except Exception as e:
+            print(f"⚠️ 錄製 Webhook 失敗: {e}")
+        return response
+
+def process_webhook_request(request):
+    """解析 Webhook 內容並依序處理每個事件"""
     try:
         # 取得原始請求資料
         if hasattr(request, 'get_json'):
@@ -84,19 +108,35 @@ def line_webhook_handler(request):
         
         print(f"收到 LINE Webhook: {json.dumps(data, indent=2, ensure_ascii=False)}")
         
-        # 處理每個事件
-        for event in data.get('events', []):
-            event_type = event.get('type')
-            print(f"處理事件類型: {event_type}")
-            
-            if event_type == 'message':
-                handle_message_event(event)
-            elif event_type == 'follow':
-                handle_follow_event(event)
-            elif event_type == 'unfollow':
-                handle_unfollow_event(event)
-            else:
-                print(f"未處理的事件類型: {event_type}")
+        events = data.get('events', [])
+        
+        # 先開始下載檔案 / 圖片內容，與排隊、額度檢查與進度通知重疊進行
+        for event in events:
+            prefetch_event_content(event)
+        
+        # 依租戶排入公平排程器，同一執行個體內的並行請求共用佇列，
+        # 單一用戶大量傳檔時其他用戶的事件仍可輪流處理
+        scheduler = get_scheduler()
+        futures = [
+            scheduler.submit(tenant_of(event.get('source')), profiling.attached(handle_event), event)
+            for event in events
+        ]
+        deferred = 0
+        for future in futures:
+            try:
+                future.result()
+            except DEFERRED_ERRORS:
+                deferred += 1
+        
+        # Cloud Function 回應後背景執行緒可能被凍結，回應前送出本次累積的進度通知
+        if IS_CLOUD_FUNCTION:
+            progress.flush(force=True)
+        
+        if deferred:
+            # 回應非 2xx 讓 LINE 重送 (需在 LINE Developers Console 啟用 Webhook 重送)；
+            # 重送時已完成的事件依重試帳本略過，延後的事件從檢查點繼續
+            print(f"🕒 {deferred} 個事件延後處理，回應 503 等待 LINE 重送")
+            return ('Deferred', 503)
         
         return ('OK', 200)
         
@@ -104,6 +144,47 @@ def line_webhook_handler(request):
         print(f"處理 Webhook 時發生錯誤: {e}")
         return ('Error', 500)
 
+def prefetch_event_content(event):
+    """事件解析後立即開始下載檔案 / 圖片內容 (未啟用或超過預算時由處理器照常下載)"""
+    prefetcher = get_prefetcher()
+    message = event.get('message') or {}
+    if prefetcher is None or event.get('type') != 'message' or message.get('type') not in ('file', 'image'):
+        return
+    
+    # 重送事件的工作可能已完成，由處理器依重試帳本決定是否下載
+    if (event.get('deliveryContext') or {}).get('isRedelivery'):
+        return
+    
+    message_id = message['id']
+    if message['type'] == 'image':
+        prefetcher.start(message_id, profiling.attached(lambda: fetch_line_content(message_id)),
+                         reservation_bytes(None))
+    else:
+        file_name = message['fileName']
+        file_size = message.get('fileSize') or 0
+        prefetcher.start(message_id, profiling.attached(lambda: fetch_line_content(message_id, file_name, file_size)),
+                         reservation_bytes(file_size))
+
+def discard_prefetched(message_id):
+    """放棄未使用的預先下載內容 (超過額度、已完成的重送事件、處理失敗)"""
+    prefetcher = get_prefetcher()
+    if prefetcher is not None:
+        prefetcher.discard(message_id)
+
+def handle_event(event):
+    """依事件類型分派處理"""
+    event_type = event.get('type')
+    print(f"處理事件類型: {event_type}")
+    
+    if event_type == 'message':
+        handle_message_event(event)
+    elif event_type == 'follow':
+        handle_follow_event(event)
+    elif event_type == 'unfollow':
+        handle_unfollow_event(event)
+    else:
+        print(f"未處理的事件類型: {event_type}")
+
 @app.route("/", methods=['POST'])
 def line_webhook_flask():
     """接收 LINE Webhook 的主要端點 (Flask 路由)"""
@@ -134,7 +215,7 @@ def handle_text_message(event):
     print(f"收到文字訊息: {text}")
     
     # 只在啟用自動回覆時才回覆
-    if AUTO_REPLY_ENABLED:
+    if get_settings().auto_reply_enabled:
         reply_message = f"收到您的訊息: {text}"
         reply_to_user(reply_token, reply_message, user_id)
     else:
@@ -147,67 +228,83 @@ def handle_file_message(event):
     file_size = event['message']['fileSize']
     reply_token = event.get('replyToken')
     user_id = event['source'].get('userId')
+    tenant = tenant_of(event['source'])
+    started = time.perf_counter()
     
     print(f"收到檔案: {file_name} (大小: {file_size} bytes)")
+    profiling.annotate(message_type='file', extension=Path(file_name).suffix.lower(), file_size=file_size)
     
-    # 階段 1：立即回覆（使用 reply token）
-    if AUTO_REPLY_ENABLED:
-        immediate_reply = f"📥 開始下載檔案：{file_name}"
-        reply_to_user(reply_token, immediate_reply, user_id)
-    else:
-        print("🤖 自動回覆已停用，跳過檔案下載通知")
+    # 超過租戶每日下載額度時不下載
+    if not get_quota().allows(tenant, byte_count=file_size):
+        print(f"🚫 租戶今日額度已用完，跳過: {file_name}")
+        discard_prefetched(message_id)
+        notify_progress(user_id, message_id, file_name, 'rejected', reply_token)
+        return
     
     try:
-        # 階段 2：下載檔案
-        print(f"開始下載檔案 {message_id}...")
-        downloaded_file = download_line_file(message_id, file_name)
-        
-        # 階段 3：下載完成後用 push message 回覆結果
-        if downloaded_file:
-            # 處理新的回傳格式
-            if isinstance(downloaded_file, dict):
-                file_path = downloaded_file['file_path']
-                content_type = downloaded_file.get('content_type', '')
-            else:
-                # 向後相容舊格式
-                file_path = downloaded_file
-                content_type = ''
-            
-            # 上傳到 Cloud Storage
-            cloud_url = upload_to_cloud_storage(file_path, file_name, content_type)
-            
-            if cloud_url:
-                result_message = f"✅ 檔案下載成功！\n📁 檔案名稱: {file_name}\n💾 檔案大小: {file_size} bytes\n☁️ 雲端儲存: {cloud_url}"
-            else:
-                result_message = f"✅ 檔案下載成功！\n📁 檔案名稱: {file_name}\n💾 檔案大小: {file_size} bytes\n📂 本地儲存: {file_path}\n⚠️ 雲端上傳失敗"
-        else:
-            result_message = f"❌ 檔案下載失敗: {file_name}\n請檢查檔案是否仍在 LINE 中可用"
-            
-        # 使用 push message 發送結果（因為 reply token 可能已過期）
-        if AUTO_REPLY_ENABLED:
-            push_message_to_user(user_id, result_message)
-        else:
-            print("🤖 自動回覆已停用，跳過檔案處理結果通知")
+        # 下載檔案並上傳 (依重試帳本的檢查點執行)
+        job = get_ledger().start(message_id, 'line_file', {
+            'message_id': message_id,
+            'file_name': file_name,
+            'file_size': file_size,
+            'user_id': user_id,
+            'tenant_id': tenant
+        })
+        if job['status'] == STATUS_DONE:
+            print(f"檔案 {message_id} 已處理完成，略過重送事件")
+            return
+        if job['status'] == STATUS_DEAD:
+            print(f"☠️ 檔案 {message_id} 已在死信區，略過重送事件")
+            notify_progress(user_id, message_id, file_name, 'failed', reply_token, detail=DEAD_JOB_DETAIL)
+            return
+        
+        # 階段 1：記錄開始下載 (與其他狀態合併在同一則訊息，reply token 有效時以回覆發送)
+        notify_progress(user_id, message_id, file_name, 'downloading', reply_token)
+        file_path, cloud_url = run_file_job(job)
+        if file_path:
+            get_quota().consume(tenant, byte_count=os.path.getsize(file_path))
+        
+        # 階段 2：記錄結果，由進度通知器彙整後發送
+        notify_file_result(user_id, message_id, file_name, file_path, cloud_url, f"{file_size} bytes")
             
+    except DEFERRED_ERRORS as e:
+        # 由 process_webhook_request 回應 503，LINE 重送時重試
+        print(f"⏰ {e}，等待 LINE 重送: {file_name}")
+        notify_progress(user_id, message_id, file_name, 'deferred', detail=str(e))
+        raise
+    
     except Exception as e:
         print(f"處理檔案時發生錯誤: {e}")
-        if AUTO_REPLY_ENABLED:
-            error_message = f"❌ 處理檔案時發生錯誤: {file_name}\n錯誤: {str(e)}"
-            push_message_to_user(user_id, error_message)
-        else:
-            print("🤖 自動回覆已停用，跳過錯誤通知")
+        notify_progress(user_id, message_id, file_name, 'failed', detail=str(e))
+    
+    finally:
+        # 已由 run_file_job 取用時不做任何事
+        discard_prefetched(message_id)
+        metrics.observe('file.stage.total_ms', (time.perf_counter() - started) * 1000)
+
+def fetch_line_content(message_id, file_name=None, file_size=None):
+    """
+    經由 LINE 相依服務防護下載圖片 (file_name 為 None) 或檔案 (宣告大小達到 ADMISSION_STREAM_BYTES 時串流下載)
+
+    Raises:
+        DependencyUnavailable: LINE 內容 API 異常 (斷路器開啟) 或並行數已滿，不等待逾時
+    """
+    if file_name is None:
+        return get_dependency('line').call(download_line_image, message_id, is_failure=lambda result: not result)
+    return get_dependency('line').call(download_line_file, message_id, file_name, is_streamed(file_size),
+                                       is_failure=lambda result: not result, transfer_bytes=file_size or 0)
 
 def download_line_image(message_id):
     """從 LINE 下載圖片"""
     try:
         # 使用 LINE Bot SDK 取得圖片內容（參考網頁教學）
-        line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+        line_bot_api = LineBotApi(get_settings().line_channel_access_token)
         
         print(f"正在下載圖片: {message_id}")
         print(f"使用 LINE Bot SDK...")
         
         # 使用 get_message_content 方法取得訊息內容
-        message_content = line_bot_api.get_message_content(message_id)
+        message_content = line_bot_api.get_message_content(message_id, timeout=deadline.timeout_for(60))
         
         print(f"成功取得圖片內容")
         print(f"內容類型: {message_content.content_type}")
@@ -218,20 +315,13 @@ def download_line_image(message_id):
         download_dir = os.path.join(desktop_path, "LINE_Downloads")
         os.makedirs(download_dir, exist_ok=True)
         
-        # 根據內容類型判斷圖片格式
+        # 根據內容類型判斷圖片格式 (預設為 jpg)
         content_type = message_content.content_type
-        if 'jpeg' in content_type or 'jpg' in content_type:
-            extension = '.jpg'
-        elif 'png' in content_type:
-            extension = '.png'
-        elif 'gif' in content_type:
-            extension = '.gif'
-        else:
-            extension = '.jpg'  # 預設為 jpg
+        extension = extension_for_mime(content_type, default='.jpg')
         
-        # 儲存圖片（參考網頁教學的寫法）
+        # 儲存圖片（參考網頁教學的寫法），檔名加上訊息 ID 避免同一秒內的下載互相覆蓋
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"LINE_Image_{timestamp}{extension}"
+        filename = f"LINE_Image_{timestamp}_{message_id}{extension}"
         file_path = os.path.join(download_dir, filename)
         
         # 使用二進位模式寫入檔案
@@ -258,18 +348,18 @@ def download_line_image(message_id):
         print(f"詳細錯誤: {traceback.format_exc()}")
         return None
 
-def download_line_file(message_id, file_name):
-    """從 LINE 下載檔案"""
+def download_line_file(message_id, file_name, stream=False):
+    """從 LINE 下載檔案 (stream 時逐塊寫入磁碟，不將整個檔案留在記憶體)"""
     try:
         # 先嘗試取得檔案資訊
         print(f"🔍 先取得檔案資訊...")
         info_url = f"https://api-data.line.me/v2/bot/message/{message_id}/content/header"
         headers = {
-            'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}',
+            'Authorization': f'Bearer {get_settings().line_channel_access_token}',
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        info_response = requests.get(info_url, headers=headers, timeout=30)
+        info_response = get_line_session().get(info_url, headers=headers, timeout=deadline.timeout_for(30))
         print(f"檔案資訊回應: {info_response.status_code}")
         if info_response.status_code == 200:
             print(f"檔案資訊: {info_response.text}")
@@ -279,10 +369,10 @@ def download_line_file(message_id, file_name):
         
         print(f"正在下載檔案: {file_name}")
         print(f"下載 URL: {content_url}")
-        print(f"使用 Token: {LINE_CHANNEL_ACCESS_TOKEN[:20]}...")
+        print(f"使用 Token: {(get_settings().line_channel_access_token or '')[:20]}...")
         
-        # 先嘗試不帶 stream 的請求
-        response = requests.get(content_url, headers=headers, timeout=60)
+        # 一般檔案不帶 stream；大型檔案以串流下載
+        response = get_line_session().get(content_url, headers=headers, timeout=deadline.timeout_for(60), stream=stream)
         
         print(f"回應狀態碼: {response.status_code}")
         print(f"回應標頭: {dict(response.headers)}")
@@ -299,12 +389,16 @@ def download_line_file(message_id, file_name):
             
             # 儲存檔案
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            safe_filename = f"{timestamp}_{file_name}"
+            safe_filename = f"{timestamp}_{message_id}_{file_name}"
             file_path = os.path.join(download_dir, safe_filename)
             
             # 使用二進位模式寫入檔案
             with open(file_path, 'wb') as f:
-                f.write(response.content)
+                if stream:
+                    for chunk in response.iter_content(chunk_size=stream_chunk_bytes()):
+                        f.write(chunk)
+                else:
+                    f.write(response.content)
             
             # 檢查檔案是否成功寫入
             if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
@@ -324,14 +418,14 @@ def download_line_file(message_id, file_name):
             # 方法 2: 嘗試使用不同的 API 端點
             print("🔄 嘗試使用備用 API 端點...")
             alt_url = f"https://api-data.line.me/v2/bot/message/{message_id}/content/stream"
-            alt_response = requests.get(alt_url, headers=headers, timeout=60)
+            alt_response = get_line_session().get(alt_url, headers=headers, timeout=deadline.timeout_for(60))
             
             print(f"備用 API 回應狀態碼: {alt_response.status_code}")
             
             if alt_response.status_code == 200:
                 # 儲存檔案
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                safe_filename = f"{timestamp}_{file_name}"
+                safe_filename = f"{timestamp}_{message_id}_{file_name}"
                 file_path = os.path.join(download_dir, safe_filename)
                 
                 with open(file_path, 'wb') as f:
@@ -344,13 +438,13 @@ def download_line_file(message_id, file_name):
             
             # 方法 3: 嘗試使用不同的請求方式
             print("🔄 嘗試使用 POST 請求...")
-            post_response = requests.post(content_url, headers=headers, timeout=60)
+            post_response = get_line_session().post(content_url, headers=headers, timeout=deadline.timeout_for(60))
             
             print(f"POST 請求回應狀態碼: {post_response.status_code}")
             
             if post_response.status_code == 200:
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                safe_filename = f"{timestamp}_{file_name}"
+                safe_filename = f"{timestamp}_{message_id}_{file_name}"
                 file_path = os.path.join(download_dir, safe_filename)
                 
                 with open(file_path, 'wb') as f:
@@ -377,47 +471,178 @@ def handle_image_message(event):
     message_id = event['message']['id']
     reply_token = event.get('replyToken')
     user_id = event['source'].get('userId')
+    tenant = tenant_of(event['source'])
+    started = time.perf_counter()
     
     print(f"收到圖片訊息，ID: {message_id}")
+    profiling.annotate(message_type='image')
     
-    # 階段 1：立即回覆（使用 reply token）
-    if AUTO_REPLY_ENABLED:
-        immediate_reply = "📸 開始下載圖片..."
-        reply_to_user(reply_token, immediate_reply, user_id)
-    else:
-        print("🤖 自動回覆已停用，跳過圖片下載通知")
+    # 圖片大小要下載後才知道，只檢查當日額度是否已用完
+    if not get_quota().allows(tenant):
+        print(f"🚫 租戶今日額度已用完，跳過圖片: {message_id}")
+        discard_prefetched(message_id)
+        notify_progress(user_id, message_id, '圖片', 'rejected', reply_token)
+        return
     
     try:
-        # 階段 2：下載圖片
-        print(f"開始下載圖片 {message_id}...")
-        downloaded_image = download_line_image(message_id)
+        # 下載圖片並上傳 (依重試帳本的檢查點執行)
+        job = get_ledger().start(message_id, 'line_image', {
+            'message_id': message_id,
+            'user_id': user_id,
+            'tenant_id': tenant
+        })
+        if job['status'] == STATUS_DONE:
+            print(f"圖片 {message_id} 已處理完成，略過重送事件")
+            return
+        if job['status'] == STATUS_DEAD:
+            print(f"☠️ 圖片 {message_id} 已在死信區，略過重送事件")
+            notify_progress(user_id, message_id, '圖片', 'failed', reply_token, detail=DEAD_JOB_DETAIL)
+            return
         
-        # 階段 3：下載完成後用 push message 回覆結果
+        # 階段 1：記錄開始下載 (與其他狀態合併在同一則訊息，reply token 有效時以回覆發送)
+        notify_progress(user_id, message_id, '圖片', 'downloading', reply_token)
+        downloaded_image, cloud_url = run_file_job(job)
         if downloaded_image:
-            # 上傳到 Cloud Storage
-            file_name = os.path.basename(downloaded_image)
-            cloud_url = upload_to_cloud_storage(downloaded_image, file_name)
+            get_quota().consume(tenant, byte_count=os.path.getsize(downloaded_image))
+        
+        # 階段 2：記錄結果，由進度通知器彙整後發送
+        label = os.path.basename(downloaded_image) if downloaded_image else '圖片'
+        notify_file_result(user_id, message_id, label, downloaded_image, cloud_url)
             
-            if cloud_url:
-                result_message = f"✅ 圖片下載成功！\n📁 檔案名稱: {file_name}\n☁️ 雲端儲存: {cloud_url}"
+    except DEFERRED_ERRORS as e:
+        # 由 process_webhook_request 回應 503，LINE 重送時重試
+        print(f"⏰ {e}，等待 LINE 重送: {message_id}")
+        notify_progress(user_id, message_id, '圖片', 'deferred', detail=str(e))
+        raise
+    
+    except Exception as e:
+        print(f"處理圖片時發生錯誤: {e}")
+        notify_progress(user_id, message_id, '圖片', 'failed', detail=str(e))
+    
+    finally:
+        # 已由 run_file_job 取用時不做任何事
+        discard_prefetched(message_id)
+        metrics.observe('file.stage.total_ms', (time.perf_counter() - started) * 1000)
+
+def run_file_job(job):
+    """
+    依檢查點執行 LINE 檔案工作的剩餘階段 (下載 → 上傳)，失敗時記錄到重試帳本
+    
+    Returns:
+        (本地檔案路徑, 雲端路徑)，失敗的階段回傳 None
+    """
+    ledger = get_ledger()
+    job_id = job['job_id']
+    payload = job['payload']
+    downloaded = job['checkpoints'].get('downloaded')
+    stage = 'download'
+    
+    try:
+        # 已下載且本地檔案仍在時，直接從上傳階段繼續
+        if not downloaded or not os.path.exists(downloaded['file_path']):
+            started = time.perf_counter()
+            prefetcher = get_prefetcher()
+            prefetched, result = prefetcher.take(payload['message_id']) if prefetcher else (False, None)
+            if prefetched:
+                print(f"使用預先下載的內容 {payload['message_id']}")
             else:
-                result_message = f"✅ 圖片下載成功！\n📁 檔案名稱: {file_name}\n📂 本地儲存: {downloaded_image}\n⚠️ 雲端上傳失敗"
-        else:
-            result_message = f"❌ 圖片下載失敗\n請檢查圖片是否仍在 LINE 中可用"
+                # 依宣告大小保留下載預算；預算不足或剩餘時間不足以下載時不開始 (交給重試帳本)
+                file_size = None if job['kind'] == 'line_image' else payload.get('file_size') or 0
+                required = deadline.transfer_seconds(file_size or 0, 'download')
+                with admit(file_size), deadline.stage('download', required):
+                    print(f"開始下載 {payload['message_id']}...")
+                    result = fetch_line_content(payload['message_id'],
+                                                None if job['kind'] == 'line_image' else payload['file_name'],
+                                                file_size)
+            # 處理器在下載階段實際花費的時間 (預先下載時只剩等待尚未完成的部分)
+            metrics.observe('file.stage.download_ms', (time.perf_counter() - started) * 1000)
             
-        # 使用 push message 發送結果（因為 reply token 可能已過期）
-        if AUTO_REPLY_ENABLED:
-            push_message_to_user(user_id, result_message)
-        else:
-            print("🤖 自動回覆已停用，跳過圖片處理結果通知")
+            if not result:
+                ledger.fail(job_id, stage, '下載失敗')
+                return None, None
             
+            # 處理新的回傳格式，並向後相容舊格式 (僅回傳路徑)
+            if isinstance(result, dict):
+                downloaded = {'file_path': result['file_path'], 'content_type': result.get('content_type', '')}
+            else:
+                downloaded = {'file_path': result, 'content_type': ''}
+            ledger.checkpoint(job_id, 'downloaded', downloaded)
+        
+        stage = 'upload'
+        file_path = downloaded['file_path']
+        file_name = payload.get('file_name') or os.path.basename(file_path)
+        
+        # 圖片: 以感知雜湊搜尋近似重複 (轉傳後重新壓縮的同一張圖片)
+        tenant = payload.get('tenant_id')
+        image_hash, duplicate_of = (detect_duplicate_image(file_path, tenant) if job['kind'] == 'line_image'
+                                    else (None, None))
+        
+        # 本地環境不上傳，下載完成即視為完成
+        if ENVIRONMENT == 'local':
+            if not duplicate_of:
+                register_image(image_hash, file_path, tenant)
+            ledger.complete(job_id)
+            return file_path, None
+        
+        started = time.perf_counter()
+        extra_metadata = {}
+        if image_hash:
+            extra_metadata['line_image_hash'] = image_hash
+        if duplicate_of:
+            extra_metadata['line_duplicate_of'] = duplicate_of
+        # Cloud Storage 異常時 (斷路器開啟) 或剩餘時間不足以上傳時立即失敗，回應 503 等待 LINE 重送
+        upload_bytes = os.path.getsize(file_path)
+        with deadline.stage('upload', deadline.transfer_seconds(upload_bytes, 'upload')):
+            cloud_url = get_dependency('gcs').call(
+                upload_to_cloud_storage, file_path, file_name, downloaded['content_type'],
+                payload.get('user_id'), payload.get('tenant_id'), extra_metadata=extra_metadata,
+                is_failure=lambda url: url is None, transfer_bytes=upload_bytes
+            )
+        metrics.observe('file.stage.upload_ms', (time.perf_counter() - started) * 1000)
+        if not cloud_url:
+            ledger.fail(job_id, stage, '雲端上傳失敗')
+            return file_path, None
+        if not duplicate_of:
+            register_image(image_hash, cloud_url.split('/', 3)[3], tenant)
+        
+        ledger.checkpoint(job_id, 'uploaded', cloud_url)
+        ledger.complete(job_id)
+        return file_path, cloud_url
+    
+    except DEFERRED_ERRORS as e:
+        # 階段尚未開始，不計入失敗次數 (忙碌期間多次延後不會讓工作移入死信區)
+        ledger.defer(job_id, stage, e)
+        raise
+    
     except Exception as e:
-        print(f"處理圖片時發生錯誤: {e}")
-        if AUTO_REPLY_ENABLED:
-            error_message = f"❌ 處理圖片時發生錯誤\n錯誤: {str(e)}"
-            push_message_to_user(user_id, error_message)
-        else:
-            print("🤖 自動回覆已停用，跳過錯誤通知")
+        ledger.fail(job_id, stage, e)
+        raise
+
+def detect_duplicate_image(file_path, tenant):
+    """
+    計算圖片的感知雜湊並在同一租戶的圖片中搜尋近似重複 (IMAGE_DEDUP_ENABLED 時)
+
+    Returns:
+        (雜湊 hex 或 None, 可沿用結果的原圖物件名稱或 None)；計算失敗時不影響上傳
+    """
+    try:
+        image_hash, match = find_duplicate(file_path, tenant)
+    except Exception as e:
+        print(f"⚠️ 無法計算圖片感知雜湊: {e}")
+        return None, None
+    if is_reusable(match, tenant):
+        print(f"🔁 近似重複的圖片 (距離 {match.distance})，沿用原圖結果: {match.name}")
+        return image_hash, match.name
+    if match:
+        # 距離超過 IMAGE_DEDUP_REUSE_MAX_DISTANCE: 可能是相似但內容不同的圖片，照常處理
+        metrics.increment('dedup.near')
+        print(f"🔍 相似的圖片 (距離 {match.distance})，不沿用結果: {match.name}")
+    return image_hash, None
+
+def replay_job(job):
+    """重跑重試帳本中的工作 (供 scripts/retry_jobs.py 使用)"""
+    file_path, cloud_url = run_file_job(job)
+    return bool(file_path) and (cloud_url is not None or ENVIRONMENT == 'local')
 
 def handle_follow_event(event):
     """處理加好友事件"""
@@ -438,7 +663,7 @@ def reply_to_user(reply_token, message, user_id=None, group_id=None):
     """回覆 LINE 用戶訊息"""
     try:
         headers = {
-            'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}',
+            'Authorization': f'Bearer {get_settings().line_channel_access_token}',
             'Content-Type': 'application/json'
         }
         
@@ -461,7 +686,7 @@ def reply_to_user(reply_token, message, user_id=None, group_id=None):
             return
         
         print(f"發送訊息請求: {json.dumps(data, ensure_ascii=False)}")
-        response = requests.post(url, headers=headers, json=data, timeout=10)
+        response = get_line_session().post(url, headers=headers, json=data, timeout=deadline.timeout_for(10))
         
         if response.status_code == 200:
             print(f"✅ 已發送訊息: {message}")
@@ -475,12 +700,43 @@ def reply_to_user(reply_token, message, user_id=None, group_id=None):
     except Exception as e:
         print(f"發送訊息失敗: {e}")
 
+def send_progress_message(user_id, message, reply_token=None):
+    """進度通知器的發送函式 (reply token 仍有效時回覆，否則 push)"""
+    if reply_token:
+        reply_to_user(reply_token, message, user_id)
+    else:
+        push_message_to_user(user_id, message)
+
+# 進度通知器: 同一用戶在時間窗內的狀態變更合併成一則訊息
+progress = ProgressNotifier(send_progress_message)
+
+# 死信區的工作在重送時的通知說明
+DEAD_JOB_DETAIL = '重試次數已達上限，請重新傳送檔案'
+
+def notify_progress(user_id, job_key, label, stage, reply_token=None, detail=None):
+    """記錄檔案工作的狀態變更 (僅在啟用自動回覆時通知)"""
+    if not get_settings().auto_reply_enabled:
+        print(f"🤖 自動回覆已停用，跳過進度通知: {label} {stage}")
+        return
+    progress.update(user_id, job_key, label, stage, reply_token, detail)
+
+def notify_file_result(user_id, job_key, label, file_path, cloud_url, detail=None):
+    """依下載 / 上傳結果記錄最終狀態"""
+    if not file_path:
+        notify_progress(user_id, job_key, label, 'failed', detail='下載失敗，請檢查檔案是否仍在 LINE 中可用')
+    elif cloud_url:
+        notify_progress(user_id, job_key, label, 'uploaded', detail=detail)
+    elif ENVIRONMENT == 'local':
+        notify_progress(user_id, job_key, label, 'downloaded', detail=detail)
+    else:
+        notify_progress(user_id, job_key, label, 'failed', detail='雲端上傳失敗')
+
 def push_message_to_user(user_id, message):
     """使用 push message 發送訊息給用戶"""
     try:
         url = "https://api.line.me/v2/bot/message/push"
         headers = {
-            'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}',
+            'Authorization': f'Bearer {get_settings().line_channel_access_token}',
             'Content-Type': 'application/json'
         }
         data = {
@@ -489,7 +745,7 @@ def push_message_to_user(user_id, message):
         }
         
         print(f"發送 push message: {json.dumps(data, ensure_ascii=False)}")
-        response = requests.post(url, headers=headers, json=data, timeout=10)
+        response = get_line_session().post(url, headers=headers, json=data, timeout=deadline.timeout_for(10))
         
         if response.status_code == 200:
             print(f"✅ 已使用 push message 發送: {message}")
@@ -500,60 +756,84 @@ def push_message_to_user(user_id, message):
         print(f"push message 發送失敗: {e}")
 
 def get_file_type(file_name, content_type=None):
-    """根據檔案名稱和內容類型判斷檔案類型"""
-    # 從檔案名稱取得副檔名
-    file_extension = os.path.splitext(file_name)[1].lower()
-    
-    # 檔案類型分類
-    if file_extension in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
-        return 'images'
-    elif file_extension in ['.pdf']:
-        return 'documents'
-    elif file_extension in ['.doc', '.docx']:
-        return 'documents'
-    elif file_extension in ['.xls', '.xlsx']:
-        return 'spreadsheets'
-    elif file_extension in ['.ppt', '.pptx']:
-        return 'presentations'
-    elif file_extension in ['.txt', '.md']:
-        return 'text'
-    elif file_extension in ['.zip', '.rar', '.7z']:
-        return 'archives'
-    elif file_extension in ['.mp4', '.avi', '.mov', '.wmv']:
-        return 'videos'
-    elif file_extension in ['.mp3', '.wav', '.flac']:
-        return 'audio'
-    else:
-        return 'others'
-
-def upload_to_cloud_storage(file_path, file_name, content_type=None):
-    """上傳檔案到 Cloud Storage"""
+    """根據檔案名稱和內容類型判斷檔案類型 (查詢共用路由表)"""
+    return resolve_route(file_name, content_type).file_type
+
+_storage_client = None
+
+def get_storage_client():
+    """取得共用的 Cloud Storage 客戶端 (第一次上傳時建立)"""
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client()
+    return _storage_client
+
+_line_session = None
+
+def get_line_session():
+    """取得共用的 LINE API 連線 (保留連線池，回覆 / push / 下載不必每次重新建立 TLS 連線)"""
+    global _line_session
+    if _line_session is None:
+        session = requests.Session()
+        # 每個 LINE API 主機保留的連線數 (與同時處理的事件數相當)
+        pool_size = get_settings().get_int('LINE_HTTP_POOL_SIZE', 16)
+        session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+        session.pool_size = pool_size
+        _line_session = session
+    return _line_session
+
+def _on_settings_reload(settings):
+    """連線池大小變更時重新建立 LINE 連線 (進行中的請求沿用舊連線)"""
+    global _line_session
+    if _line_session is not None and _line_session.pool_size != settings.get_int('LINE_HTTP_POOL_SIZE', 16):
+        _line_session = None
+
+env_manager.on_reload(_on_settings_reload)
+
+def upload_to_cloud_storage(file_path, file_name, content_type=None, user_id=None, tenant_id=None,
+                            extra_metadata=None):
+    """上傳檔案到 Cloud Storage (extra_metadata 會一併寫入物件 metadata)"""
     # 本地環境跳過 Cloud Storage 上傳
     if ENVIRONMENT == 'local':
         print(f"🏠 本地環境：跳過 Cloud Storage 上傳")
         return None
         
     try:
-        # 初始化 Cloud Storage 客戶端
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
+        # 共用 Cloud Storage 客戶端 (不必每次上傳都重新建立連線與驗證)
+        storage_client = get_storage_client()
+        bucket_name = get_settings().bucket_name
+        bucket = storage_client.bucket(bucket_name)
         
-        # 根據檔案類型決定儲存路徑
-        file_type = get_file_type(file_name, content_type)
-        storage_path = f"line-{file_type}/{file_name}"
+        # 根據檔案類型決定儲存路徑 (依 OBJECT_LAYOUT 加上日期分區、分片、內容雜湊與租戶標籤)
+        route = resolve_route(file_name, content_type)
+        storage_path = upload_object_name(route.storage_prefix, file_name, file_path, tenant_id)
         
-        print(f"📁 檔案類型: {file_type}")
+        print(f"📁 檔案類型: {route.file_type} (路由: {route.name}，{'需處理' if route.process else '僅儲存'})")
         print(f"📂 儲存路徑: {storage_path}")
         
         # 建立 blob 物件
         blob = bucket.blob(storage_path)
         
+        # 記錄上傳者與租戶，供文件處理器寫入結果索引並計算租戶額度
+        metadata = {}
+        if user_id:
+            metadata['line_user_id'] = user_id
+        if tenant_id:
+            metadata['line_tenant_id'] = tenant_id
+        metadata.update(extra_metadata or {})
+        # 以標頭觸發分析時，文件處理器處理此物件時也分析
+        if profiling.propagate():
+            metadata[profiling.PROFILE_METADATA_KEY] = '1'
+        if metadata:
+            blob.metadata = metadata
+        
         # 上傳檔案
-        blob.upload_from_filename(file_path)
+        blob.upload_from_filename(file_path, timeout=deadline.timeout_for(60))
         
         # 返回檔案路徑
-        gcs_path = f"gs://{BUCKET_NAME}/{storage_path}"
+        gcs_path = f"gs://{bucket_name}/{storage_path}"
         
+        record_route(route, 'uploaded')
         print(f"✅ 檔案已上傳到 Cloud Storage")
         print(f"📂 檔案路徑: {gcs_path}")
         return gcs_path
@@ -563,19 +843,47 @@ def upload_to_cloud_storage(file_path, file_name, content_type=None):
         return None
 
 def health_check_handler():
-    """健康檢查處理函數"""
-    return {'status': 'healthy', 'service': 'line-webhook-receiver'}, 200
+    """健康檢查處理函數 (相依服務的斷路器未關閉時狀態為 degraded)"""
+    return {
+        'status': 'degraded' if is_degraded() else 'healthy',
+        'service': 'line-webhook-receiver',
+        'dependencies': dependency_states()
+    }, 200
+
+def metrics_handler():
+    """指標輸出處理函數 (包含各租戶目前的排隊狀態、相依服務狀態、下載預算與預熱結果)"""
+    budget = get_budget()
+    return {**metrics.snapshot(), 'scheduler': get_scheduler().stats(), 'dependencies': dependency_states(),
+            'admission': budget.stats() if budget else None, 'warmup': warmup.report()}, 200
+
+def warmup_handler():
+    """預熱處理函數 (同一執行個體只預熱一次，之後回傳第一次的結果)"""
+    return warmup.run(), 200
 
 @app.route("/health", methods=['GET'])
 def health_check():
     """健康檢查端點 (Flask 路由)"""
     return health_check_handler()
 
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    """指標輸出端點 (Flask 路由)"""
+    return metrics_handler()
+
+@app.route("/warmup", methods=['GET'])
+def warmup_endpoint():
+    """預熱端點 (Flask 路由)"""
+    return warmup_handler()
+
 # Cloud Function 入口點
 def line_webhook(request):
     """Cloud Function 入口點"""
-    # 處理 GET 請求 (健康檢查)
+    # 處理 GET 請求 (指標輸出 / 預熱 / 健康檢查)
     if request.method == 'GET':
+        if request.path.rstrip('/').endswith('/metrics'):
+            return metrics_handler()
+        if request.path.rstrip('/').endswith('/warmup'):
+            return warmup_handler()
         return health_check_handler()
     # 處理 POST 請求 (LINE Webhook)
     elif request.method == 'POST':
@@ -583,15 +891,71 @@ def line_webhook(request):
     else:
         return ('Method not allowed', 405)
 
+def warm_storage():
+    """建立 Cloud Storage 客戶端並取得存取權杖、建立連線 (讀取不存在物件的中繼資料)"""
+    if ENVIRONMENT == 'local':
+        return {'skipped': '本地環境不上傳'}
+    bucket = get_storage_client().bucket(get_settings().bucket_name)
+    bucket.blob(f"{warmup.object_prefix()}ping").exists(timeout=warmup.timeout_seconds())
+
+def warm_line():
+    """建立到 api.line.me (回覆 / push) 與 api-data.line.me (下載) 的連線"""
+    session = get_line_session()
+    headers = {'Authorization': f'Bearer {get_settings().line_channel_access_token}'}
+    # bot 資訊不會產生訊息，同時確認 Channel Access Token 有效
+    response = session.get('https://api.line.me/v2/bot/info', headers=headers,
+                           timeout=warmup.timeout_seconds())
+    session.head('https://api-data.line.me/', timeout=warmup.timeout_seconds())
+    return {'bot_info': response.status_code}
+
+def warm_state():
+    """開啟重試帳本 / 租戶額度的 SQLite 連線，啟動排程器與預先下載的執行緒"""
+    get_ledger()
+    get_quota()
+    get_scheduler()
+    get_prefetcher()
+    get_budget()
+
+warmup.register('state', warm_state)
+warmup.register('storage', warm_storage)
+warmup.register('line', warm_line)
+warmup.register('image_hash', warm_up_image_hash)
+
+def init_worker():
+    """正式服務模式: 工作行程 fork 後建立各自的客戶端、SQLite 連線與執行緒並預熱 (主行程不處理請求，不會預先建立)"""
+    global _storage_client, _line_session
+    _storage_client = None
+    _line_session = None
+    warmup.run(force=True)
+    print(f"👷 工作行程 {os.getpid()} 已初始化")
+
+def drain_worker():
+    """正式服務模式: 工作行程結束前等待預先下載完成，並送出累積的進度通知"""
+    prefetcher = get_prefetcher()
+    if prefetcher is not None:
+        prefetcher.shutdown()
+    get_scheduler().shutdown()
+    progress.flush(force=True)
+    print(f"👋 工作行程 {os.getpid()} 已結束")
+
+# 冷啟動時預熱 (WARMUP_ON_START)；正式服務模式由每個工作行程在 fork 後預熱 (init_worker)
+if warmup.on_start() and settings.get('SERVER_MODE', 'dev') != 'prefork':
+    warmup.run()
+
 if __name__ == "__main__":
-    # 本地開發模式
-    port = int(os.environ.get('PORT', 8080))
-    debug = os.environ.get('DEBUG', 'False').lower() == 'true'
+    # 本地開發模式 (SERVER_MODE=prefork 時為正式服務模式，見 server.py)
+    port = settings.port
+    debug = settings.debug
+    server_mode = settings.get('SERVER_MODE', 'dev')
     
     print(f"啟動本地測試伺服器於 port {port}")
     print(f"Debug 模式: {debug}")
-    print(f"LINE Token: {LINE_CHANNEL_ACCESS_TOKEN[:20] if LINE_CHANNEL_ACCESS_TOKEN else '未設定'}...")
-    print(f"LINE Channel ID: {LINE_CHANNEL_ID or '未設定'}")
-    print(f"Webhook URL: {WEBHOOK_URL or '未設定'}")
+    print(f"LINE Token: {settings.line_channel_access_token[:20] if settings.line_channel_access_token else '未設定'}...")
+    print(f"LINE Channel ID: {settings.line_channel_id or '未設定'}")
+    print(f"Webhook URL: {settings.webhook_url or '未設定'}")
     
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    if server_mode == 'prefork':
+        from server import serve
+        serve(app, f"0.0.0.0:{port}", on_worker_start=init_worker, on_worker_exit=drain_worker)
+    else:
+        app.run(host='0.0.0.0', port=port, debug=debug)
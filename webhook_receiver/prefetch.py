@@ -0,0 +1,198 @@
+"""
+LINE 內容預先下載
+Webhook 解析完成後立即開始下載檔案 / 圖片內容，與排程器排隊、額度與重試帳本檢查、進度通知重疊進行；
+處理器執行到下載階段時直接取用結果，未預先下載 (或超過預算) 時照常下載。
+
+下載中的內容會完整留在記憶體 (requests 的 response.content)，以 PREFETCH_MAX_BYTES 限制同時預先下載的總位元組數，
+並不等待地向下載准入控制 (admission.py) 的共用預算保留 (預算不足或有處理器在等待時不預先下載)；
+下載完成後內容已寫入檔案，即釋放預算。
+
+指標: prefetch.started / prefetch.skipped (超過預算) / prefetch.hit / prefetch.miss / prefetch.discarded，
+prefetch.download_ms (下載耗時)、prefetch.wait_ms (處理器等待預先下載完成的時間)。
+
+PREFETCH_ENABLED / PREFETCH_MAX_BYTES 在每次預先下載時由設定快照讀取；PREFETCH_WORKERS 於設定重新載入時
+套用到共用的預先下載器 (已排入的下載在原本的執行緒完成)。
+"""
+
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Optional
+
+from config import metrics
+from config.env_manager import env_manager, get_settings
+from admission import ByteBudget, get_budget
+
+
+def prefetch_workers(settings=None) -> int:
+    """同時預先下載的數量上限 (PREFETCH_WORKERS)"""
+    return (settings or get_settings()).get_int('PREFETCH_WORKERS', 4)
+
+
+def _downloaded_path(result) -> Optional[str]:
+    """下載函式的回傳值 (dict 或路徑) 中的本地檔案路徑"""
+    if isinstance(result, dict):
+        return result.get('file_path')
+    return result
+
+
+class ContentPrefetcher:
+    """LINE 內容預先下載器"""
+
+    def __init__(self, workers: Optional[int] = None, max_bytes: Optional[int] = None,
+                 budget: Optional[ByteBudget] = None):
+        """
+        初始化預先下載器
+
+        Args:
+            workers: 同時下載的數量上限 (預設依 PREFETCH_WORKERS)
+            max_bytes: 同時下載中的內容總位元組數上限 (單一超過上限的檔案在沒有其他下載時仍可預先下載；
+                預設依目前設定的 PREFETCH_MAX_BYTES)
+            budget: 與處理器共用的下載預算 (None 表示不限制)
+        """
+        self.workers = prefetch_workers() if workers is None else workers
+        self._max_bytes = max_bytes
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending: Dict[str, Future] = {}
+        self._reserved = 0
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return get_settings().get_int('PREFETCH_MAX_BYTES', 64 * 1024 * 1024)
+
+    def resize(self, workers: int):
+        """調整同時下載的數量上限；已排入的下載在原本的執行緒完成，之後的下載使用新的執行緒"""
+        with self._lock:
+            if workers == self.workers:
+                return
+            self.workers = workers
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def start(self, message_id: str, fetch: Callable[[], object], size_hint: int) -> bool:
+        """
+        開始預先下載 (已在下載中或超過預算時不重複下載)
+
+        Args:
+            message_id: LINE 訊息 ID
+            fetch: 下載函式 (回傳值與 download_line_file / download_line_image 相同)
+            size_hint: 需要保留的預算 (bytes，見 admission.reservation_bytes)
+
+        Returns:
+            是否已預先下載
+        """
+        with self._lock:
+            if message_id in self._pending:
+                return True
+            if self._reserved and self._reserved + size_hint > self.max_bytes:
+                metrics.increment('prefetch.skipped')
+                return False
+            if self.budget is not None and not self.budget.try_acquire(size_hint):
+                metrics.increment('prefetch.skipped')
+                return False
+            self._reserved += size_hint
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prefetch')
+            # 沿用 Webhook 請求的 context (呼叫期限)
+            future = self._executor.submit(contextvars.copy_context().run, self._fetch, fetch, size_hint)
+            self._pending[message_id] = future
+        metrics.increment('prefetch.started')
+        return True
+
+    def _fetch(self, fetch, size_hint):
+        started = time.perf_counter()
+        try:
+            return fetch()
+        finally:
+            with self._lock:
+                self._reserved -= size_hint
+            if self.budget is not None:
+                self.budget.release(size_hint)
+            metrics.observe('prefetch.download_ms', (time.perf_counter() - started) * 1000)
+
+    def take(self, message_id: str):
+        """
+        取得預先下載的結果 (下載中時等待完成)
+
+        Returns:
+            (是否有預先下載, 下載結果)；預先下載發生例外時視為沒有預先下載，由呼叫端重新下載
+        """
+        with self._lock:
+            future = self._pending.pop(message_id, None)
+        if future is None:
+            metrics.increment('prefetch.miss')
+            return False, None
+
+        started = time.perf_counter()
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"⚠️ 預先下載失敗，改為重新下載: {e}")
+            metrics.increment('prefetch.miss')
+            return False, None
+        metrics.observe('prefetch.wait_ms', (time.perf_counter() - started) * 1000)
+        metrics.increment('prefetch.hit')
+        return True, result
+
+    def discard(self, message_id: str):
+        """放棄預先下載的內容 (例如超過額度或重送的已完成工作)，下載完成後刪除檔案"""
+        with self._lock:
+            future = self._pending.pop(message_id, None)
+        if future is None:
+            return
+        metrics.increment('prefetch.discarded')
+        future.add_done_callback(_remove_download)
+
+    def shutdown(self):
+        """停止預先下載 (等待下載中的內容完成，之後的 start 會重新建立執行緒)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def pending(self) -> int:
+        """尚未被取用的預先下載數"""
+        with self._lock:
+            return len(self._pending)
+
+
+def _remove_download(future: Future):
+    """刪除未被取用的下載檔案"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    file_path = _downloaded_path(future.result())
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> Optional[ContentPrefetcher]:
+    """取得共用的預先下載器 (PREFETCH_ENABLED=false 時回傳 None)"""
+    global _prefetcher
+    if not get_settings().get_bool('PREFETCH_ENABLED', True):
+        return None
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = ContentPrefetcher(budget=get_budget())
+        return _prefetcher
+
+
+def _on_settings_reload(settings):
+    """設定重新載入時調整共用預先下載器的執行緒數"""
+    with _prefetcher_lock:
+        prefetcher = _prefetcher
+    if prefetcher is not None:
+        prefetcher.resize(prefetch_workers(settings))
+
+
+env_manager.on_reload(_on_settings_reload)
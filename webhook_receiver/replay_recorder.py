@@ -0,0 +1,140 @@
+"""
+Webhook 錄製器
+將收到的 LINE Webhook 請求 (原始內容、標頭、時間與處理耗時) 去識別化後，
+以精簡的 JSON Lines 追加寫入記錄檔 (.gz 結尾時以 gzip 壓縮)，供 local_test/replay_webhook.py 重播。
+
+每筆紀錄寫入後立即 flush；gzip 檔案的每筆紀錄是一個完整的 gzip member (多個 member 串接仍是合法的 gzip 檔案)，
+行程中途結束時最多遺失最後一筆，讀取時略過不完整的結尾。
+
+啟用方式: 設定 WEBHOOK_CAPTURE_PATH，例如 /tmp/webhook_capture.jsonl.gz
+"""
+
+import os
+import json
+import gzip
+import hashlib
+import threading
+from typing import Optional
+
+# 需要保留的標頭；簽章與授權資訊一律遮蔽
+CAPTURED_HEADERS = ('Content-Type', 'Content-Length', 'User-Agent', 'X-Line-Signature', 'Authorization')
+REDACTED_HEADERS = ('X-Line-Signature', 'Authorization')
+
+# 事件中需要假名化的識別欄位 (保留同一用戶/群組的對應關係) 與需要遮蔽的內容欄位
+PSEUDONYMIZED_FIELDS = ('userId', 'groupId', 'roomId', 'replyToken')
+REDACTED_FIELDS = ('text',)
+
+
+class WebhookRecorder:
+    """Webhook 錄製器"""
+
+    def __init__(self, path: str, salt: Optional[str] = None):
+        """
+        初始化錄製器
+
+        Args:
+            path: 記錄檔路徑 (.gz 結尾時以 gzip 壓縮)
+            salt: 假名化用的鹽值，未指定時每次啟動隨機產生
+        """
+        self.path = path
+        self.salt = salt or os.urandom(8).hex()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._compress = path.endswith('.gz')
+        self._file = open(path, 'ab')
+
+    def _pseudonym(self, value: str) -> str:
+        digest = hashlib.sha256(f"{self.salt}:{value}".encode('utf-8')).hexdigest()[:16]
+        return f"{value[:1]}{digest}"
+
+    def _redact(self, node):
+        """遞迴去識別化事件內容"""
+        if isinstance(node, dict):
+            redacted = {}
+            for key, value in node.items():
+                if key in PSEUDONYMIZED_FIELDS and isinstance(value, str):
+                    redacted[key] = self._pseudonym(value)
+                elif key in REDACTED_FIELDS and isinstance(value, str):
+                    redacted[key] = f"[REDACTED len={len(value)}]"
+                elif key == 'fileName' and isinstance(value, str):
+                    # 保留副檔名以維持路由行為
+                    redacted[key] = f"file_{self._pseudonym(value)[1:9]}{os.path.splitext(value)[1]}"
+                else:
+                    redacted[key] = self._redact(value)
+            return redacted
+        if isinstance(node, list):
+            return [self._redact(item) for item in node]
+        return node
+
+    def record(self, received_at: float, headers, body: bytes, status: int, latency_ms: float):
+        """
+        追加一筆請求紀錄
+
+        Args:
+            received_at: 收到請求的時間 (epoch 秒)
+            headers: 請求標頭
+            body: 原始請求內容
+            status: 回應狀態碼
+            latency_ms: 處理耗時 (毫秒)
+        """
+        captured_headers = {}
+        for name in CAPTURED_HEADERS:
+            value = headers.get(name)
+            if value is not None:
+                captured_headers[name] = '[REDACTED]' if name in REDACTED_HEADERS else value
+
+        try:
+            payload = self._redact(json.loads(body or b'{}'))
+            body_text = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+        except ValueError:
+            body_text = None
+
+        entry = {
+            't': round(received_at, 4),
+            'headers': captured_headers,
+            'body': body_text,
+            'size': len(body or b''),
+            'status': status,
+            'latency_ms': round(latency_ms, 2),
+        }
+        data = (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        if self._compress:
+            data = gzip.compress(data)
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_recorder: Optional[WebhookRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder(path: Optional[str], salt: Optional[str] = None) -> Optional[WebhookRecorder]:
+    """取得共用的錄製器 (未設定路徑時回傳 None)"""
+    global _recorder
+    if not path:
+        return None
+    with _recorder_lock:
+        if _recorder is None or _recorder.path != path:
+            _recorder = WebhookRecorder(path, salt)
+    return _recorder
+
+
+def read_capture(path: str):
+    """逐筆讀取記錄檔；錄製中途結束造成的不完整結尾 (截斷的 gzip member 或沒有換行的最後一行) 會略過"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if not line.endswith('\n'):
+                    print(f"⚠️ 記錄檔結尾不完整，略過最後一筆: {path}")
+                    break
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile):
+            print(f"⚠️ 記錄檔結尾不完整，略過最後一筆: {path}")
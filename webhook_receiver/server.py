@@ -0,0 +1,99 @@
+"""
+Webhook 接收器的正式服務模式 (自架主機)
+`python webhook_receiver/main.py` 預設使用 Flask 開發伺服器 (單一行程)；SERVER_MODE=prefork 時改由 gunicorn
+預先 fork SERVER_WORKERS 個工作行程，每個行程以 SERVER_THREADS 個執行緒 (gthread) 處理請求。
+
+- fork 後初始化: 主行程只載入程式與設定，Cloud Storage 客戶端、SQLite 連線 (重試帳本 / 租戶額度)、
+  排程器與預先下載的執行緒由每個工作行程在 fork 後各自建立 (on_worker_start)
+- 優雅關閉: 收到 SIGTERM 後停止接受新連線，進行中的請求 (包含下載與上傳) 最多再執行 SERVER_GRACEFUL_SECONDS 秒；
+  工作行程結束前 (on_worker_exit) 送出累積的進度通知並等待預先下載完成
+- SO_REUSEPORT: SERVER_REUSE_PORT=true 時監聽 socket 設定 SO_REUSEPORT，
+  可在同一個 port 啟動新版本後再關閉舊版本 (不中斷服務)，由核心分配連線
+
+指標由各工作行程分別累計，/metrics 回傳處理該請求的工作行程的數值。
+需要 gunicorn (pip install gunicorn)，只在 Linux / macOS 上執行。
+"""
+
+import os
+import sys
+from typing import Callable, Optional
+
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS') or (os.cpu_count() or 1) * 2 + 1)
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))
+SERVER_GRACEFUL_SECONDS = int(os.getenv('SERVER_GRACEFUL_SECONDS', '30'))
+# 單一請求的處理時間上限 (超過時重新啟動工作行程)，預設與 Cloud Function 逾時相同並加上保留時間
+SERVER_TIMEOUT_SECONDS = int(os.getenv('SERVER_TIMEOUT_SECONDS', '90'))
+SERVER_REUSE_PORT = os.getenv('SERVER_REUSE_PORT', 'false').lower() == 'true'
+SERVER_KEEPALIVE_SECONDS = int(os.getenv('SERVER_KEEPALIVE_SECONDS', '5'))
+
+
+def build_options(bind: str, workers: int = SERVER_WORKERS, threads: int = SERVER_THREADS,
+                  reuse_port: bool = SERVER_REUSE_PORT,
+                  on_worker_start: Optional[Callable[[], None]] = None,
+                  on_worker_exit: Optional[Callable[[], None]] = None) -> dict:
+    """
+    建立 gunicorn 設定
+
+    Args:
+        bind: 監聽位址 (host:port)
+        workers: 工作行程數
+        threads: 每個工作行程的執行緒數
+        reuse_port: 是否設定 SO_REUSEPORT
+        on_worker_start: 工作行程 fork 後執行 (初始化客戶端)
+        on_worker_exit: 工作行程結束前執行 (送出累積的通知、等待背景下載)
+    """
+    options = {
+        'bind': bind,
+        'workers': max(1, workers),
+        'threads': max(1, threads),
+        'worker_class': 'gthread',
+        'graceful_timeout': SERVER_GRACEFUL_SECONDS,
+        'timeout': SERVER_TIMEOUT_SECONDS,
+        'keepalive': SERVER_KEEPALIVE_SECONDS,
+        'reuse_port': reuse_port,
+        'accesslog': None,
+    }
+    if on_worker_start:
+        options['post_fork'] = lambda server, worker: on_worker_start()
+    if on_worker_exit:
+        options['worker_exit'] = lambda server, worker: on_worker_exit()
+    return options
+
+
+def serve(wsgi_app, bind: str, **kwargs):
+    """
+    以預先 fork 的多工作行程啟動 WSGI 應用程式 (阻塞直到主行程結束)
+
+    Args:
+        wsgi_app: 已載入的 WSGI 應用程式 (主行程載入後由工作行程沿用)
+        bind: 監聽位址 (host:port)
+        kwargs: 見 build_options
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise ImportError("正式服務模式需要 gunicorn，請執行: pip install gunicorn")
+
+    options = build_options(bind, **kwargs)
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return wsgi_app
+
+    print(f"🚀 正式服務模式: {bind}，{options['workers']} 個工作行程 x {options['threads']} 個執行緒"
+          f"{'，SO_REUSEPORT' if options['reuse_port'] else ''}")
+    _Application().run()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # 主行程載入時不預熱 (客戶端與執行緒無法跨 fork 沿用)，由工作行程在 fork 後預熱
+    os.environ['SERVER_MODE'] = 'prefork'
+    import main
+
+    serve(main.app, f"0.0.0.0:{main.settings.port}",
+          on_worker_start=main.init_worker, on_worker_exit=main.drain_worker)